@@ -0,0 +1,125 @@
+"""
+Compression Benchmark
+
+Compares the compressed chunk format of :mod:`website.compression` with the
+JSON recordings of the control application: compression ratio (against the
+JSON file and against raw float64 columns), encode and decode throughput
+for each codec, level and predictor order, and the time to read a 10 s
+window of EEG from a compressed file.
+
+The synthetic recording mimics the Muse streams: quantized EEG (12-bit,
+0.488 uV steps) with slow drifts, smooth accelerometer/gyroscope/PPG
+signals and LSL timestamps that are linear within the 12-sample chunks
+sent by the headset, with jitter between chunks.
+
+Usage:
+    python benchmarks/compression.py [minutes]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy import signal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from website.compression import CompressedRecording, ChunkWriter, write_recording  # noqa: E402
+from website.recordings import STREAM_CHANNELS, STREAM_RATES  # noqa: E402
+
+# (codec, level) pairs to compare
+SETTINGS = (('zlib', 1), ('zlib', 6), ('lzma', 0), ('lzma', 6))
+# (timestamp order, value order) pairs to compare
+ORDERS = ((0, 0), (1, 0), (2, 0), (1, 1), (2, 2))
+
+
+def synthetic_streams(minutes):
+    """Return stream name -> (timestamps, values) arrays of a synthetic recording."""
+    rng = np.random.default_rng(0)
+    streams = {}
+    for stream, channels in STREAM_CHANNELS.items():
+        rate = STREAM_RATES[stream]
+        n = int(rate * 60 * minutes)
+        # The Muse sends chunks of 12 samples, timestamped linearly within
+        # a chunk from the chunk's (jittered) arrival time
+        offsets = np.repeat(rng.normal(0, 1e-3, n // 12 + 1), 12)[:n]
+        timestamps = 1000.0 + np.arange(n) / rate + offsets
+        # Band-limited signal: a leaky random walk plus a little white noise
+        drift = signal.lfilter([1.0], [1.0, -0.95], rng.normal(0, 3, (n, len(channels))), axis=0)
+        if stream == 'eeg':
+            values = np.round((800 + drift + rng.normal(0, 2, drift.shape)) / 0.48828125) * 0.48828125
+        else:
+            values = drift * 0.01
+        streams[stream] = (timestamps, values)
+    return streams
+
+
+def to_recorded_data(streams, minutes):
+    """Convert synthetic streams to the in-memory format of the control application."""
+    data = {stream: [{"timestamp": t, "values": v} for t, v in zip(timestamps.tolist(), values.tolist())]
+            for stream, (timestamps, values) in streams.items()}
+    data["markers"] = [{"timestamp": 1000.0 + i, "values": [f"onset:stimulus_{i}"], "stream": "NeuroCue"}
+                       for i in range(int(60 * minutes))]
+    return data
+
+
+def main(minutes):
+    directory = tempfile.mkdtemp()
+    try:
+        streams = synthetic_streams(minutes)
+        recorded_data = to_recorded_data(streams, minutes)
+        raw_bytes = sum(t.nbytes + v.nbytes for t, v in streams.values())
+
+        json_path = os.path.join(directory, "recorded_data_benchmark.json")
+        start = time.perf_counter()
+        with open(json_path, "w") as f:
+            json.dump(recorded_data, f, indent=4)
+        json_seconds = time.perf_counter() - start
+        json_bytes = os.path.getsize(json_path)
+        print(f"Recording: {minutes} min, raw float64 {raw_bytes / 1e6:.1f} MB, "
+              f"JSON {json_bytes / 1e6:.1f} MB (written in {json_seconds:.2f} s)")
+        print(f"    {'codec':8s} {'orders':>5s} {'size MB':>8s} {'vs JSON':>8s} {'vs raw':>7s} "
+              f"{'encode MB/s':>12s} {'decode MB/s':>12s}")
+
+        path = os.path.join(directory, "recorded_data_benchmark.ncz")
+        for codec, level in SETTINGS:
+            for timestamp_order, value_order in ORDERS:
+                start = time.perf_counter()
+                with ChunkWriter(path, codec, level, timestamp_order, value_order) as writer:
+                    for stream, (timestamps, values) in streams.items():
+                        writer.append(stream, timestamps, values)
+                encode_seconds = time.perf_counter() - start
+                size = os.path.getsize(path)
+
+                start = time.perf_counter()
+                recording = CompressedRecording(path)
+                for stream, (timestamps, values) in streams.items():
+                    decoded_timestamps, decoded_values = recording.read(stream)
+                    assert np.array_equal(decoded_timestamps, timestamps)
+                    assert np.array_equal(decoded_values, values)
+                decode_seconds = time.perf_counter() - start
+
+                print(f"    {codec}-{level:<3d} {timestamp_order:>3d}/{value_order:<1d} {size / 1e6:8.2f} {json_bytes / size:7.1f}x "
+                      f"{raw_bytes / size:6.2f}x {raw_bytes / 1e6 / encode_seconds:12.1f} "
+                      f"{raw_bytes / 1e6 / decode_seconds:12.1f}")
+
+        # End-to-end save from the in-memory lists (what stop_recording does) and random access
+        start = time.perf_counter()
+        write_recording(path, recorded_data)
+        print(f"write_recording (defaults): {time.perf_counter() - start:.2f} s "
+              f"vs json.dump {json_seconds:.2f} s")
+        recording = CompressedRecording(path)
+        middle = 1000.0 + 30 * minutes
+        start = time.perf_counter()
+        timestamps, _ = recording.read('eeg', middle, middle + 10)
+        print(f"10 s EEG window ({len(timestamps)} samples): {(time.perf_counter() - start) * 1000:.2f} ms")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,108 @@
+"""
+Import-Time Benchmark
+
+Runs ``python -X importtime -c "import <module>"`` for the control
+application and the child programs and reports the total import time, the
+slowest top-level imports and the peak resident memory of each interpreter.
+Heavy packages (OpenCV, VLC, matplotlib, pylsl) should only show up for the
+child program that actually uses them.
+
+Usage:
+    python benchmarks/import_time.py [module ...]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ("website.app", "website.p1", "website.p2", "website.p4")
+TOP_N = 10
+
+# Prints the peak RSS of the interpreter after the import (kB on Linux, bytes on macOS)
+RSS_SNIPPET = (
+    "import {module}\n"
+    "try:\n"
+    "    import resource, sys\n"
+    "    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+    "    print(rss // 1024 if sys.platform == 'darwin' else rss)\n"
+    "except ImportError:\n"
+    "    print(-1)\n"
+)
+
+
+def parse_importtime(stderr):
+    """
+    Parse the ``-X importtime`` output.
+
+    Args:
+        stderr (str): Standard error of the interpreter.
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) per imported module.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return entries
+
+
+def measure(module):
+    """
+    Import a module in a fresh interpreter and measure it.
+
+    Args:
+        module (str): Module to import, e.g. ``website.app``.
+
+    Returns:
+        dict: ``module``, ``ok``, ``wall_ms``, ``import_ms``, ``modules``,
+        ``max_rss_kb`` and ``top`` (slowest imports one level down), or ``error``.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RSS_SNIPPET.format(module=module)],
+        capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        return {'module': module, 'ok': False, 'error': result.stderr.strip().splitlines()[-1:]}
+
+    entries = parse_importtime(result.stderr)
+    # Depth 0 are the imports made directly by the interpreter or the -c
+    # statement, depth 1 the packages those pull in
+    top_level = [entry for entry in entries if entry[3] == 0]
+    direct = sorted((entry for entry in entries if entry[3] == 1), key=lambda entry: entry[2], reverse=True)
+    return {
+        'module': module,
+        'ok': True,
+        'wall_ms': wall_ms,
+        'import_ms': sum(entry[2] for entry in top_level) / 1000,
+        'modules': len(entries),
+        'max_rss_kb': int(result.stdout.strip().splitlines()[-1]),
+        'top': [(name, cumulative / 1000) for name, _, cumulative, _ in direct[:TOP_N]]
+    }
+
+
+def main(modules):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(root)
+    for module in modules:
+        report = measure(module)
+        if not report['ok']:
+            print(f"{module}: import failed {report['error']}")
+            continue
+        print(f"{module}: {report['import_ms']:.1f} ms import, {report['wall_ms']:.1f} ms interpreter wall time, "
+              f"{report['modules']} modules, peak RSS {report['max_rss_kb'] / 1024:.1f} MB")
+        for name, cumulative_ms in report['top']:
+            print(f"    {cumulative_ms:9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or DEFAULT_MODULES)
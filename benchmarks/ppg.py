@@ -0,0 +1,100 @@
+"""
+PPG Beat Detection Check
+
+Feeds synthetic PPG recordings through :class:`website.ppg.HeartRateMonitor`
+in 12-sample chunks, like the Muse sends them, and checks that the monitor
+recovers from the two situations that used to lock it up:
+
+- ``rate_step``: the heart rate steps from 60 to 95 bpm and stays there;
+  the reported heart rate has to follow within a few beats.
+- ``artifact``: a +8000 step in the raw signal (a motion artifact) raises
+  the peak amplitude; beats have to be detected again shortly after.
+
+Reports the final metrics of each scenario and exits with a non-zero status
+if one fails.
+
+Usage:
+    python benchmarks/ppg.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from website.ppg import HeartRateMonitor  # noqa: E402
+from website.recordings import STREAM_CHANNELS, STREAM_RATES  # noqa: E402
+
+DURATION = 180.0  # seconds per scenario
+EVENT_TIME = 60.0  # seconds, time of the rate step or artifact
+RECOVERY = 15.0  # seconds of beats (at 60 bpm) that may be missed after the artifact
+MAX_REJECTED = 5  # intervals that may be rejected after the rate step
+CHUNK = 12  # samples per chunk
+
+
+def synthetic_ppg(rates, artifact_at=None, seed=0):
+    """
+    Return (timestamps, values) of a synthetic PPG recording.
+
+    Args:
+        rates (callable): Heart rate in bpm at a time in seconds.
+        artifact_at (float, optional): Time of a +8000 step in the signal.
+        seed (int): Seed of the noise.
+    """
+    rng = np.random.default_rng(seed)
+    sfreq = STREAM_RATES['ppg']
+    timestamps = 1000.0 + np.arange(int(DURATION * sfreq)) / sfreq
+    t = timestamps - timestamps[0]
+    phase = 2 * np.pi * np.cumsum([rates(time_) / 60.0 for time_ in t]) / sfreq
+    pulse = 100.0 * (np.sin(phase) + 0.3 * np.sin(2 * phase + 0.8))
+    signal = 50000.0 + pulse + rng.normal(0, 2.0, len(t))
+    if artifact_at is not None:
+        signal[t >= artifact_at] += 8000.0
+    values = np.tile(signal[:, None], (1, len(STREAM_CHANNELS['ppg'])))
+    return timestamps, values
+
+
+def run(timestamps, values):
+    """Feed a recording through a monitor in chunks and return the monitor."""
+    monitor = HeartRateMonitor(STREAM_RATES['ppg'], STREAM_CHANNELS['ppg'], shared=False)
+    for start in range(0, len(timestamps), CHUNK):
+        monitor.process(timestamps[start:start + CHUNK], values[start:start + CHUNK])
+    return monitor
+
+
+def check_rate_step():
+    timestamps, values = synthetic_ppg(lambda t: 60.0 if t < EVENT_TIME else 95.0)
+    monitor = run(timestamps, values)
+    # Only the few intervals around the step may be rejected
+    ok = abs(monitor.metrics['heart_rate'] - 95.0) < 3.0 and monitor.metrics['rejected'] <= MAX_REJECTED
+    return ok, monitor
+
+
+def check_artifact():
+    timestamps, values = synthetic_ppg(lambda t: 60.0, artifact_at=EVENT_TIME)
+    monitor = run(timestamps, values)
+    # At most the beats of the recovery window may be missed, and beats are found up to the end
+    ok = monitor.metrics['beats'] >= DURATION - RECOVERY and \
+        monitor.metrics['last_beat'] - timestamps[0] > DURATION - 2.0 and \
+        abs(monitor.metrics['heart_rate'] - 60.0) < 3.0
+    return ok, monitor
+
+
+def main():
+    failed = []
+    for name, check in (('rate_step', check_rate_step), ('artifact', check_artifact)):
+        ok, monitor = check()
+        metrics = monitor.metrics
+        print(f"{name:>10}: {'ok' if ok else 'FAILED'}  heart rate {metrics['heart_rate']:.1f} bpm, "
+              f"beats {metrics['beats']}, rejected {metrics['rejected']}, "
+              f"last beat at {metrics['last_beat'] - 1000.0:.1f} s")
+        if not ok:
+            failed.append(name)
+    if failed:
+        sys.exit(f"Failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
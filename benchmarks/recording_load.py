@@ -0,0 +1,82 @@
+"""
+Recording Load Benchmark
+
+Writes a synthetic ``recorded_data_*.json`` file in the format of the
+control application (``indent=4``) and compares the time to get its EEG
+into numpy arrays with ``json.load``, with the streaming converter, and
+from the columnar cache, plus the peak Python memory of each (measured in a
+second run with ``tracemalloc``).
+
+Usage:
+    python benchmarks/recording_load.py [minutes]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from website.recordings import STREAM_CHANNELS, STREAM_RATES, convert_recording, load_recording  # noqa: E402
+
+
+def write_recording(path, minutes):
+    """Write a synthetic recording of ``minutes`` minutes of all Muse streams."""
+    rng = np.random.default_rng(0)
+    data = {}
+    for stream, channels in STREAM_CHANNELS.items():
+        n = int(STREAM_RATES[stream] * 60 * minutes)
+        timestamps = 1000.0 + np.arange(n) / STREAM_RATES[stream]
+        values = rng.normal(0, 100, (n, len(channels)))
+        data[stream] = [{"timestamp": t, "values": v} for t, v in zip(timestamps.tolist(), values.tolist())]
+    data["markers"] = [{"timestamp": 1000.0 + i, "values": [f"onset:stimulus_{i}"], "stream": "NeuroCue"}
+                       for i in range(int(60 * minutes))]
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+
+
+def timed(function):
+    """Return the wall time of a call and the peak memory of a second call."""
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(minutes):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "recorded_data_benchmark.json")
+        write_recording(path, minutes)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"Recording: {minutes} min, {size_mb:.1f} MB")
+
+        def with_json_load():
+            with open(path) as f:
+                data = json.load(f)
+            return np.array([sample["values"] for sample in data["eeg"]])
+
+        results = (
+            ("json.load", timed(with_json_load)),
+            ("streaming convert", timed(lambda: convert_recording(path))),
+            ("cached load", timed(lambda: np.asarray(load_recording(path)["eeg"]["values"]).sum()))
+        )
+        for name, (seconds, peak) in results:
+            print(f"    {name:18s} {seconds * 1000:9.1f} ms  {size_mb / seconds:8.1f} MB/s  "
+                  f"peak {peak / 1e6:7.1f} MB")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 10)
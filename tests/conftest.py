@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from website import clock
+from website.recordings import STREAM_CHANNELS, STREAM_RATES
+
+
+def synthetic_streams(seconds, seed=0):
+    """Return stream name -> (timestamps, values) of a synthetic Muse recording."""
+    rng = np.random.default_rng(seed)
+    streams = {}
+    for stream, channels in STREAM_CHANNELS.items():
+        n = int(STREAM_RATES[stream] * seconds)
+        streams[stream] = (1000.0 + np.arange(n) / STREAM_RATES[stream], rng.normal(0.0, 20.0, (n, len(channels))))
+    return streams
+
+
+def recorded_data(streams, markers=()):
+    """Return streams and (timestamp, text) markers in the control application's in-memory format."""
+    data = {stream: [{"timestamp": t, "values": v} for t, v in zip(timestamps.tolist(), values.tolist())]
+            for stream, (timestamps, values) in streams.items()}
+    data["markers"] = [{"timestamp": t, "values": [text], "stream": "NeuroCue"} for t, text in markers]
+    return data
+
+
+@pytest.fixture
+def write_recording(tmp_path):
+    """Write ``recorded_data_*.json`` (or ``.ncz``) files as the control application does."""
+    def write(streams, markers=(), name="recorded_data_20250101_120000.json"):
+        path = str(tmp_path / name)
+        if name.endswith(".ncz"):
+            from website.compression import write_recording as write_compressed
+            write_compressed(path, recorded_data(streams, markers))
+        else:
+            with open(path, "w") as f:
+                json.dump(recorded_data(streams, markers), f, indent=4)
+        return path
+    return write
+
+
+@pytest.fixture
+def project_clock(monkeypatch):
+    """Run the project clock on ``time.monotonic``, like pylsl's ``local_clock``, without an LSL runtime."""
+    monkeypatch.setattr(clock, "_local_clock", time.monotonic)
+    monkeypatch.setattr(clock, "_wall_offset", None)
+    return clock
@@ -0,0 +1,65 @@
+import numpy as np
+
+from conftest import synthetic_streams
+from website.artifacts import ArtifactLog, BlinkDetector, EventTracker, MotionDetector
+from website.recordings import STREAM_CHANNELS, STREAM_RATES
+
+CHUNK = 12  # samples per chunk, like the Muse sends them
+
+
+def run(detector, timestamps, values):
+    for start in range(0, len(timestamps), CHUNK):
+        detector.process(timestamps[start:start + CHUNK], values[start:start + CHUNK])
+
+
+def test_event_tracker_across_chunks():
+    tracker = EventTracker(min_duration=0.02)
+    timestamps = np.arange(20) / 100.0
+    mask = np.zeros(20, dtype=bool)
+    mask[3:5] = True  # 20 ms
+    mask[8:15] = True  # crosses the chunk boundary
+    amplitude = np.arange(20, dtype=np.float64)
+    events = tracker.update(timestamps[:10], mask[:10], amplitude[:10])
+    assert events == [(0.03, 0.05, 4.0)]
+    assert tracker.active
+    events = tracker.update(timestamps[10:], mask[10:], amplitude[10:])
+    assert events == [(0.08, 0.15, 14.0)]
+    assert not tracker.active
+
+
+def test_blink_detector():
+    timestamps, values = synthetic_streams(6)['eeg']
+    sfreq = STREAM_RATES['eeg']
+    blink = np.arange(int(0.2 * sfreq))
+    onset = int(3.0 * sfreq)
+    for channel in ('AF7', 'AF8'):
+        values[onset + blink, STREAM_CHANNELS['eeg'].index(channel)] += 150.0 * np.sin(np.pi * blink / len(blink))
+    log = ArtifactLog()
+    events = []
+    log.listeners.append(events.append)
+    detector = BlinkDetector(log, sfreq, STREAM_CHANNELS['eeg'])
+    run(detector, timestamps, values)
+    assert [event['type'] for event in events] == ['blink']
+    assert 1002.9 < events[0]['onset'] < events[0]['offset'] < 1003.3
+    assert detector.status()['events'] == 1
+    assert log.recent(since=events[0]['offset']) == []
+
+
+def test_no_blinks_in_background_eeg():
+    timestamps, values = synthetic_streams(6)['eeg']
+    log = ArtifactLog()
+    run(BlinkDetector(log, STREAM_RATES['eeg'], STREAM_CHANNELS['eeg']), timestamps, values)
+    assert log.recent() == []
+
+
+def test_motion_detector():
+    sfreq = STREAM_RATES['gyro']
+    timestamps = 1000.0 + np.arange(int(6 * sfreq)) / sfreq
+    values = np.random.default_rng(0).normal(0.0, 1.0, (len(timestamps), 3))
+    turn = (timestamps >= 1002.0) & (timestamps < 1003.0)
+    values[turn, 2] += 60.0
+    log = ArtifactLog()
+    run(MotionDetector(log, 'gyro', sfreq), timestamps, values)
+    events = log.recent()
+    assert [(event['type'], event['source']) for event in events] == [('head_motion', 'gyro')]
+    assert 1001.9 < events[0]['onset'] < 1002.3
@@ -0,0 +1,36 @@
+import json
+
+import numpy as np
+
+from conftest import synthetic_streams
+from website.batch import needs_finalize, process_session
+from website.session import Session
+
+PARAMS = {'l_freq': 1.0, 'h_freq': 40.0, 'tmin': -0.1, 'tmax': 0.3, 'baseline': None}
+
+
+def write_log(session, onsets):
+    entries = [{'file_shown': f"stimulus_{i}.png", 'timestamp': 1.7e9 + t, 'lsl_timestamp': 1000.0 + t}
+               for i, t in enumerate(onsets)]
+    with open(session.file_path("image_stimuli_start_time_20250101_120000.json"), 'w') as f:
+        json.dump(entries, f)
+
+
+def test_changed_inputs_rebuild_the_alignment(tmp_path, write_recording, project_clock):
+    session_dir = tmp_path / "20250101_120000"
+    session_dir.mkdir()
+    write_recording(synthetic_streams(10), name="20250101_120000/recorded_data_20250101_120000.json")
+    session = Session(str(session_dir))
+    write_log(session, [1.0, 2.0])
+    assert process_session(session.path, PARAMS)['trials'] == 2
+    assert not needs_finalize(Session(session.path))
+
+    # A log that changes after finalizing must not be epoched against the old alignment
+    write_log(session, [1.0, 2.0, 3.0, 4.0])
+    assert needs_finalize(Session(session.path))
+    result = process_session(session.path, PARAMS)
+    assert result['status'] == 'processed', result['error']
+    assert result['trials'] == 4
+    assert len(Session(session.path).load_alignment()['events']) == 4
+    epochs = np.load(session_dir / "processed" / "epochs.npz")
+    assert len(epochs['labels']) == 4
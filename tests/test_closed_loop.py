@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from website.closed_loop import ClosedLoopTrigger
+
+
+class Feature:
+    """Passes the first channel through as the feature."""
+    name = "test"
+    unit = ""
+
+    def update(self, timestamps, values):
+        return timestamps, values[:, 0]
+
+
+def make_trigger(sent, **kwargs):
+    return ClosedLoopTrigger(Feature(), 1.0, sent.append, refractory=0.5, **kwargs)
+
+
+def test_fires_on_crossings_with_refractory():
+    sent = []
+    trigger = make_trigger(sent)
+    trigger.start()
+    t = np.arange(0, 3, 0.1)
+    feature = np.where((t % 1.0) < 0.5, 0.0, 2.0)  # crosses upward at 0.5, 1.5, 2.5 s
+    trigger.process(t, feature[:, None])
+    assert [round(s['sample_time'], 6) for s in sent] == [0.5, 1.5, 2.5]
+    assert trigger.triggers == 3
+
+
+def test_no_triggers_when_stopped():
+    sent = []
+    trigger = make_trigger(sent)
+    trigger.process(np.arange(0, 1, 0.1), np.array([0, 2] * 5, dtype=float)[:, None])
+    assert sent == []
+
+
+@pytest.mark.parametrize("threshold, direction", [("high", None), ({}, None), (None, "sideways")])
+def test_start_rejects_bad_parameters(threshold, direction):
+    trigger = make_trigger([])
+    with pytest.raises(ValueError):
+        trigger.start(threshold, direction)
+    assert not trigger.active
+    assert trigger.threshold == 1.0 and trigger.direction == 'above'
+
+
+def test_start_coerces_threshold():
+    trigger = make_trigger([])
+    trigger.start("2.5", "below")
+    assert trigger.threshold == 2.5 and trigger.direction == 'below' and trigger.active
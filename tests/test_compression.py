@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from conftest import synthetic_streams
+from website.compression import ChunkWriter, CompressedRecording, decode_column, encode_column
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+@pytest.mark.parametrize("order", [0, 1, 2])
+def test_column_roundtrip_is_bit_exact(codec, order):
+    values = np.concatenate([np.random.default_rng(0).normal(0.0, 20.0, 500), [np.nan, np.inf, -0.0, 1e308]])
+    decoded = decode_column(encode_column(values, codec, 1, order), len(values), codec, order)
+    assert decoded.tobytes() == values.tobytes()
+
+
+def test_chunked_write_and_range_read(tmp_path):
+    timestamps, values = synthetic_streams(10)['eeg']
+    path = str(tmp_path / "recording.ncz")
+    markers = [{'timestamp': 1001.0, 'values': ["onset:a.png"], 'stream': "NeuroCue"}]
+    with ChunkWriter(path, chunk_samples=300) as writer:
+        # Pieces that do not line up with the chunks
+        for start in range(0, len(timestamps), 77):
+            writer.append('eeg', timestamps[start:start + 77], values[start:start + 77])
+        writer.close(markers)
+
+    recording = CompressedRecording(path)
+    assert recording.channels == {'eeg': values.shape[1]}
+    assert [chunk['samples'] for chunk in recording.chunks] == [300] * 8 + [160]
+    assert recording.markers == markers
+    assert recording.first_timestamp('eeg') == timestamps[0]
+    assert recording.first_timestamp('ppg') is None
+
+    read_timestamps, read_values = recording.read('eeg')
+    assert np.array_equal(read_timestamps, timestamps)
+    assert np.array_equal(read_values, values)
+
+    read_timestamps, read_values = recording.read('eeg', 1003.0, 1004.0)
+    keep = (timestamps >= 1003.0) & (timestamps <= 1004.0)
+    assert np.array_equal(read_timestamps, timestamps[keep])
+    assert np.array_equal(read_values, values[keep])
+
+    assert len(recording.read('ppg')[0]) == 0
+
+
+def test_not_a_compressed_recording(tmp_path):
+    path = tmp_path / "recording.ncz"
+    path.write_bytes(b"{}" + bytes(8))
+    with pytest.raises(ValueError):
+        CompressedRecording(str(path))
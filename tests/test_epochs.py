@@ -0,0 +1,48 @@
+import json
+
+import numpy as np
+
+from conftest import synthetic_streams
+from website.epochs import extract_epochs, load_epochs
+
+
+def test_extract_epochs_windows_and_baseline():
+    values = np.arange(100, dtype=np.float64)[:, None] * [1.0, -1.0]
+    epochs, kept = extract_epochs(values, [2, 50, 97, -1], -5, 5)
+    assert kept.tolist() == [False, True, False, False]
+    assert epochs.shape == (1, 2, 10)
+    assert np.array_equal(epochs[0, 0], np.arange(45, 55))
+    assert np.array_equal(epochs[0, 1], -np.arange(45, 55))
+
+    epochs, _ = extract_epochs(values, [50], -5, 5, baseline=(-5, 0))
+    assert np.allclose(epochs[0, 0], np.arange(10) - 2.0)
+
+
+def test_load_epochs(tmp_path, write_recording, project_clock):
+    session_dir = tmp_path / "20250101_120000"
+    session_dir.mkdir()
+    streams = synthetic_streams(10)
+    write_recording(streams, name="20250101_120000/recorded_data_20250101_120000.json")
+    onsets = {"initial_delay_0": 0.5, "a.png": 2.0, "b.png": 5.0, "late.png": 9.9}
+    with open(session_dir / "image_stimuli_start_time_20250101_120000.json", 'w') as f:
+        json.dump([{'file_shown': label, 'timestamp': 1.7e9 + t, 'lsl_timestamp': 1000.0 + t}
+                   for label, t in onsets.items()], f)
+
+    epochs = load_epochs(str(session_dir), tmin=-0.1, tmax=0.3)
+    # The countdown step is left out, the last event has no complete window
+    assert epochs['labels'] == ["a.png", "b.png"]
+    assert epochs['dropped'] == 1
+    assert epochs['data'].shape == (2, 4, len(epochs['times']))
+    start = int(round(-0.1 * 256))
+    assert np.isclose(epochs['times'][0], start / 256)
+    assert np.allclose(epochs['data'][0], streams['eeg'][1][512 + start:512 + start + len(epochs['times'])].T)
+    assert np.allclose(epochs['event_times'], [1002.0, 1005.0])
+
+    # The second call is served from the session cache
+    cached = load_epochs(str(session_dir), tmin=-0.1, tmax=0.3)
+    assert len(list((session_dir / "cache").glob("epochs_eeg_*.npz"))) == 1
+    assert cached['labels'] == epochs['labels']
+    assert np.array_equal(cached['data'], epochs['data'])
+
+    only_b = load_epochs(str(session_dir), tmin=-0.1, tmax=0.3, labels=["b.png"], use_cache=False)
+    assert only_b['labels'] == ["b.png"]
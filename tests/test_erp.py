@@ -0,0 +1,66 @@
+import numpy as np
+
+from conftest import synthetic_streams
+from website.erp import OnlineERP, OnsetListener, shared_arrays
+from website.recordings import STREAM_CHANNELS, STREAM_RATES
+
+CHUNK = 12  # samples per chunk, like the Muse sends them
+
+
+def test_online_average_of_early_onsets():
+    sfreq = STREAM_RATES['eeg']
+    timestamps, values = synthetic_streams(20)['eeg']
+    erp = OnlineERP(sfreq, STREAM_CHANNELS['eeg'], condition=lambda label: label.split('/')[0])
+    try:
+        # A positive response 300 ms after every "faces" onset
+        onsets = 1001.0 + np.arange(16)
+        response = 50.0 * np.exp(-((erp.times - 0.3) / 0.05) ** 2)
+        for i, onset in enumerate(onsets):
+            index = int(np.searchsorted(timestamps, onset))
+            if i % 2 == 0:
+                values[index + erp.start:index + erp.stop] += response[:, None]
+        # Onsets arrive before the samples of their window
+        listener = OnsetListener(erp)
+        listener.process([1000.2], [["onset:initial_delay_0"]])
+        listener.process(onsets, [[f"onset:{'faces' if i % 2 == 0 else 'houses'}/{i}.png"]
+                                  for i in range(len(onsets))])
+        listener.process([1000.4], [["offset:faces/0.png"]])
+        for start in range(0, len(timestamps), CHUNK):
+            erp.process(timestamps[start:start + CHUNK], values[start:start + CHUNK])
+
+        status = erp.status()
+        assert list(status['conditions']) == ['faces', 'houses']
+        assert status['conditions']['faces']['count'] == 8
+        assert status['pending'] == 0 and status['missed'] == 0
+        faces = np.array(status['conditions']['faces']['mean'])
+        houses = np.array(status['conditions']['houses']['mean'])
+        peak = int(np.argmax(response))
+        assert np.all(faces[:, peak] > 30.0)
+        assert np.all(np.abs(houses[:, peak]) < 25.0)
+
+        means, counts = shared_arrays(erp.shm.buf, len(STREAM_CHANNELS['eeg']), len(erp.times))
+        assert counts[:3].tolist() == [8.0, 8.0, 0.0]
+        assert np.allclose(means[0], faces)
+    finally:
+        erp.close()
+
+
+def test_late_onset_is_missed():
+    sfreq = STREAM_RATES['eeg']
+    timestamps, values = synthetic_streams(10)['eeg']
+    erp = OnlineERP(sfreq, STREAM_CHANNELS['eeg'], shared=False)
+    erp.process(timestamps, values)
+    # The window of 1001.0 left the 5 s ring long ago
+    erp.add_onset(1001.0, "a.png")
+    erp.add_onset(1008.0, "b.png")
+    erp.process(timestamps[-1:] + 1.0 / sfreq, values[-1:])
+    status = erp.status()
+    assert status['missed'] == 1
+    assert status['conditions']['b.png']['count'] == 1
+    assert status['conditions']['b.png']['std'][0][0] is None
+    # Baseline correction leaves a zero-mean pre-stimulus interval
+    mean = np.array(status['conditions']['b.png']['mean'])
+    assert np.allclose(mean[:, :-erp.start].mean(axis=1), 0.0)
+
+    erp.reset()
+    assert erp.status()['conditions'] == {}
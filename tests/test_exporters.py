@@ -0,0 +1,147 @@
+import struct
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+from conftest import synthetic_streams
+from website.exporters import (XDF_BOUNDARY, XDF_FILE_HEADER, XDF_SAMPLES, XDF_STREAM_FOOTER, XDF_STREAM_HEADER,
+                               export_edf, export_xdf)
+from website.recordings import EEG_RANGE, STREAM_CHANNELS
+
+
+def read_edf_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(256)
+        n_signals = int(header[252:256])
+        signals = f.read(256 * n_signals)
+    fields = {'version': header[:8], 'records': int(header[236:244]), 'duration': float(header[244:252]),
+              'signals': n_signals}
+    offset = 0
+    for name, width in (('labels', 16), ('transducers', 80), ('units', 8), ('physical_min', 8),
+                        ('physical_max', 8), ('digital_min', 8), ('digital_max', 8), ('prefilter', 80),
+                        ('samples', 8), ('reserved', 32)):
+        fields[name] = [signals[offset + i * width:offset + (i + 1) * width].decode().strip()
+                        for i in range(n_signals)]
+        offset += width * n_signals
+    return fields
+
+
+def read_count(data, offset):
+    width = data[offset]
+    return int.from_bytes(data[offset + 1:offset + 1 + width], 'little'), offset + 1 + width
+
+
+def read_xdf(path):
+    """Return the header, footer and samples of every stream of an XDF file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:4] == b"XDF:"
+    offset, streams, tags = 4, {}, []
+    while offset < len(data):
+        length, offset = read_count(data, offset)
+        tag, content = struct.unpack('<H', data[offset:offset + 2])[0], data[offset + 2:offset + length]
+        offset += length
+        tags.append(tag)
+        if tag in (XDF_FILE_HEADER, XDF_BOUNDARY):
+            continue
+        stream_id = struct.unpack('<I', content[:4])[0]
+        stream = streams.setdefault(stream_id, {'timestamps': [], 'values': []})
+        if tag == XDF_STREAM_HEADER:
+            stream['header'] = ElementTree.fromstring(content[4:])
+        elif tag == XDF_STREAM_FOOTER:
+            stream['footer'] = ElementTree.fromstring(content[4:])
+        elif tag == XDF_SAMPLES:
+            n, position = read_count(content, 4)
+            channels = int(stream['header'].find('channel_count').text)
+            numeric = stream['header'].find('channel_format').text == 'float32'
+            for _ in range(n):
+                assert content[position] == 8
+                stream['timestamps'].append(struct.unpack('<d', content[position + 1:position + 9])[0])
+                position += 9
+                if numeric:
+                    stream['values'].append(np.frombuffer(content[position:position + 4 * channels], '<f4'))
+                    position += 4 * channels
+                else:
+                    size, position = read_count(content, position)
+                    stream['values'].append(content[position:position + size].decode('utf-8'))
+                    position += size
+    return tags, streams
+
+
+def test_edf_header(tmp_path, write_recording):
+    path = write_recording(synthetic_streams(5), markers=[(1001.0, "onset:cat.png")])
+    result = export_edf(path, str(tmp_path / "out.edf"), annotations=[(1001.0, "cat.png")])
+    header = read_edf_header(str(tmp_path / "out.edf"))
+    assert header['version'] == b"0       "
+    assert header['records'] == result['records'] == 5
+    assert header['labels'] == ['TP9', 'AF7', 'AF8', 'TP10', 'EDF Annotations']
+    assert header['units'][:4] == ['uV'] * 4
+    assert float(header['physical_min'][0]) == EEG_RANGE[0]
+    assert header['samples'][0] == '256'
+    assert result['annotations'] == 1
+    assert result['clipped'] == {}
+
+
+def test_edf_values_roundtrip(tmp_path, write_recording):
+    streams = synthetic_streams(4)
+    path = write_recording({'eeg': streams['eeg']})
+    export_edf(path, str(tmp_path / "out.bdf"), bdf=True)
+    header = read_edf_header(str(tmp_path / "out.bdf"))
+    samples = [int(n) for n in header['samples']]
+    with open(tmp_path / "out.bdf", 'rb') as f:
+        f.seek(256 * (header['signals'] + 1))
+        record = f.read(3 * sum(samples))
+    raw = np.frombuffer(record[:3 * 256], dtype=np.uint8).reshape(-1, 3)
+    digital = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16))
+    digital = np.where(digital >= 2 ** 23, digital - 2 ** 24, digital)
+    low, high = float(header['physical_min'][0]), float(header['physical_max'][0])
+    physical = (digital + 2 ** 23) * (high - low) / (2 ** 24 - 1) + low
+    assert np.allclose(physical, streams['eeg'][1][:256, 0], atol=(high - low) / 2 ** 23)
+
+
+def test_edf_reports_clipping(tmp_path, write_recording, capsys):
+    streams = synthetic_streams(2)
+    streams['eeg'][1][10:15, 1] = 1500.0
+    path = write_recording({'eeg': streams['eeg']})
+    result = export_edf(path, str(tmp_path / "out.edf"))
+    assert result['clipped'] == {'AF7': 5}
+    assert "AF7" in capsys.readouterr().out
+
+
+def test_xdf_same_from_json_and_ncz(tmp_path, write_recording):
+    streams = synthetic_streams(3)
+    markers = [(1000.5, "onset:a.png")]
+    counts = {}
+    for extension in ("json", "ncz"):
+        path = write_recording(streams, markers, name=f"recorded_data_20250101_120000.{extension}")
+        counts[extension] = export_xdf(path, str(tmp_path / f"{extension}.xdf"))
+    assert counts['json'] == counts['ncz']
+    assert counts['json']['eeg'] == len(streams['eeg'][0])
+    assert counts['json']['markers'] == 1
+    with open(tmp_path / "json.xdf", 'rb') as f:
+        assert f.read(4) == b"XDF:"
+
+
+def test_xdf_headers_and_samples(tmp_path, write_recording):
+    streams = synthetic_streams(12)
+    path = write_recording(streams, [(1000.5, "onset:a.png")])
+    export_xdf(path, str(tmp_path / "out.xdf"), annotations=[(1001.0, "a.png"), (None, "unaligned.png")])
+    tags, xdf = read_xdf(str(tmp_path / "out.xdf"))
+    assert tags[0] == XDF_FILE_HEADER
+    assert XDF_BOUNDARY in tags
+
+    names = [stream['header'].find('name').text for stream in xdf.values()]
+    assert names == [f"Muse-{name.upper()}" for name in STREAM_CHANNELS] + ["NeuroCue-markers",
+                                                                           "NeuroCue-annotations"]
+    eeg = xdf[1]
+    assert [label.text for label in eeg['header'].iter('label')] == STREAM_CHANNELS['eeg']
+    assert float(eeg['header'].find('nominal_srate').text) == 256
+    assert np.array_equal(eeg['timestamps'], streams['eeg'][0])
+    assert np.allclose(np.array(eeg['values']), streams['eeg'][1], atol=1e-4)
+    assert int(eeg['footer'].find('sample_count').text) == len(streams['eeg'][0])
+    assert float(eeg['footer'].find('first_timestamp').text) == streams['eeg'][0][0]
+
+    assert xdf[len(STREAM_CHANNELS) + 1]['values'] == ["onset:a.png"]
+    annotations = xdf[len(STREAM_CHANNELS) + 2]
+    assert annotations['header'].find('channel_format').text == 'string'
+    assert (annotations['timestamps'], annotations['values']) == ([1001.0], ["a.png"])
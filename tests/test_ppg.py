@@ -0,0 +1,60 @@
+import numpy as np
+
+from website.ppg import HeartRateMonitor
+from website.recordings import STREAM_CHANNELS, STREAM_RATES
+
+CHUNK = 12  # samples per chunk, like the Muse sends them
+
+
+def synthetic_ppg(seconds, rate, artifact_at=None, seed=0):
+    """Return (timestamps, values) of a PPG recording whose heart rate in bpm is ``rate(t)``."""
+    rng = np.random.default_rng(seed)
+    sfreq = STREAM_RATES['ppg']
+    t = np.arange(int(seconds * sfreq)) / sfreq
+    phase = 2 * np.pi * np.cumsum([rate(time_) / 60.0 for time_ in t]) / sfreq
+    signal = 50000.0 + 100.0 * (np.sin(phase) + 0.3 * np.sin(2 * phase + 0.8)) + rng.normal(0, 2.0, len(t))
+    if artifact_at is not None:
+        signal[t >= artifact_at] += 8000.0
+    return 1000.0 + t, np.tile(signal[:, None], (1, len(STREAM_CHANNELS['ppg'])))
+
+
+def run(timestamps, values):
+    monitor = HeartRateMonitor(STREAM_RATES['ppg'], STREAM_CHANNELS['ppg'], shared=False)
+    for start in range(0, len(timestamps), CHUNK):
+        monitor.process(timestamps[start:start + CHUNK], values[start:start + CHUNK])
+    return monitor
+
+
+def test_regular_heart_rate():
+    monitor = run(*synthetic_ppg(60.0, lambda t: 72.0))
+    assert abs(monitor.metrics['heart_rate'] - 72.0) < 2.0
+    assert abs(monitor.metrics['beats'] - 72) <= 2
+    assert monitor.metrics['rejected'] == 0
+    assert monitor.metrics['rmssd_ms'] < 50.0
+    status = monitor.status()
+    assert status['shared_memory'] is None
+    assert len(status['ibis']) == monitor.metrics['beats'] - 1
+
+
+def test_follows_a_rate_step():
+    monitor = run(*synthetic_ppg(90.0, lambda t: 60.0 if t < 30.0 else 95.0))
+    assert abs(monitor.metrics['heart_rate'] - 95.0) < 3.0
+    assert monitor.metrics['rejected'] <= 5
+
+
+def test_recovers_from_an_artifact():
+    timestamps, values = synthetic_ppg(90.0, lambda t: 60.0, artifact_at=30.0)
+    monitor = run(timestamps, values)
+    assert monitor.metrics['beats'] >= 75
+    assert monitor.metrics['last_beat'] > timestamps[-1] - 2.0
+    assert abs(monitor.metrics['heart_rate'] - 60.0) < 3.0
+
+
+def test_shared_metrics():
+    monitor = HeartRateMonitor(STREAM_RATES['ppg'], STREAM_CHANNELS['ppg'])
+    try:
+        timestamps, values = synthetic_ppg(10.0, lambda t: 60.0)
+        monitor.process(timestamps, values)
+        assert monitor.shared[5] == monitor.metrics['beats'] > 0
+    finally:
+        monitor.close()
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from conftest import synthetic_streams
+from website.pyramid import LEVEL_FACTOR, PyramidBuilder, build_pyramid, load_pyramid, pyramid_dir, read_range
+
+
+def test_builder_levels_match_the_samples():
+    values = np.random.default_rng(0).normal(0.0, 20.0, (1000, 2))
+    values[17, 1] = np.nan
+    timestamps = np.arange(1000) / 256.0
+    builder = PyramidBuilder()
+    # Chunks that do not line up with the blocks
+    for start in range(0, 1000, 37):
+        builder.append(timestamps[start:start + 37], values[start:start + 37])
+    levels = builder.finish()
+    assert [len(level['timestamps']) for level in levels] == [250, 63, 16, 4, 1]
+    for k, level in enumerate(levels):
+        size = LEVEL_FACTOR ** (k + 1)
+        for block in (0, len(level['timestamps']) - 1):
+            expected = values[block * size:(block + 1) * size]
+            assert level['timestamps'][block] == timestamps[block * size]
+            assert np.array_equal(level['min'][block], np.nanmin(expected, axis=0))
+            assert np.array_equal(level['max'][block], np.nanmax(expected, axis=0))
+
+
+def test_read_range(write_recording):
+    timestamps, values = synthetic_streams(60)['eeg']
+    path = write_recording({'eeg': (timestamps, values)})
+    meta = load_pyramid(path)
+    assert meta['streams']['eeg']['samples'] == len(timestamps)
+    assert os.path.isdir(pyramid_dir(path))
+
+    overview = read_range(path, 'eeg', width=100)
+    assert overview['level'] >= 0
+    assert len(overview['timestamps']) <= 100
+    assert np.array_equal(overview['min'].min(axis=0), values.min(axis=0))
+    assert np.array_equal(overview['max'].max(axis=0), values.max(axis=0))
+
+    # A short range is returned sample by sample
+    detail = read_range(path, 'eeg', 1010.0, 1010.5, width=1000)
+    keep = (timestamps >= 1010.0) & (timestamps <= 1010.5)
+    assert detail['level'] == -1
+    assert np.allclose(detail['timestamps'], timestamps[keep])
+    assert np.allclose(detail['min'], values[keep])
+
+    # An unchanged recording is not rebuilt
+    assert load_pyramid(path) == meta
+    assert build_pyramid(path)['streams'] == meta['streams']
@@ -0,0 +1,47 @@
+import numpy as np
+
+from website.quality import SATURATION_LIMITS, stream_quality
+from website.recordings import EEG_RANGE
+
+RATE = 256
+
+
+def eeg(values):
+    timestamps = 1000.0 + np.arange(len(values)) / RATE
+    return stream_quality(timestamps, values, RATE, SATURATION_LIMITS['eeg'])
+
+
+def test_zero_mean_eeg_is_not_saturated():
+    values = np.random.default_rng(0).normal(0.0, 20.0, (RATE * 60, 4))
+    report = eeg(values)
+    assert all(channel['saturated_fraction'] == 0.0 for channel in report['channels'])
+
+
+def test_clipped_eeg_is_saturated():
+    values = np.random.default_rng(0).normal(0.0, 20.0, (RATE * 10, 4))
+    values[:RATE, 0] = EEG_RANGE[1]
+    values[RATE:2 * RATE, 1] = EEG_RANGE[0]
+    report = eeg(values)
+    assert report['channels'][0]['saturated_fraction'] == 0.1
+    assert report['channels'][1]['saturated_fraction'] == 0.1
+    assert report['channels'][2]['saturated_fraction'] == 0.0
+
+
+def test_timing_checks():
+    values = np.random.default_rng(0).normal(0.0, 20.0, (RATE * 10, 4))
+    timestamps = 1000.0 + np.arange(len(values)) / RATE
+    timestamps[RATE:] += 0.5  # a 0.5 s gap
+    timestamps[2 * RATE] = timestamps[2 * RATE - 1]  # a duplicate
+    report = stream_quality(timestamps, values, RATE)
+    assert report['gaps']['count'] == 1
+    assert abs(report['gaps']['longest_s'] - 0.5) < 1e-9
+    assert report['duplicates'] == 1
+    assert report['out_of_order'] == 0
+
+
+def test_flat_line():
+    values = np.random.default_rng(0).normal(0.0, 20.0, (RATE * 10, 4))
+    values[:2 * RATE, 3] = 5.0
+    report = stream_quality(1000.0 + np.arange(len(values)) / RATE, values, RATE)
+    assert abs(report['channels'][3]['flat_fraction'] - 0.2) < 0.01
+    assert report['channels'][0]['flat_fraction'] == 0.0
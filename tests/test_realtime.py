@@ -0,0 +1,64 @@
+import numpy as np
+
+from website.realtime import Resample, Rereference, build_stages
+
+
+def run(stages, timestamps, values, chunk):
+    """Pass a recording through configured stages in chunks and return the joined output."""
+    output_times, output = [], []
+    for start in range(0, len(timestamps), chunk):
+        t, v = timestamps[start:start + chunk], values[start:start + chunk]
+        for stage in stages:
+            t, v = stage.process(t, v)
+        output_times.append(t)
+        output.append(v)
+    return np.concatenate(output_times), np.concatenate(output)
+
+
+def configure(stages, sfreq, channels):
+    for stage in stages:
+        sfreq, channels = stage.configure(sfreq, channels)
+    return sfreq, channels
+
+
+def test_filters_are_independent_of_the_chunking():
+    sfreq, channels = 256.0, ['TP9', 'AF7', 'AF8', 'TP10']
+    timestamps = np.arange(2048) / sfreq
+    values = np.random.default_rng(0).normal(0.0, 20.0, (2048, 4)) + 100.0
+    spec = [('notch', 50.0), ('high_pass', 1.0), ('low_pass', 40.0), ('rereference', ['TP9', 'TP10'])]
+    outputs = []
+    for chunk in (12, 2048):
+        stages = build_stages(spec)
+        configure(stages, sfreq, channels)
+        outputs.append(run(stages, timestamps, values, chunk)[1])
+    assert np.allclose(outputs[0], outputs[1])
+
+
+def test_notch_and_band_edges():
+    sfreq = 256.0
+    t = np.arange(int(10 * sfreq)) / sfreq
+    for spec, freq, passed in (([('notch', 50.0)], 50.0, False), ([('notch', 50.0)], 10.0, True),
+                               ([('high_pass', 1.0)], 0.1, False), ([('low_pass', 40.0)], 80.0, False)):
+        stages = build_stages(spec)
+        configure(stages, sfreq, ['ch'])
+        _, output = run(stages, t, np.sin(2 * np.pi * freq * t)[:, None], 12)
+        amplitude = np.abs(output[len(t) // 2:]).max()
+        assert (amplitude > 0.9) if passed else (amplitude < 0.1), (spec, freq, amplitude)
+
+
+def test_rereference_to_the_common_average():
+    stage = Rereference()
+    stage.configure(256.0, ['a', 'b'])
+    _, output = stage.process(np.zeros(1), np.array([[1.0, 3.0]]))
+    assert output.tolist() == [[-1.0, 1.0]]
+
+
+def test_resample_onto_a_regular_grid():
+    stage = Resample(128.0)
+    assert stage.configure(256.0, ['ch']) == (128.0, ['ch'])
+    jitter = np.random.default_rng(0).uniform(-1e-4, 1e-4, 2560)
+    timestamps = 1000.0 + np.arange(2560) / 256.0 + jitter
+    output_times, output = run([stage], timestamps, np.full((2560, 1), 5.0), 12)
+    assert np.allclose(np.diff(output_times), 1 / 128.0)
+    assert abs(len(output_times) - 1280) <= 1
+    assert np.allclose(output, 5.0)
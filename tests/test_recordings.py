@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from conftest import synthetic_streams
+from website import recordings
+from website.recordings import STREAM_CHANNELS, first_timestamp, iter_stream_chunks, load_markers, load_recording
+
+MARKERS = [(1000.5, "onset:a.png"), (1001.5, "offset:a.png")]
+
+
+@pytest.fixture(params=["json", "ncz"])
+def recording(request, write_recording):
+    streams = synthetic_streams(3)
+    path = write_recording(streams, MARKERS, name=f"recorded_data_20250101_120000.{request.param}")
+    return path, streams
+
+
+def test_load_recording(recording):
+    path, streams = recording
+    loaded = load_recording(path)
+    for stream, (timestamps, values) in streams.items():
+        assert np.allclose(loaded[stream]['timestamps'], timestamps)
+        assert np.allclose(loaded[stream]['values'], values)
+    assert loaded['markers']['values'] == ["onset:a.png", "offset:a.png"]
+
+
+def test_iter_stream_chunks(recording):
+    path, streams = recording
+    chunks = list(iter_stream_chunks(path, 'eeg', 100))
+    assert all(len(timestamps) <= 100 for timestamps, _ in chunks)
+    assert np.allclose(np.concatenate([t for t, _ in chunks]), streams['eeg'][0])
+    assert np.allclose(np.concatenate([v for _, v in chunks]), streams['eeg'][1])
+    assert all(v.shape[1] == len(STREAM_CHANNELS['eeg']) for _, v in chunks)
+
+
+def test_first_timestamp_and_markers(recording):
+    path, streams = recording
+    assert first_timestamp(path, 'ppg') == streams['ppg'][0][0]
+    markers = load_markers(path)
+    assert np.allclose(markers['timestamps'], [t for t, _ in MARKERS])
+    assert markers['values'] == [text for _, text in MARKERS]
+
+
+def test_json_is_converted_once(write_recording, monkeypatch):
+    path = write_recording(synthetic_streams(2))
+    calls = []
+    convert = recordings.convert_recording
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return convert(*args, **kwargs)
+    monkeypatch.setattr(recordings, 'convert_recording', counted)
+    for stream in STREAM_CHANNELS:
+        first_timestamp(path, stream)
+        list(iter_stream_chunks(path, stream))
+    load_markers(path)
+    assert len(calls) == 1
+    # Later reads are memory-mapped from the cache
+    assert isinstance(load_recording(path)['eeg']['values'], np.memmap)
@@ -0,0 +1,50 @@
+import json
+
+from conftest import synthetic_streams
+from website.session import STATUS_FINALIZED, STATUS_OPEN, Session, list_sessions
+
+WALL_START = 1.7e9  # wall-clock time of LSL time 1000.0 in the synthetic session
+CAMERA_RATE = 30.0
+
+
+def write_session(session_dir, write_recording, onsets):
+    write_recording(synthetic_streams(5), name=f"{session_dir.name}/recorded_data_20250101_120000.json")
+    with open(session_dir / "image_stimuli_start_time_20250101_120000.json", 'w') as f:
+        json.dump([{'file_shown': f"stimulus_{i}.png", 'timestamp': WALL_START + t, 'lsl_timestamp': 1000.0 + t}
+                   for i, t in enumerate(onsets)], f)
+    (session_dir / "recording_start_time_20250101_120000.avi").write_bytes(b"")
+    with open(session_dir / "recording_start_time_20250101_120000_timestamps.json", 'w') as f:
+        json.dump([{'frame_number': i, 'timestamp': WALL_START + i / CAMERA_RATE} for i in range(150)], f, indent=4)
+
+
+def test_finalize_aligns_events(tmp_path, write_recording, project_clock):
+    session_dir = tmp_path / "20250101_120000"
+    session_dir.mkdir()
+    write_session(session_dir, write_recording, [1.0, 2.5, 30.0])
+    session = Session(str(session_dir))
+    assert session.manifest['status'] == STATUS_OPEN
+
+    manifest = session.finalize()
+    assert manifest['status'] == STATUS_FINALIZED
+    roles = {f['name']: f['role'] for f in manifest['files']}
+    assert roles["recorded_data_20250101_120000.json"] == 'eeg_recording'
+    assert roles["recording_start_time_20250101_120000_timestamps.json"] == 'camera_timestamps'
+    assert roles["recording_start_time_20250101_120000.avi"] == 'camera_video'
+    assert manifest['alignment'] == {'file': "alignment.json", 'events': 3, 'eeg_matched': 2, 'camera_matched': 2}
+
+    alignment = Session(str(session_dir)).load_alignment()
+    assert alignment['recordings'] == ["recorded_data_20250101_120000.json"]
+    events = alignment['events']
+    assert [event['eeg_sample'] for event in events] == [256, 640, -1]
+    assert [event['camera_frame'] for event in events] == [30, 75, -1]
+    assert [event['eeg_recording'] for event in events] == [0, 0, -1]
+    assert events[0]['label'] == "stimulus_0.png"
+
+    assert [s.session_id for s in list_sessions(str(tmp_path))] == ["20250101_120000"]
+
+
+def test_unfinalized_session_has_no_alignment(tmp_path, project_clock):
+    session = Session.create(root=str(tmp_path), label="pilot", subject_information=None)
+    assert session.session_id.endswith("pilot")
+    assert session.load_alignment() is None
+    assert Session(session.path).manifest['status'] == STATUS_OPEN
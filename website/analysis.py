@@ -0,0 +1,74 @@
+"""
+Offline Signal Analysis
+
+Filtering and spectral helpers for recorded sessions, used by the epoching
+API and the batch post-processing command. The frequency bands match the
+ones shown in the live visualization.
+"""
+
+from scipy import signal
+
+# EEG frequency bands (Hz), as in the visualization window
+FREQUENCY_BANDS = {
+    'delta': (0.5, 4),
+    'theta': (4, 8),
+    'alpha': (8, 13),
+    'beta': (13, 30),
+    'gamma': (30, 45)
+}
+
+
+def bandpass_filter(values, sfreq, l_freq=None, h_freq=None, order=4):
+    """
+    Zero-phase Butterworth filter of a recording along the sample axis.
+
+    Args:
+        values (numpy.ndarray): Samples, shape (samples, channels).
+        sfreq (float): Sample rate in Hz.
+        l_freq (float, optional): High-pass edge in Hz.
+        h_freq (float, optional): Low-pass edge in Hz.
+        order (int): Filter order.
+
+    Returns:
+        numpy.ndarray: Filtered samples. Returned unchanged if both edges are
+        None or the recording is too short to filter.
+    """
+    nyquist = sfreq / 2.0
+    if l_freq is not None and h_freq is not None:
+        sos = signal.butter(order, [l_freq / nyquist, h_freq / nyquist], btype='bandpass', output='sos')
+    elif l_freq is not None:
+        sos = signal.butter(order, l_freq / nyquist, btype='highpass', output='sos')
+    elif h_freq is not None:
+        sos = signal.butter(order, h_freq / nyquist, btype='lowpass', output='sos')
+    else:
+        return values
+    # sosfiltfilt pads the signal; shorter recordings cannot be filtered
+    if len(values) <= 3 * (2 * len(sos) + 1):
+        return values
+    return signal.sosfiltfilt(sos, values, axis=0)
+
+
+def band_powers(values, sfreq, bands=FREQUENCY_BANDS, segment_seconds=2.0):
+    """
+    Average power per frequency band and channel from Welch's periodogram.
+
+    Args:
+        values (numpy.ndarray): Samples, shape (samples, channels).
+        sfreq (float): Sample rate in Hz.
+        bands (dict): Band name -> (low, high) edges in Hz.
+        segment_seconds (float): Length of the Welch segments.
+
+    Returns:
+        dict: Band name -> list of absolute band power per channel
+        (integrated PSD), empty lists if there are no samples.
+    """
+    if len(values) == 0:
+        return {band: [] for band in bands}
+    nperseg = min(len(values), int(segment_seconds * sfreq))
+    freqs, psd = signal.welch(values, fs=sfreq, nperseg=nperseg, axis=0)
+    resolution = freqs[1] - freqs[0] if len(freqs) > 1 else 0.0
+    powers = {}
+    for band, (low, high) in bands.items():
+        mask = (freqs >= low) & (freqs < high)
+        powers[band] = (psd[mask].sum(axis=0) * resolution).tolist()
+    return powers
@@ -19,18 +19,27 @@ Key Features:
 """
 
 from flask import Flask, render_template, jsonify, request
+import glob
+import os
 import threading
 import time
 import json
-from pylsl import StreamInlet, resolve_stream
 import numpy as np
 import multiprocessing
 from multiprocessing import shared_memory, Manager
-import matplotlib.pyplot as plt
 import logging
-from website import p1, p2, p4
+from website import clock
+from website.command_bus import CommandBus, STATUS_STARTING
+from website.launcher import run_program
+from website.recordings import STREAM_CHANNELS
+from website.session import Session, SESSIONS_DIR
 import warnings
-import logging
+
+# Heavy dependencies are imported only in the process that uses them:
+# pylsl in the acquisition functions, matplotlib/scipy/tkinter in the
+# visualization process, and OpenCV/VLC/Pillow in the child programs
+# (started through website.launcher). Under the "spawn" start method every
+# child re-imports this module, so it must stay light and free of side effects.
 
 warnings.filterwarnings("ignore")
 logging.getLogger('matplotlib').setLevel(logging.CRITICAL)
@@ -49,11 +58,13 @@ PPG_BUFFER_SIZE = PPG_SAMPLE_RATE * DISPLAY_TIME  # Buffer size for PPG data
 
 # Global variables for recording
 recording = False
+recording_start = 0.0  # LSL time of the first recorded sample, later for a scheduled start
 recorded_data = {
     "eeg": [],
     "acc": [],
     "gyro": [],
-    "ppg": []
+    "ppg": [],
+    "markers": []
 }
 
 # Initialize data buffers
@@ -77,6 +88,74 @@ eeg_inlet = None
 acc_inlet = None
 gyro_inlet = None
 ppg_inlet = None
+# Command buses of the child programs (created in __main__)
+p1_bus = None
+p2_bus = None
+p4_bus = None
+
+# Child programs that must report ready before the Flask app starts serving
+# ('p1', 'p2', 'p4'); the others are marked "starting" until they are up
+REQUIRED_COMPONENTS = ()
+STARTUP_TIMEOUT = 30  # seconds to wait for each required component
+muse_status = "starting"  # Startup state of the Muse stream connection
+
+# Commands that may take longer than the default reply timeout (seconds)
+COMMAND_TIMEOUTS = {
+    'initialize_camera': 15.0,
+    'video_clean_up': 10.0,
+    'stop_recording': 10.0
+}
+
+# Format of saved recordings: "json" (recorded_data_*.json) or "ncz", the
+# compressed chunk format of website.compression (recorded_data_*.ncz)
+RECORDING_FORMAT = "json"
+
+current_session = None  # Open Session that recordings and child outputs are written to
+
+# Real-time DSP pipeline run on the EEG chunks by the processing worker (see
+# website.realtime): (stage, parameter) pairs in order, empty to disable it.
+# Its output is published in shared memory as 'eeg_pipeline' and saved next
+# to the recording as derived_data_eeg_pipeline_*.npz if RECORD_DERIVED_STREAMS.
+EEG_PIPELINE_STAGES = (('notch', 50.0), ('high_pass', 1.0))
+RECORD_DERIVED_STREAMS = True
+# Detect blinks, jaw clenches and head motion while streaming (see
+# website.artifacts); events are recorded as artifact_onset/artifact_offset
+# markers of the ARTIFACT_MARKER_STREAM and served by /artifacts
+ARTIFACT_DETECTION = True
+ARTIFACT_MARKER_STREAM = "NeuroCue artifacts"
+artifact_log = None  # ArtifactLog, created by start_acquisition_threads
+artifact_detectors = []
+# Heart rate and HRV from the PPG (see website.ppg), published in shared
+# memory as 'ppg_metrics' and served by /heart_rate
+PPG_HEART_RATE = True
+heart_rate_monitor = None  # HeartRateMonitor, created by start_acquisition_threads
+# Live ERP averaging around the stimulus onsets (see website.erp), on the
+# output of the EEG pipeline if it is enabled; published in shared memory as
+# 'erp' and served by /erp. Conditions are the stimulus directories if
+# ERP_BY_DIRECTORY, otherwise the single stimulus files.
+ONLINE_ERP = True
+ERP_BY_DIRECTORY = True
+online_erp = None  # OnlineERP, created by start_acquisition_threads
+# Closed-loop image presentation (see website.closed_loop): during a run
+# started with /start_closed_loop, p2 shows the next image when the feature
+# crosses the threshold. CLOSED_LOOP_FEATURE is ('band_power', band) of the
+# CLOSED_LOOP_CHANNELS in uV^2, or ('ppg', metric of website.ppg), e.g.
+# ('ppg', 'heart_rate') in bpm, which needs PPG_HEART_RATE; None disables it.
+CLOSED_LOOP_FEATURE = ('band_power', 'alpha')
+CLOSED_LOOP_CHANNELS = ('AF7', 'AF8')
+CLOSED_LOOP_THRESHOLD = 20.0
+CLOSED_LOOP_DIRECTION = 'above'  # 'above' or 'below'
+closed_loop_trigger = None  # ClosedLoopTrigger, created by start_acquisition_threads
+session_start_report = None  # Skew report of the last synchronized start (see website.synchronization)
+# Periodic estimates of the wall-clock offset and the LSL time correction of
+# the Muse inlets (see website.clock), saved as clock_offsets.json with
+# every recording and served by /clock_status
+clock_monitor = None  # ClockMonitor, created by start_acquisition_threads
+processing_worker = None  # ProcessingWorker thread, created by start_acquisition_threads
+pipelines = {}  # Pipeline objects by derived stream name
+
+marker_inlets = {}  # LSL marker inlets of the stimulus programs, keyed by source id
+MARKER_RESOLVE_INTERVAL = 5  # seconds between scans for new marker streams
 
 # Threading lock for thread safety
 data_lock = threading.Lock()
@@ -84,6 +163,20 @@ data_lock = threading.Lock()
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
+def connect_to_muse_thread():
+    """
+    Connect to the Muse streams in the background and track the startup state.
+
+    Sets ``muse_status`` to ``ready`` once :func:`connect_to_muse` returns.
+    """
+    global muse_status
+    try:
+        connect_to_muse()
+        muse_status = "ready"
+    except Exception as e:
+        logging.error(f"Error connecting to Muse streams: {e}")
+        muse_status = "failed"
+
 # Connect to Muse streams
 def connect_to_muse():
     """
@@ -95,6 +188,8 @@ def connect_to_muse():
     global eeg_connected, acc_connected, gyro_connected, ppg_connected
     global eeg_inlet, acc_inlet, gyro_inlet, ppg_inlet  # Make inlets global
 
+    from pylsl import StreamInlet, resolve_stream
+
     print("Looking for an EEG stream...")
     eeg_streams = resolve_stream('type', 'EEG')
     if eeg_streams:
@@ -128,6 +223,31 @@ def connect_to_muse():
     else:
         print("No streams found. Please ensure the Muse device is connected and streaming.")
 
+def resolve_marker_streams_thread():
+    """
+    Continuously look for stimulus marker streams and open an inlet for each.
+
+    The stimulus programs (p2, p4) publish their onsets/offsets as LSL marker
+    streams that may appear after the Muse streams, so they are resolved in
+    the background. Markers are timestamped with the LSL clock and recorded
+    alongside the EEG data by ``process_data_thread``.
+    """
+    from pylsl import StreamInlet, resolve_byprop
+    from website.markers import MARKER_STREAM_TYPE
+
+    while True:
+        try:
+            for info in resolve_byprop('type', MARKER_STREAM_TYPE, timeout=1.0):
+                source_id = info.source_id() or info.name()
+                if source_id not in marker_inlets:
+                    print(f"Creating inlet for marker stream '{info.name()}'...")
+                    inlet = StreamInlet(info)
+                    with data_lock:
+                        marker_inlets[source_id] = (info.name(), inlet)
+        except Exception as e:
+            logging.error(f"Error resolving marker streams: {e}")
+        time.sleep(MARKER_RESOLVE_INTERVAL)
+
 # Process data in a separate thread
 def process_data_thread():
     """
@@ -135,7 +255,8 @@ def process_data_thread():
 
     - Reads EEG, accelerometer, gyroscope, and PPG chunks.
     - Updates global buffers and shared memory arrays.
-    - Appends recorded data if recording is enabled.
+    - Appends recorded data if recording is enabled, including stimulus
+      markers from the p2/p4 marker streams.
     """
     global recording, recorded_data
     global eeg_inlet, acc_inlet, gyro_inlet, ppg_inlet
@@ -149,6 +270,8 @@ def process_data_thread():
             if eeg_connected and eeg_inlet:
                 chunk, timestamps = eeg_inlet.pull_chunk()
                 if chunk:
+                    if processing_worker is not None:
+                        processing_worker.submit("eeg", timestamps, chunk)
                     with data_lock:  # Acquire lock before modifying shared data
                         for i, sample in enumerate(chunk):
                             # Update the global buffer
@@ -160,7 +283,7 @@ def process_data_thread():
                             # Update the shared memory buffer
                             shared_eeg_data[:] = eeg_data[:]
                             
-                            if recording:
+                            if recording and timestamps[i] >= recording_start:
                                 recorded_data["eeg"].append({
                                     "timestamp": timestamps[i],
                                     "values": sample[:4]
@@ -169,6 +292,8 @@ def process_data_thread():
             if acc_connected and acc_inlet:
                 chunk, timestamps = acc_inlet.pull_chunk()
                 if chunk:
+                    if processing_worker is not None:
+                        processing_worker.submit("acc", timestamps, chunk)
                     with data_lock:
                         for i, sample in enumerate(chunk):
                             # Update global buffer
@@ -180,7 +305,7 @@ def process_data_thread():
                             # Update shared memory buffer
                             shared_acc_data[:] = acc_data[:]
                             
-                            if recording:
+                            if recording and timestamps[i] >= recording_start:
                                 recorded_data["acc"].append({
                                     "timestamp": timestamps[i],
                                     "values": sample[:3]
@@ -189,6 +314,8 @@ def process_data_thread():
             if gyro_connected and gyro_inlet:
                 chunk, timestamps = gyro_inlet.pull_chunk()
                 if chunk:
+                    if processing_worker is not None:
+                        processing_worker.submit("gyro", timestamps, chunk)
                     with data_lock:
                         for i, sample in enumerate(chunk):
                             # Update global buffer
@@ -200,7 +327,7 @@ def process_data_thread():
                             # Update shared memory buffer
                             shared_gyro_data[:] = gyro_data[:]
                             
-                            if recording:
+                            if recording and timestamps[i] >= recording_start:
                                 recorded_data["gyro"].append({
                                     "timestamp": timestamps[i],
                                     "values": sample[:3]
@@ -209,6 +336,8 @@ def process_data_thread():
             if ppg_connected and ppg_inlet:
                 chunk, timestamps = ppg_inlet.pull_chunk()
                 if chunk:
+                    if processing_worker is not None:
+                        processing_worker.submit("ppg", timestamps, chunk)
                     with data_lock:
                         for i, sample in enumerate(chunk):
                             # Update global buffer
@@ -220,20 +349,122 @@ def process_data_thread():
                             # Update shared memory buffer
                             shared_ppg_data[:] = ppg_data[:]
                             
-                            if recording:
+                            if recording and timestamps[i] >= recording_start:
                                 recorded_data["ppg"].append({
                                     "timestamp": timestamps[i],
                                     "values": sample[:3]
                                 })
+
+            for stream_name, marker_inlet in list(marker_inlets.values()):
+                chunk, timestamps = marker_inlet.pull_chunk()
+                if chunk and processing_worker is not None:
+                    processing_worker.submit("markers", timestamps, chunk)
+                if chunk and recording:
+                    with data_lock:
+                        for i, sample in enumerate(chunk):
+                            if timestamps[i] < recording_start:
+                                continue
+                            recorded_data["markers"].append({
+                                "timestamp": timestamps[i],
+                                "values": sample[:1],
+                                "stream": stream_name
+                            })
             
             time.sleep(0.001)
         except Exception as e:
             logging.error(f"Error in processing thread: {e}")
             time.sleep(0.1)
 
-# Start the data processing thread
-thread = threading.Thread(target=process_data_thread, daemon=True)
-thread.start()
+def record_artifact(event):
+    """Add a detected artifact to the recording as onset and offset markers."""
+    if not recording:
+        return
+    with data_lock:
+        for edge in ('onset', 'offset'):
+            recorded_data["markers"].append({
+                "timestamp": event[edge],
+                "values": [f"artifact_{edge}:{event['type']}"],
+                "stream": ARTIFACT_MARKER_STREAM
+            })
+
+def start_acquisition_threads():
+    """
+    Start the data processing thread and the marker stream discovery thread.
+
+    Called from ``__main__`` so that importing this module (e.g. when a child
+    process re-imports it under the "spawn" start method) starts no threads.
+    """
+    global thread, marker_thread, processing_worker, artifact_log, heart_rate_monitor, online_erp
+    global closed_loop_trigger, clock_monitor
+
+    # Start the real-time processing worker before the streams are read; it
+    # timestamps chunks on the project clock of the samples and stimulus onsets
+    from website.realtime import ProcessingWorker, Pipeline, build_stages
+    processing_worker = ProcessingWorker(clock=clock.now)
+    if EEG_PIPELINE_STAGES:
+        pipelines['eeg_pipeline'] = Pipeline('eeg_pipeline', 'eeg', build_stages(EEG_PIPELINE_STAGES),
+                                             SAMPLE_RATE, STREAM_CHANNELS['eeg'])
+    for name, pipeline in pipelines.items():
+        processing_worker.add(pipeline.stream, pipeline)
+        shared_memory_names[name] = pipeline.buffer.name
+    if ARTIFACT_DETECTION:
+        from website.artifacts import ArtifactLog, BlinkDetector, JawClenchDetector, MotionDetector
+        artifact_log = ArtifactLog()
+        artifact_log.listeners.append(record_artifact)
+        artifact_detectors.extend([
+            ('eeg', BlinkDetector(artifact_log, SAMPLE_RATE, STREAM_CHANNELS['eeg'])),
+            ('eeg', JawClenchDetector(artifact_log, SAMPLE_RATE, STREAM_CHANNELS['eeg'])),
+            ('gyro', MotionDetector(artifact_log, 'gyro', GYRO_SAMPLE_RATE)),
+            ('acc', MotionDetector(artifact_log, 'acc', ACC_SAMPLE_RATE))
+        ])
+        for stream, detector in artifact_detectors:
+            processing_worker.add(stream, detector)
+    if PPG_HEART_RATE:
+        from website.ppg import HeartRateMonitor
+        heart_rate_monitor = HeartRateMonitor(PPG_SAMPLE_RATE, STREAM_CHANNELS['ppg'])
+        processing_worker.add('ppg', heart_rate_monitor)
+        shared_memory_names['ppg_metrics'] = heart_rate_monitor.shm.name
+    if ONLINE_ERP:
+        from website.erp import OnlineERP, OnsetListener
+        condition = (lambda label: os.path.dirname(label) or label) if ERP_BY_DIRECTORY else None
+        online_erp = OnlineERP(SAMPLE_RATE, STREAM_CHANNELS['eeg'], condition=condition)
+        if 'eeg_pipeline' in pipelines:
+            pipelines['eeg_pipeline'].listeners.append(online_erp)
+        else:
+            processing_worker.add('eeg', online_erp)
+        processing_worker.add('markers', OnsetListener(online_erp))
+        shared_memory_names['erp'] = online_erp.shm.name
+    if CLOSED_LOOP_FEATURE and (CLOSED_LOOP_FEATURE[0] != 'ppg' or heart_rate_monitor is not None):
+        from website.closed_loop import BandPowerFeature, MetricFeature, ClosedLoopTrigger
+        kind, name = CLOSED_LOOP_FEATURE
+        if kind == 'ppg':
+            # Read after the heart rate monitor has processed the same chunk
+            feature = MetricFeature(heart_rate_monitor, name)
+        else:
+            feature = BandPowerFeature(SAMPLE_RATE, STREAM_CHANNELS['eeg'], name, CLOSED_LOOP_CHANNELS)
+        closed_loop_trigger = ClosedLoopTrigger(
+            feature, CLOSED_LOOP_THRESHOLD, lambda trigger: p2_bus.notify('closed_loop_trigger', trigger),
+            CLOSED_LOOP_DIRECTION, clock=clock.now, worker=processing_worker)
+        processing_worker.add('ppg' if kind == 'ppg' else 'eeg', closed_loop_trigger, first=kind != 'ppg')
+    processing_worker.start()
+
+    # Start the data processing thread
+    thread = threading.Thread(target=process_data_thread, daemon=True)
+    thread.start()
+
+    # Start looking for stimulus marker streams
+    marker_thread = threading.Thread(target=resolve_marker_streams_thread, daemon=True)
+    marker_thread.start()
+
+    # Start the periodic clock offset estimates
+    clock_monitor = clock.ClockMonitor(connected_inlets)
+    clock_monitor.start()
+
+def connected_inlets():
+    """Return the connected Muse inlets by stream name."""
+    inlets = (('eeg', eeg_inlet, eeg_connected), ('acc', acc_inlet, acc_connected),
+              ('gyro', gyro_inlet, gyro_connected), ('ppg', ppg_inlet, ppg_connected))
+    return {name: inlet for name, inlet, connected in inlets if connected and inlet is not None}
 
 # Flask routes
 @app.route("/")
@@ -251,95 +482,509 @@ def subject_information():
     return jsonify({"status": "Subject Information Saved"})
 # subject description end
 
+# session management start
+def send_session_dir(buses=None):
+    """
+    Point the child programs at the directory of the current session, or at
+    ``data`` if no session is open.
+
+    Args:
+        buses (list, optional): Command buses to send to, default all children.
+
+    Returns:
+        list: Names of the child programs that did not get the directory,
+        e.g. because they are still starting; those still starting get it
+        from :func:`send_session_dir_when_ready` once they are up.
+    """
+    directory = current_session.path if current_session is not None else "data"
+    return [bus.name for bus in (buses or (p1_bus, p2_bus, p4_bus))
+            if bus is not None and not send_command(bus, 'set_session_dir', directory)]
+
+def send_session_dir_when_ready(bus):
+    """
+    Send the current session directory to a child program once it reports
+    ready, so a session opened while it was starting also gets its files.
+    Run in a thread per child at startup.
+    """
+    if bus.wait_ready() and current_session is not None:
+        send_session_dir([bus])
+
+def open_session(label=None):
+    """
+    Create a new session directory and point the child programs at it.
+
+    Args:
+        label (str, optional): Appended to the session id.
+
+    Returns:
+        tuple: The new current Session and the names of the child programs
+        that did not get its directory (see :func:`send_session_dir`).
+    """
+    global current_session
+    current_session = Session.create(label=label)
+    not_sent = send_session_dir()
+    print(f"Session {current_session.session_id} opened in {current_session.path}")
+    if not_sent:
+        print(f"WARNING: Session directory not sent to {', '.join(not_sent)}")
+    return current_session, not_sent
+
+def save_derived_streams(session, filename):
+    """
+    Save the outputs of the real-time pipelines recorded with a recording as
+    ``derived_data_<stream>_<time>.npz`` in its session.
+    """
+    stamp = os.path.splitext(os.path.basename(filename))[0].replace("recorded_data_", "")
+    for name, pipeline in pipelines.items():
+        derived = pipeline.stop_recording()
+        np.savez(session.file_path(f"derived_data_{name}_{stamp}.npz"), timestamps=derived['timestamps'],
+                 values=derived['values'], sfreq=derived['sfreq'], channels=np.asarray(derived['channels']))
+
+def post_process_recording(session_path, filename):
+    """
+    Build the min/max pyramid of a saved recording (see website.pyramid) and
+    write the quality report of its session (see website.quality), logging failures.
+    """
+    from website.pyramid import load_pyramid
+    from website.quality import write_quality_report
+    try:
+        # Builds the pyramid unless /recording_overview already did
+        load_pyramid(filename)
+    except Exception as e:
+        print(f"WARNING: Pyramid of {filename} failed: {e}")
+    try:
+        write_quality_report(session_path)
+    except Exception as e:
+        print(f"WARNING: Quality report of {session_path} failed: {e}")
+
+@app.route("/start_session", methods=["POST"])
+def start_session():
+    data = request.get_json(silent=True) or {}
+    if isinstance(data, str):
+        data = json.loads(data)
+    session, not_sent = open_session(data.get("label"))
+    status = f"Session {session.session_id} started"
+    if not_sent:
+        status += (f". Not yet writing to it: {', '.join(not_sent)}"
+                   " (programs still starting switch to it once ready)")
+    return jsonify({"status": status, "session": session.path, "not_sent": not_sent})
+
+@app.route("/finalize_session", methods=["POST"])
+def finalize_session():
+    """
+    Finalize the current session: list its files in the manifest and write
+    the alignment index. Stimulus runs and recordings should be stopped first,
+    since their files are only written when they end.
+    """
+    global current_session
+    if current_session is None:
+        return jsonify({"status": "No open session"})
+    session = current_session
+    current_session = None
+    not_sent = send_session_dir()
+    manifest = session.finalize()
+    return jsonify({"status": f"Session {session.session_id} finalized", "manifest": manifest,
+                    "not_sent": not_sent})
+
+@app.route("/recording_overview", methods=["GET"])
+def recording_overview():
+    """
+    Serve a time range of a saved recording summarized for a pixel width.
+
+    Query parameters: ``session`` (session id, defaults to the current
+    session), ``file`` (recording name, defaults to the latest one),
+    ``stream`` (default ``eeg``), ``start`` and ``end`` (LSL seconds,
+    default the whole recording) and ``width`` (pixels, default 1000).
+    While the pyramid of the recording is being built, e.g. right after the
+    recording stopped, answers 202 with ``building`` set instead of waiting.
+    """
+    from website.pyramid import is_building, read_range
+    session_id = request.args.get("session")
+    if session_id:
+        session_path = os.path.join(SESSIONS_DIR, os.path.basename(session_id))
+    elif current_session is not None:
+        session_path = current_session.path
+    else:
+        return jsonify({"status": "No session given and no open session"}), 400
+    name = request.args.get("file")
+    if name:
+        path = os.path.join(session_path, os.path.basename(name))
+    else:
+        recordings = sorted(glob.glob(os.path.join(session_path, "recorded_data_*.json")) +
+                            glob.glob(os.path.join(session_path, "recorded_data_*.ncz")))
+        path = recordings[-1] if recordings else ""
+    stream = request.args.get("stream", "eeg")
+    if not os.path.isfile(path) or stream not in STREAM_CHANNELS:
+        return jsonify({"status": "Recording or stream not found"}), 404
+    if is_building(path):
+        return jsonify({"status": f"Overview of {os.path.basename(path)} is being built, try again shortly",
+                        "file": os.path.basename(path), "building": True}), 202
+
+    start = request.args.get("start", type=float)
+    end = request.args.get("end", type=float)
+    overview = read_range(path, stream, start, end, request.args.get("width", 1000, type=int))
+
+    def to_list(array):
+        # NaN is not valid JSON
+        return np.where(np.isnan(array), None, array).tolist()
+
+    return jsonify({
+        "file": os.path.basename(path),
+        "stream": stream,
+        "channels": STREAM_CHANNELS[stream],
+        "level": overview['level'],
+        "samples_per_bin": overview['samples_per_bin'],
+        "timestamps": overview['timestamps'].tolist(),
+        "min": to_list(overview['min']),
+        "max": to_list(overview['max'])
+    })
+
+@app.route("/session_status", methods=["GET"])
+def session_status():
+    if current_session is None:
+        return jsonify({"session": None})
+    return jsonify({"session": current_session.path, "manifest": current_session.manifest})
+# session management end
+
 # command for video feed control
-def send_command(conn, command, json_data=None):
+def send_command(bus, command, json_data=None, timeout=None):
     """
-    Send a command to a child process via a Pipe connection.
+    Send a command to a child process through its command bus and wait for the reply.
 
     Args:
-        conn (multiprocessing.Connection): Parent end of a Pipe connection.
+        bus (CommandBus): Command bus of the child program.
         command (str): Command string to send.
-        json_data (dict, optional): Optional JSON data to send after command.
+        json_data (dict, optional): Optional JSON data sent with the command.
+        timeout (float, optional): Seconds to wait for the reply. Defaults to
+            the entry in ``COMMAND_TIMEOUTS`` or the bus default.
 
     Returns:
-        bool: True if command successfully sent and response received, False otherwise.
+        bool: True if command successfully sent and response received, False
+        otherwise (including while the child program is still starting and
+        when the child replies with an ``error``).
     """
     try:
-        # Send the command
-        conn.send(command)
-        print(f"Sent command: {command}")
-
-        # If the command is 'save_config', send the JSON data, for program 2
-        if command == "save_config" or command == "save_video_config" and json_data is not None:
-            conn.send(json_data)
-            print(f"Sent JSON data: {json_data}")
-        
-        # Wait for a response
-        response = conn.recv()
-        print(f"Received response: {response}")
-        
+        if bus is None or bus.status == STATUS_STARTING:
+            print(f"Error sending command: {command}: program is still starting")
+            return False
+        if timeout is None:
+            timeout = COMMAND_TIMEOUTS.get(command)
+        response = bus.request(command, json_data, timeout)
+        if isinstance(response, dict) and response.get('error'):
+            print(f"Error sending command: {command}: {response['error']}")
+            return False
         return True
     except Exception as e:
         print(f"Error sending command: {e}")
         return False
+
+@app.route("/component_status", methods=["GET"])
+def component_status():
+    """Return the startup state of the Muse streams and every child program."""
+    status = {
+        'muse': {
+            'status': muse_status,
+            'eeg': eeg_connected,
+            'acc': acc_connected,
+            'gyro': gyro_connected,
+            'ppg': ppg_connected
+        }
+    }
+    for name, bus in (('p1', p1_bus), ('p2', p2_bus), ('p4', p4_bus)):
+        status[name] = bus.status_info() if bus is not None else {'status': STATUS_STARTING}
+    return jsonify(status)
+
+@app.route("/command_latency", methods=["GET"])
+def command_latency():
+    """Return per-command round-trip latency histograms of every child program."""
+    return jsonify({bus.name: bus.stats() for bus in (p1_bus, p2_bus, p4_bus) if bus is not None})
     
+@app.route("/pipeline_status", methods=["GET"])
+def pipeline_status():
+    """Return the per-stage cost of the real-time pipelines and the worker's queue latency."""
+    return jsonify({
+        'worker': processing_worker.status() if processing_worker is not None else None,
+        'pipelines': {name: pipeline.status() for name, pipeline in pipelines.items()}
+    })
+
+@app.route("/artifacts", methods=["GET"])
+def artifacts():
+    """
+    Return the artifacts detected live, optionally only those ending after
+    the LSL time ``since``, with the event counts and per-chunk detector cost.
+    """
+    if artifact_log is None:
+        return jsonify({"status": "Artifact detection is disabled", "events": []})
+    return jsonify({
+        "events": artifact_log.recent(request.args.get("since", type=float)),
+        "counts": dict(artifact_log.counts),
+        "detectors": {f"{type(detector).__name__}_{stream}": detector.status()
+                      for stream, detector in artifact_detectors}
+    })
+
+@app.route("/heart_rate", methods=["GET"])
+def heart_rate():
+    """Return the current heart rate and HRV metrics with the IBIs of the HRV window."""
+    if heart_rate_monitor is None:
+        return jsonify({"status": "Heart rate monitoring is disabled"})
+    return jsonify(heart_rate_monitor.status())
+
+@app.route("/erp", methods=["GET"])
+def erp():
+    """Return the live ERP of every condition: trial count, mean and standard deviation."""
+    if online_erp is None:
+        return jsonify({"status": "Online ERP averaging is disabled"})
+    return jsonify(online_erp.status())
+
+@app.route("/reset_erp", methods=["POST"])
+def reset_erp():
+    """Forget the trials averaged so far."""
+    if online_erp is not None:
+        online_erp.reset()
+    return jsonify({"status": "ERP reset"})
+
+@app.route("/start_closed_loop", methods=["POST"])
+def start_closed_loop():
+    """
+    Start a closed-loop run of the image sequence in p2.
+
+    The JSON body may override the ``threshold`` and ``direction`` of the
+    trigger for this run.
+    """
+    if closed_loop_trigger is None:
+        return jsonify({"status": "Closed-loop triggering is disabled"})
+    data = request.get_json(silent=True) or {}
+    # Validate the parameters before p2 enters a run that waits for triggers
+    try:
+        closed_loop_trigger.start(data.get('threshold'), data.get('direction'))
+    except ValueError as e:
+        return jsonify({"status": f"Closed loop not started: {e}"}), 400
+    cmd = 'start_closed_loop'
+    if not send_command(p2_bus, cmd):
+        closed_loop_trigger.stop()
+        return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
+    return jsonify({"status": "Started Closed-Loop Stimuli", "trigger": closed_loop_trigger.status()})
+
+@app.route("/stop_closed_loop", methods=["POST"])
+def stop_closed_loop():
+    """Stop sending triggers and end the closed-loop run in p2."""
+    if closed_loop_trigger is not None:
+        closed_loop_trigger.stop()
+    cmd = 'stop_stimuli'
+    if send_command(p2_bus, cmd):
+        return jsonify({"status": "Stopped Closed-Loop Stimuli"})
+    return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
+
+@app.route("/closed_loop_status", methods=["GET"])
+def closed_loop_status():
+    """
+    Return the live feature value, the trigger state and its decision
+    latency; the per-trial latencies to the onset are in p2's
+    ``*_closed_loop.json`` report.
+    """
+    if closed_loop_trigger is None:
+        return jsonify({"status": "Closed-loop triggering is disabled"})
+    return jsonify(closed_loop_trigger.status())
+
 @app.route("/start_recording_video", methods=["POST"])
 def start_recording_video():
-    global parent_conn
+    global p1_bus
     cmd = 'start_recording'
-    if send_command(parent_conn, cmd):
+    if send_command(p1_bus, cmd):
         return jsonify({"status": f"Recording Camera Feed"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure camera program is running."})
 
 @app.route("/stop_recording_video", methods=["POST"])
 def stop_recording_video():
-    global parent_conn
+    global p1_bus
     cmd = 'stop_recording'
-    if send_command(parent_conn, cmd):
+    if send_command(p1_bus, cmd):
         return jsonify({"status": f"Camera Feed Recording Stopped and Saved"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure camera program is running."})
     
 @app.route("/open_visualization_video", methods=["POST"])
 def open_visualization_video():
-    global parent_conn
+    global p1_bus
     cmd = 'show_feed'
-    if send_command(parent_conn, cmd):
+    if send_command(p1_bus, cmd):
         return jsonify({"status": f"Showing Camera Feed"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure camera program is running."})
     
 @app.route("/close_visualization_video", methods=["POST"])
 def close_visualization_video():
-    global parent_conn
+    global p1_bus
     cmd = 'close_feed'
-    if send_command(parent_conn, cmd):
+    if send_command(p1_bus, cmd):
         return jsonify({"status": f"Closed Video Feed"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
 
 # command for muse control
+def begin_recording(start_at=None):
+    """
+    Start recording the Muse streams and the stimulus markers.
+
+    Args:
+        start_at (float, optional): LSL time of a scheduled session start;
+            samples and markers before it are not recorded.
+    """
+    global recording, recorded_data, recording_start
+    if RECORD_DERIVED_STREAMS:
+        for pipeline in pipelines.values():
+            pipeline.start_recording(start_at)
+    with data_lock:
+        recorded_data = {
+            "eeg": [],
+            "acc": [],
+            "gyro": [],
+            "ppg": [],
+            "markers": []
+        }
+        recording_start = start_at or 0.0
+        recording = True
+
 @app.route("/start_recording", methods=["POST"])
 def start_recording():
-    global recording, recorded_data
-    recording = True
-    recorded_data = {
-        "eeg": [],
-        "acc": [],
-        "gyro": [],
-        "ppg": []
-    }
+    begin_recording()
     return jsonify({"status": "Recording started"})
 
+@app.route("/synchronized_start", methods=["POST"])
+def synchronized_start():
+    """
+    Start the EEG recording, the camera recording and a stimulus run together.
+
+    Every component is armed with a start time ``lead`` seconds ahead on
+    the LSL clock and starts at that time; the residual skew between them
+    is measured shortly after, saved as ``session_start.json`` in the
+    session and served by ``/session_start_report``. The JSON body may set
+    ``stimuli`` (``images``, ``videos`` or None), ``camera`` (False to
+    leave the camera out) and ``lead`` in seconds.
+    """
+    from website.synchronization import SYNC_START_LEAD
+
+    data = request.get_json(silent=True) or {}
+    stimuli = data.get('stimuli', 'images')
+    # Without an open session one is opened, and stays open until /finalize_session
+    session_opened = current_session is None
+    session = open_session()[0] if session_opened else current_session
+    start_at = clock.now() + float(data.get('lead', SYNC_START_LEAD))
+
+    # Arm every component in advance; each confirms before the start time
+    begin_recording(start_at)
+    armed = {'muse': clock.now()}
+    targets = {}
+    if data.get('camera', True):
+        targets['camera'] = (p1_bus, 'start_recording')
+    if stimuli == 'images':
+        targets['stimuli'] = (p2_bus, 'start_stimuli')
+    elif stimuli == 'videos':
+        targets['stimuli'] = (p4_bus, 'start_video_stimuli')
+    failed = []
+    for name, (bus, cmd) in targets.items():
+        if send_command(bus, cmd, {'start_at': start_at}):
+            armed[name] = clock.now()
+        else:
+            failed.append(name)
+
+    buses = {name: bus for name, (bus, _) in targets.items() if name not in failed}
+    threading.Thread(target=collect_session_start, args=(session, start_at, armed, buses), daemon=True).start()
+    return jsonify({
+        "status": f"Session starts in {(start_at - clock.now()) * 1000:.0f} ms",
+        "start_at": start_at,
+        "armed_lead_ms": {name: (start_at - at) * 1000.0 for name, at in armed.items()},
+        "failed": failed,
+        "session": session.path,
+        "session_opened": session_opened
+    })
+
+def collect_session_start(session, start_at, armed, buses):
+    """
+    Report the residual skew of a synchronized start, shortly after it.
+
+    Takes the first recorded sample of every connected Muse stream and the
+    first frame and onset reported by the child programs, and saves the
+    :func:`~website.synchronization.skew_report` in the session.
+
+    Args:
+        session (Session): Session of the recording.
+        start_at (float): Scheduled start on the LSL clock.
+        armed (dict): Component name -> LSL time it confirmed it was armed.
+        buses (dict): ``camera`` / ``stimuli`` -> CommandBus of the child.
+    """
+    global session_start_report
+    from website.synchronization import SYNC_SETTLE, skew_report, write_skew_report
+
+    time.sleep(max(0.0, start_at + SYNC_SETTLE - clock.now()))
+    components = {}
+    streams = (('eeg', eeg_connected, SAMPLE_RATE), ('acc', acc_connected, ACC_SAMPLE_RATE),
+               ('gyro', gyro_connected, GYRO_SAMPLE_RATE), ('ppg', ppg_connected, PPG_SAMPLE_RATE))
+    with data_lock:
+        for stream, connected, rate in streams:
+            if connected:
+                samples = recorded_data[stream]
+                components[stream] = {'armed': armed['muse'], 'period': 1.0 / rate,
+                                      'first': samples[0]['timestamp'] if samples else None}
+    for name, bus in buses.items():
+        try:
+            status = bus.request('sync_status')
+        except Exception as e:
+            print(f"Error getting the start of {name}: {e}")
+            status = None
+        if not isinstance(status, dict):
+            status = {}
+        components[name] = {'armed': armed.get(name), 'first': status.get('first_frame', status.get('first_onset')),
+                            'period': status.get('frame_period')}
+
+    session_start_report = skew_report(start_at, components)
+    write_skew_report(session.path, session_start_report)
+    skew = session_start_report['skew_ms']
+    print(f"Synchronized start: skew {'n/a' if skew is None else f'{skew:.2f} ms'}, "
+          f"late {session_start_report['late']}, missing {session_start_report['missing']}")
+
+@app.route("/clock_status", methods=["GET"])
+def clock_status():
+    """
+    Return the published wall-clock offset, the drift and uncertainty of the
+    periodic offset estimates and the spread of the Muse time corrections.
+    """
+    if clock_monitor is None:
+        return jsonify({"status": "Clock monitor is not running"})
+    return jsonify(clock_monitor.report())
+
+@app.route("/session_start_report", methods=["GET"])
+def get_session_start_report():
+    """Return the skew report of the last synchronized start."""
+    if session_start_report is None:
+        return jsonify({"status": "No synchronized start yet"})
+    return jsonify(session_start_report)
+
 @app.route("/stop_recording", methods=["POST"])
 def stop_recording():
     global recording
     recording = False
-    filename = f"data/recorded_data_{time.strftime('%Y%m%d_%H%M%S')}.json"
-    with open(filename, "w") as f:
-        json.dump(recorded_data, f, indent=4)
-    return jsonify({"status": f"Recording stopped. Data saved to {filename}"})
+    # Without an open session one is opened, and stays open until /finalize_session
+    session_opened = current_session is None
+    session = open_session()[0] if session_opened else current_session
+    filename = session.file_path(f"recorded_data_{time.strftime('%Y%m%d_%H%M%S')}.{RECORDING_FORMAT}")
+    if RECORDING_FORMAT == "ncz":
+        # Encoded once at the end, so the acquisition thread is not slowed
+        from website.compression import write_recording
+        write_recording(filename, recorded_data)
+    else:
+        with open(filename, "w") as f:
+            json.dump(recorded_data, f, indent=4)
+    if RECORD_DERIVED_STREAMS:
+        save_derived_streams(session, filename)
+    if clock_monitor is not None:
+        clock_monitor.save(session.file_path(clock.CLOCK_OFFSETS_NAME))
+    # Summarize and check the new recording in the background, this takes seconds
+    threading.Thread(target=post_process_recording, args=(session.path, filename), daemon=True).start()
+    status = f"Recording stopped. Data saved to {filename}"
+    if session_opened:
+        status += f". No session was open, so session {session.session_id} was opened; finalize it when done"
+    return jsonify({"status": status, "session": session.path, "session_opened": session_opened})
 
 @app.route("/open_visualization", methods=["POST"])
 def open_visualization():
@@ -357,23 +1002,23 @@ def open_visualization():
 # command for image stimuli program start
 @app.route("/load_stimuli_config", methods=["POST"])
 def load_stimuli_config():
-    global parent_conn2
+    global p2_bus
 
     cmd = 'load_stimuli'
-    if send_command(parent_conn2, cmd):
+    if send_command(p2_bus, cmd):
         return jsonify({"status": f"Loaded Stimuli Configuration"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
     
 @app.route("/save_stimuli_config", methods=["POST"])
 def save_stimuli_config():
-    global parent_conn2
+    global p2_bus
 
     data = request.get_json()  # Get JSON data from request
     print("Received Data:", data)  # Debugging
 
     cmd = 'save_config'
-    if send_command(parent_conn2, cmd, data):
+    if send_command(p2_bus, cmd, data):
         return jsonify({"status": f"Saved Stimuli Configuration"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
@@ -381,9 +1026,9 @@ def save_stimuli_config():
 
 @app.route("/start_stimuli", methods=["POST"])
 def start_stimuli():
-    global parent_conn2
+    global p2_bus
     cmd = 'start_stimuli'
-    if send_command(parent_conn2, cmd):
+    if send_command(p2_bus, cmd):
         return jsonify({"status": f"Started Stimuli"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
@@ -392,23 +1037,23 @@ def start_stimuli():
 # command for video stimuli program start
 @app.route("/load_video_stimuli_config", methods=["POST"])
 def load_video_stimuli_config():
-    global parent_conn4
+    global p4_bus
 
     cmd = 'load_video_stimuli'
-    if send_command(parent_conn4, cmd):
+    if send_command(p4_bus, cmd):
         return jsonify({"status": f"Loaded Stimuli Configuration"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
     
 @app.route("/save_video_stimuli_config", methods=["POST"])
 def save_video_stimuli_config():
-    global parent_conn4
+    global p4_bus
 
     data = request.get_json()  # Get JSON data from request
     print("Received Data:", data)  # Debugging
 
     cmd = 'save_video_config'
-    if send_command(parent_conn4, cmd, data):
+    if send_command(p4_bus, cmd, data):
         return jsonify({"status": f"Saved Stimuli Configuration"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
@@ -416,9 +1061,9 @@ def save_video_stimuli_config():
 
 @app.route("/start_video_stimuli", methods=["POST"])
 def start_video_stimuli():
-    global parent_conn4
+    global p4_bus
     cmd = 'start_video_stimuli'
-    if send_command(parent_conn4, cmd):
+    if send_command(p4_bus, cmd):
         return jsonify({"status": f"Started Stimuli"})
     else:
         return jsonify({"status": f"Failed to send command: {cmd}. Make sure Program 2 is running."})
@@ -429,7 +1074,8 @@ def start_visualization(shared_memory_names, time_buffer_list, ppg_time_buffer_l
     
     """
     Start a Tkinter-based visualization window showing EEG, frequency bands,
-    accelerometer, gyroscope, and PPG signals.
+    accelerometer, gyroscope, and PPG signals, and the live ERP of every
+    condition if online ERP averaging is enabled.
 
     Args:
         shared_memory_names (dict): Names of shared memory blocks.
@@ -470,6 +1116,14 @@ def start_visualization(shared_memory_names, time_buffer_list, ppg_time_buffer_l
     acc_data = np.ndarray(acc_shape, dtype=np.float64, buffer=acc_shm.buf)
     gyro_data = np.ndarray(gyro_shape, dtype=np.float64, buffer=gyro_shm.buf)
     ppg_data = np.ndarray(ppg_shape, dtype=np.float64, buffer=ppg_shm.buf)
+
+    # Live ERP means and trial counts (see website.erp), if enabled
+    erp_shm = None
+    if 'erp' in shared_memory_names:
+        from website.erp import MAX_CONDITIONS, epoch_times, shared_arrays
+        erp_times = epoch_times(SAMPLE_RATE)
+        erp_shm = shared_memory.SharedMemory(name=shared_memory_names['erp'])
+        erp_means, erp_counts = shared_arrays(erp_shm.buf, eeg_shape[0], len(erp_times))
     
     # Assume EEG sampling rate (adjust as needed)
     fs = 256  # Hz, typical for EEG
@@ -553,6 +1207,7 @@ def start_visualization(shared_memory_names, time_buffer_list, ppg_time_buffer_l
             self.acc_ylim = (-1.2, 1.2)      # m/s² range for accelerometer
             self.gyro_ylim = (-250, 250)     # deg/s range for gyroscope
             self.ppg_ylim = (-2500, 2500)    # Arbitrary units for PPG
+            self.erp_ylim = (-50, 50)        # μV range for the ERP means
             
             # Apply fixed limits
             for ax in self.eeg_axes:
@@ -565,6 +1220,9 @@ def start_visualization(shared_memory_names, time_buffer_list, ppg_time_buffer_l
             self.acc_ax.set_ylim(self.acc_ylim)
             self.gyro_ax.set_ylim(self.gyro_ylim)
             self.ppg_ax.set_ylim(self.ppg_ylim)
+            if erp_shm is not None:
+                self.erp_ax.set_ylim(self.erp_ylim)
+                self.erp_ax.set_xlim(erp_times[0], erp_times[-1])
             
             # Set fixed x-axis limits
             t_max = max(time_buffer.max() if len(time_buffer) > 0 else 10, 
@@ -698,8 +1356,21 @@ def start_visualization(shared_memory_names, time_buffer_list, ppg_time_buffer_l
                 self.ppg_lines.append(line)
             self.ppg_ax.legend(loc="lower right", ncol=3, fontsize='small')
             
+            # Live ERP (mean of the channels per condition) below the sensors
+            self.erp_lines = []
+            if erp_shm is not None:
+                self.erp_ax = self.fig.add_subplot(gs[4:, 4])
+                self.erp_ax.set_title("Live ERP (channel mean)")
+                self.erp_ax.set_ylabel("μV")
+                self.erp_ax.set_xlabel("Time from onset (s)")
+                self.erp_ax.axvline(0, color='gray', lw=1)
+                self.erp_ax.grid(True, alpha=0.3)
+                for i in range(MAX_CONDITIONS):
+                    line, = self.erp_ax.plot([], [], lw=1, color=f"C{i}")
+                    self.erp_lines.append(line)
+
             # Add frequency band legend in the remaining space in the 5th column
-            legend_ax = self.fig.add_subplot(gs[3:, 4])
+            legend_ax = self.fig.add_subplot(gs[3:4, 4] if erp_shm is not None else gs[3:, 4])
             legend_ax.axis('off')
             
             # Create legend entries for each band with their frequency ranges
@@ -760,11 +1431,18 @@ def start_visualization(shared_memory_names, time_buffer_list, ppg_time_buffer_l
             for i in range(3):
                 self.ppg_lines[i].set_data(ppg_time_ds, ppg_data[i][::ds])
             
+            # Update the ERP lines of the conditions with trials
+            for i, line in enumerate(self.erp_lines):
+                if erp_counts[i] > 0:
+                    line.set_data(erp_times, erp_means[i].mean(axis=0))
+                else:
+                    line.set_data([], [])
+            
             # Return all lines for blitting
             all_lines = self.eeg_lines[:]
             for band_lines in self.band_lines.values():
                 all_lines.extend(band_lines)
-            all_lines.extend(self.acc_lines + self.gyro_lines + self.ppg_lines)
+            all_lines.extend(self.acc_lines + self.gyro_lines + self.ppg_lines + self.erp_lines)
             
             return all_lines
         
@@ -792,6 +1470,8 @@ def start_visualization(shared_memory_names, time_buffer_list, ppg_time_buffer_l
         acc_shm.close()
         gyro_shm.close()
         ppg_shm.close()
+        if erp_shm is not None:
+            erp_shm.close()
         
 # Add a function to clean up shared memory resources
 def cleanup_shared_memory():
@@ -813,9 +1493,20 @@ def cleanup_shared_memory():
     gyro_shm.unlink()
     ppg_shm.unlink()
 
-    global parent_conn
+    if processing_worker is not None:
+        processing_worker.stop()
+    if clock_monitor is not None:
+        clock_monitor.stop()
+    for pipeline in pipelines.values():
+        pipeline.close()
+    if heart_rate_monitor is not None:
+        heart_rate_monitor.close()
+    if online_erp is not None:
+        online_erp.close()
+
+    global p1_bus
     cmd = 'video_clean_up'
-    if send_command(parent_conn, cmd):
+    if send_command(p1_bus, cmd):
         print('Video feed cleaned up')
     else:
         print('Failed to clean up video feed')
@@ -852,42 +1543,47 @@ if __name__ == "__main__":
         'ppg': ppg_shm.name
     }
 
+    # Wall-clock times of all processes are derived from the project clock
+    # with this offset, published to the child programs started below
+    clock.publish_wall_offset()
+    start_acquisition_threads()
+
     try:
-        connect_to_muse()
+        startup_start = time.perf_counter()
 
-        # Start Program 2 as a separate process
-        print("Program 'flask - control' started - will send commands to 'Camera Program p1'")
-        global parent_conn, child_conn  # Make pipes global
+        # Resolve the Muse streams in the background; resolve_stream blocks
+        # until each stream appears, which must not delay the control app
+        muse_thread = threading.Thread(target=connect_to_muse_thread, daemon=True)
+        muse_thread.start()
+
+        # Start all child programs in parallel; each reports readiness over its pipe
+        print("Program 'flask - control' started - will send commands to 'Camera Program p1', "
+              "'Image Stimuli Program p2' and 'Video Stimuli Program p4'")
         parent_conn, child_conn = multiprocessing.Pipe()
-        # Start Program 2 as a separate process
-        p1_process = multiprocessing.Process(target=p1.main, args=(child_conn,))
+        p1_bus = CommandBus(parent_conn, "Camera Program p1")
+        p1_process = multiprocessing.Process(target=run_program, args=("website.p1", child_conn))
         p1_process.start()
-        # Wait for Program 2 to start (5 seconds)
-        print("Waiting for 'Camera Program p1' to start (5 seconds)...")
-        time.sleep(2)
-        send_command(parent_conn, 'initialize_camera')
-        time.sleep(3)
-
 
-        # Start Program 2 as a separate process
-        print("Program 'flask - control' started - will send commands to 'Image Stimuli Program p2'")
-        global parent_conn2, child_conn2  # Make pipes global
         parent_conn2, child_conn2 = multiprocessing.Pipe()
-        # Start Program 2 as a separate process
-        p2_process = multiprocessing.Process(target=p2.main, args=(child_conn2,))
+        p2_bus = CommandBus(parent_conn2, "Image Stimuli Program p2")
+        p2_process = multiprocessing.Process(target=run_program, args=("website.p2", child_conn2))
         p2_process.start()
-        # Wait for Program 2 to start (5 seconds)
-        time.sleep(2)
 
-        # Start Program 4 as a separate process
-        print("Program 'flask - control' started - will send commands to Program 'Video Stimuli Program p4'")
-        global parent_conn4, child_conn4  # Make pipes global
         parent_conn4, child_conn4 = multiprocessing.Pipe()
-        # Start Program 4 as a separate process
-        p4_process = multiprocessing.Process(target=p4.main, args=(child_conn4,))
+        p4_bus = CommandBus(parent_conn4, "Video Stimuli Program p4")
+        p4_process = multiprocessing.Process(target=run_program, args=("website.p4", child_conn4))
         p4_process.start()
-        # Wait for Program 4 to start (5 seconds)
-        time.sleep(2)
+
+        # Serve as soon as the required components are up; the others keep
+        # reporting "starting" through /component_status until they are ready
+        buses = {'p1': p1_bus, 'p2': p2_bus, 'p4': p4_bus}
+        for bus in buses.values():
+            threading.Thread(target=send_session_dir_when_ready, args=(bus,), daemon=True).start()
+        for name in REQUIRED_COMPONENTS:
+            if not buses[name].wait_ready(STARTUP_TIMEOUT):
+                print(f"WARNING: Required component {buses[name].name} is not ready "
+                      f"({buses[name].status}) after {STARTUP_TIMEOUT} s")
+        print(f"Control app ready in {time.perf_counter() - startup_start:.2f} s")
 
         # run flask app
         app.run(host='0.0.0.0', port=8082)
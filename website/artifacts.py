@@ -0,0 +1,283 @@
+"""
+Real-Time Artifact Detection
+
+Streaming detectors that flag artifacts while recording, so sessions do
+not need a separate offline artifact-rejection pass:
+
+- Eye blinks: large deflections of the same sign in both frontal channels
+  (AF7, AF8) after a 0.5-10 Hz band-pass
+- Jaw clenches: muscle (EMG) activity, the envelope of the EEG above 25 Hz
+  averaged over all channels
+- Head motion: angular speed from the gyroscope, and acceleration beyond
+  gravity from the accelerometer
+
+Each detector is a processor for the :class:`~website.realtime.ProcessingWorker`:
+it filters every chunk with the stateful stages of :mod:`website.realtime`,
+thresholds it in one vectorized step and tracks events across chunks, so a
+chunk costs tens of microseconds. Finished events (type, onset, offset on
+the LSL clock, peak) go to an :class:`ArtifactLog`, which keeps the recent
+ones for the live endpoint and passes each to its listeners, e.g. the
+recorder of the control application.
+"""
+
+import collections
+import threading
+import time
+from itertools import zip_longest
+
+import numpy as np
+
+from website.command_bus import LatencyHistogram
+from website.realtime import HighPassFilter, LowPassFilter, NotchFilter
+
+ARTIFACT_LOG_SIZE = 1000  # recent events kept for the live endpoint
+
+# Blinks: both frontal channels beyond the threshold (uV), 50-500 ms long
+BLINK_CHANNELS = ('AF7', 'AF8')
+BLINK_THRESHOLD = 80.0
+BLINK_DURATION = (0.05, 0.5)
+
+# Jaw clenches: EMG envelope (uV RMS above 25 Hz) beyond the threshold for at least 150 ms
+JAW_THRESHOLD = 25.0
+JAW_MIN_DURATION = 0.15
+
+# Head motion: angular speed (deg/s) or acceleration beyond gravity (g)
+GYRO_THRESHOLD = 20.0
+ACC_THRESHOLD = 0.15
+MOTION_MIN_DURATION = 0.1
+
+
+class ArtifactLog:
+    """
+    Thread-safe log of detected artifacts.
+
+    Attributes:
+        events (collections.deque): The most recent events, oldest first.
+        counts (collections.Counter): Number of events per type.
+    """
+    def __init__(self, size=ARTIFACT_LOG_SIZE):
+        self.events = collections.deque(maxlen=size)
+        self.counts = collections.Counter()
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        """Store an event and pass it to the listeners."""
+        with self._lock:
+            self.events.append(event)
+            self.counts[event['type']] += 1
+        for listener in self.listeners:
+            listener(event)
+
+    def recent(self, since=None):
+        """
+        Return the stored events.
+
+        Args:
+            since (float, optional): Only events whose offset is later than
+                this LSL time.
+
+        Returns:
+            list: Event dicts, oldest first.
+        """
+        with self._lock:
+            return [event for event in self.events if since is None or event['offset'] > since]
+
+
+class EventTracker:
+    """
+    Turns a per-sample detection mask into events, across chunks.
+
+    An event runs from the first sample of a run of detections to the first
+    sample after it; events shorter than ``min_duration`` or longer than
+    ``max_duration`` are discarded.
+    """
+    def __init__(self, min_duration=0.0, max_duration=None):
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.active = False
+        self.onset = None
+        self.peak = 0.0
+
+    def update(self, timestamps, mask, amplitude):
+        """
+        Process one chunk.
+
+        Args:
+            timestamps (numpy.ndarray): (n,) timestamps.
+            mask (numpy.ndarray): (n,) True where the artifact is detected.
+            amplitude (numpy.ndarray): (n,) value whose maximum is the event's peak.
+
+        Returns:
+            list: (onset, offset, peak) of the events that ended in this chunk.
+        """
+        if not len(timestamps):
+            return []
+        edges = np.diff(np.concatenate([[self.active], mask]).astype(np.int8))
+        starts = np.nonzero(edges == 1)[0]
+        ends = np.nonzero(edges == -1)[0]
+        events = []
+        if self.active:
+            if not len(ends):
+                self.peak = max(self.peak, float(amplitude.max()))
+                return events
+            end = ends[0]
+            if end:
+                self.peak = max(self.peak, float(amplitude[:end].max()))
+            events.append((self.onset, float(timestamps[end]), self.peak))
+            ends = ends[1:]
+            self.active = False
+        for start, end in zip_longest(starts, ends):
+            if end is None:
+                self.active = True
+                self.onset = float(timestamps[start])
+                self.peak = float(amplitude[start:].max())
+                break
+            events.append((float(timestamps[start]), float(timestamps[end]), float(amplitude[start:end].max())))
+        return [event for event in events if event[1] - event[0] >= self.min_duration and
+                (self.max_duration is None or event[1] - event[0] <= self.max_duration)]
+
+    def reset(self):
+        self.active = False
+        self.onset = None
+        self.peak = 0.0
+
+
+class _Detector:
+    """Base class: configures the filters, times each chunk and logs the finished events."""
+    event_type = "artifact"
+
+    def __init__(self, log, sfreq, channels, tracker):
+        self.log = log
+        self.sfreq = sfreq
+        self.channels = list(channels)
+        self.tracker = tracker
+        self.cost = LatencyHistogram()
+
+    def detect(self, timestamps, values):
+        """Return the (mask, amplitude) of a chunk."""
+        raise NotImplementedError
+
+    def process(self, timestamps, values):
+        start = time.perf_counter()
+        mask, amplitude = self.detect(timestamps, values[:, :len(self.channels)])
+        for onset, offset, peak in self.tracker.update(timestamps, mask, amplitude):
+            self.log.add(self.event(onset, offset, peak))
+        self.cost.add((time.perf_counter() - start) * 1000.0)
+
+    def event(self, onset, offset, peak):
+        return {'type': self.event_type, 'onset': onset, 'offset': offset,
+                'duration': offset - onset, 'peak': peak}
+
+    def status(self):
+        return {'events': self.log.counts[self.event_type], 'cost': self.cost.to_dict()}
+
+
+class BlinkDetector(_Detector):
+    """
+    Detects eye blinks in the frontal EEG channels.
+
+    Args:
+        log (ArtifactLog): Receives the events.
+        sfreq (float): EEG sample rate.
+        channels (list): EEG channel names.
+        threshold (float): Deflection in uV that both channels must exceed.
+    """
+    event_type = "blink"
+
+    def __init__(self, log, sfreq, channels, threshold=BLINK_THRESHOLD):
+        super().__init__(log, sfreq, channels, EventTracker(*BLINK_DURATION))
+        self.threshold = threshold
+        self._indices = [self.channels.index(channel) for channel in BLINK_CHANNELS]
+        frontal = list(BLINK_CHANNELS)
+        self.filters = [HighPassFilter(0.5), LowPassFilter(10.0)]
+        for stage in self.filters:
+            stage.configure(sfreq, frontal)
+
+    def detect(self, timestamps, values):
+        frontal = values[:, self._indices]
+        for stage in self.filters:
+            timestamps, frontal = stage.process(timestamps, frontal)
+        same_sign = np.sign(frontal[:, 0]) == np.sign(frontal[:, 1])
+        amplitude = np.abs(frontal).min(axis=1)
+        return same_sign & (amplitude > self.threshold), amplitude
+
+
+class JawClenchDetector(_Detector):
+    """
+    Detects jaw clenches from the muscle activity in all EEG channels.
+
+    The EEG is notch-filtered at the line frequency and high-passed at
+    25 Hz; the mean square over channels is smoothed by a 5 Hz low-pass to
+    an RMS envelope.
+
+    Args:
+        log (ArtifactLog): Receives the events.
+        sfreq (float): EEG sample rate.
+        channels (list): EEG channel names.
+        threshold (float): Envelope in uV RMS.
+        line_freq (float): Power-line frequency removed before.
+    """
+    event_type = "jaw_clench"
+
+    def __init__(self, log, sfreq, channels, threshold=JAW_THRESHOLD, line_freq=50.0):
+        super().__init__(log, sfreq, channels, EventTracker(JAW_MIN_DURATION))
+        self.threshold = threshold
+        self.filters = [NotchFilter(line_freq), HighPassFilter(25.0, order=4)]
+        for stage in self.filters:
+            stage.configure(sfreq, self.channels)
+        self.envelope = LowPassFilter(5.0, order=2)
+        self.envelope.configure(sfreq, ['power'])
+
+    def detect(self, timestamps, values):
+        emg = values
+        for stage in self.filters:
+            timestamps, emg = stage.process(timestamps, emg)
+        _, power = self.envelope.process(timestamps, (emg ** 2).mean(axis=1, keepdims=True))
+        amplitude = np.sqrt(np.maximum(power[:, 0], 0.0))
+        return amplitude > self.threshold, amplitude
+
+
+class MotionDetector(_Detector):
+    """
+    Detects head motion from the gyroscope or the accelerometer.
+
+    For the gyroscope the magnitude of the angular velocity is used; for
+    the accelerometer each axis is high-passed at 0.3 Hz, removing gravity
+    whatever the head orientation, and the magnitude of the rest is used.
+    The magnitude is smoothed by a 2 Hz low-pass, so that one oscillating
+    movement gives one event, and thresholded.
+
+    Args:
+        log (ArtifactLog): Receives the events.
+        stream (str): ``gyro`` or ``acc``.
+        sfreq (float): Sample rate of the stream.
+        threshold (float, optional): deg/s or g, defaults per stream.
+    """
+    event_type = "head_motion"
+
+    def __init__(self, log, stream, sfreq, threshold=None):
+        super().__init__(log, sfreq, ['X', 'Y', 'Z'], EventTracker(MOTION_MIN_DURATION))
+        self.stream = stream
+        self.threshold = threshold or (GYRO_THRESHOLD if stream == 'gyro' else ACC_THRESHOLD)
+        self.gravity = None
+        if stream == 'acc':
+            self.gravity = HighPassFilter(0.3)
+            self.gravity.configure(sfreq, self.channels)
+        self.envelope = LowPassFilter(2.0, order=2)
+        self.envelope.configure(sfreq, ['magnitude'])
+
+    def detect(self, timestamps, values):
+        if self.gravity is not None:
+            timestamps, values = self.gravity.process(timestamps, values)
+        _, magnitude = self.envelope.process(timestamps, np.sqrt((values ** 2).sum(axis=1, keepdims=True)))
+        amplitude = magnitude[:, 0]
+        return amplitude > self.threshold, amplitude
+
+    def event(self, onset, offset, peak):
+        event = super().event(onset, offset, peak)
+        event['source'] = self.stream
+        return event
+
+    def status(self):
+        return {'events': self.log.counts[self.event_type], 'source': self.stream, 'cost': self.cost.to_dict()}
@@ -0,0 +1,228 @@
+"""
+Batch Post-Processing of Recorded Sessions
+
+Command-line entry point that walks a study directory and post-processes
+every session (see :mod:`website.session`) in parallel:
+
+1. Finalize the session if it is open or its files changed since it was
+   finalized (manifest and alignment index)
+2. Convert each raw ``recorded_data_*.json`` to its columnar cache
+   (see :mod:`website.recordings`)
+3. Band-pass filter the EEG
+4. Compute band powers per channel
+5. Epoch the filtered EEG around the stimulus events
+6. Export everything to the session's ``processed/`` directory
+
+Sessions are distributed over a process pool, one session per task.
+A session is skipped when its ``processed/summary.json`` was produced from
+the same input files and parameters, so an interrupted batch resumes where
+it stopped.
+
+Usage:
+    python -m website.batch data/sessions --workers 16
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from website.analysis import FREQUENCY_BANDS, bandpass_filter, band_powers
+from website.epochs import load_epochs
+from website.recordings import STREAM_CHANNELS, STREAM_RATES, load_recording
+from website.session import Session, STATUS_FINALIZED, list_sessions
+
+PROCESSED_DIR_NAME = "processed"
+SUMMARY_NAME = "summary.json"
+PIPELINE_VERSION = 2  # bump when the outputs change to reprocess all sessions
+
+# Session files whose changes make the outputs stale
+INPUT_ROLES = ('eeg_recording', 'image_stimuli_log', 'video_stimuli_log')
+# Session files the alignment index is built from
+ALIGNMENT_ROLES = INPUT_ROLES + ('camera_video', 'camera_timestamps')
+
+
+def _file_signature(files, roles):
+    return [[f['name'], f['size'], f['mtime']] for f in files if f['role'] in roles]
+
+
+def input_signature(session, params):
+    """Return the inputs and parameters that a session's outputs depend on."""
+    return {'version': PIPELINE_VERSION, 'params': params, 'files': _file_signature(session.scan_files(), INPUT_ROLES)}
+
+
+def needs_finalize(session):
+    """Return True if the session is open or its alignment index was built from other files."""
+    if session.manifest.get('status') != STATUS_FINALIZED:
+        return True
+    return _file_signature(session.manifest.get('files', []), ALIGNMENT_ROLES) != \
+        _file_signature(session.scan_files(), ALIGNMENT_ROLES)
+
+
+def is_up_to_date(session, params):
+    """Return True if the session's outputs were produced from its current inputs and ``params``."""
+    summary_path = os.path.join(session.path, PROCESSED_DIR_NAME, SUMMARY_NAME)
+    if not os.path.exists(summary_path):
+        return False
+    try:
+        with open(summary_path, 'r') as file:
+            summary = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return summary.get('signature') == input_signature(session, params)
+
+
+def process_session(session_path, params, force=False):
+    """
+    Post-process one session. Runs in a worker process.
+
+    Args:
+        session_path (str): Session directory.
+        params (dict): ``l_freq``, ``h_freq``, ``tmin``, ``tmax`` and ``baseline``.
+        force (bool): Reprocess even if the outputs are up to date.
+
+    Returns:
+        dict: ``session``, ``status`` (``processed``, ``skipped`` or
+        ``failed``), ``seconds``, ``input_bytes``, ``trials`` and ``error``.
+    """
+    start = time.perf_counter()
+    result = {'session': session_path, 'status': 'processed', 'seconds': 0.0,
+              'input_bytes': 0, 'trials': 0, 'error': None}
+    try:
+        session = Session(session_path)
+        if not force and is_up_to_date(session, params):
+            result['status'] = 'skipped'
+            return result
+        # Epoching uses the alignment index, which must match the current files
+        if needs_finalize(session):
+            session.finalize()
+
+        output_dir = os.path.join(session.path, PROCESSED_DIR_NAME)
+        os.makedirs(output_dir, exist_ok=True)
+        sfreq = STREAM_RATES['eeg']
+
+        powers = {}
+        for path in session.files_with_role('eeg_recording'):
+            result['input_bytes'] += os.path.getsize(path)
+            base = os.path.splitext(os.path.basename(path))[0]
+
+            # Convert the raw JSON recording to its columnar cache (once)
+            recording = load_recording(path)
+
+            # Filter the EEG and compute its band powers
+            filtered = bandpass_filter(recording['eeg']['values'], sfreq, params['l_freq'], params['h_freq'])
+            np.savez(os.path.join(output_dir, f"{base}_eeg_filtered.npz"),
+                     timestamps=recording['eeg']['timestamps'], values=filtered)
+            powers[base] = band_powers(filtered, sfreq)
+
+        # Epoch the filtered EEG around the stimulus events
+        epochs = load_epochs(session.path, params['tmin'], params['tmax'], params['baseline'],
+                             l_freq=params['l_freq'], h_freq=params['h_freq'])
+        np.savez(os.path.join(output_dir, "epochs.npz"), data=epochs['data'], times=epochs['times'],
+                 labels=np.asarray(epochs['labels']), event_times=epochs['event_times'])
+        result['trials'] = len(epochs['labels'])
+
+        # Export band powers as a table: one row per recording and channel
+        with open(os.path.join(output_dir, "band_powers.csv"), 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['recording', 'channel'] + list(FREQUENCY_BANDS))
+            for base, recording_powers in powers.items():
+                for ch, channel in enumerate(STREAM_CHANNELS['eeg']):
+                    writer.writerow([base, channel] + [recording_powers[band][ch] if recording_powers[band] else ""
+                                                       for band in FREQUENCY_BANDS])
+
+        result['seconds'] = time.perf_counter() - start
+        with open(os.path.join(output_dir, SUMMARY_NAME), 'w') as file:
+            json.dump({
+                'signature': input_signature(session, params),
+                'processed': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'seconds': result['seconds'],
+                'trials': result['trials'],
+                'dropped_trials': epochs['dropped'],
+                'band_powers': powers
+            }, file, indent=4)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(study_dir, params, workers=None, force=False):
+    """
+    Post-process all sessions below a study directory in a process pool.
+
+    Args:
+        study_dir (str): Directory searched recursively for session manifests.
+        params (dict): Processing parameters, see :func:`process_session`.
+        workers (int, optional): Worker processes, defaults to the CPU count.
+        force (bool): Reprocess sessions whose outputs are up to date.
+
+    Returns:
+        dict: Counts per status, ``seconds``, ``sessions_per_second``,
+        ``mb_per_second`` and the per-session ``results``.
+    """
+    sessions = [session.path for session in list_sessions(study_dir)]
+    workers = workers or os.cpu_count() or 1
+    print(f"Batch: {len(sessions)} sessions in {study_dir}, {workers} workers")
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_session, path, params, force) for path in sessions]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            line = f"Batch: [{done}/{len(sessions)}] {result['session']}: {result['status']}"
+            if result['status'] == 'processed':
+                line += f" ({result['trials']} trials, {result['seconds']:.2f} s)"
+            elif result['status'] == 'failed':
+                line += f" ({result['error']})"
+            print(line)
+    elapsed = time.perf_counter() - start
+
+    processed = [r for r in results if r['status'] == 'processed']
+    input_mb = sum(r['input_bytes'] for r in processed) / 1e6
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('processed', 'skipped', 'failed')}
+    summary.update({
+        'seconds': elapsed,
+        'sessions_per_second': len(processed) / elapsed if elapsed > 0 else None,
+        'mb_per_second': input_mb / elapsed if elapsed > 0 else None,
+        'results': results
+    })
+    print(f"Batch: {summary['processed']} processed, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed in {elapsed:.1f} s "
+          f"({summary['sessions_per_second'] or 0:.2f} sessions/s, {summary['mb_per_second'] or 0:.1f} MB/s)")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Post-process all recorded sessions of a study in parallel.")
+    parser.add_argument("study_dir", help="directory containing the session directories")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="reprocess sessions whose outputs are up to date")
+    parser.add_argument("--l-freq", type=float, default=1.0, help="high-pass edge in Hz")
+    parser.add_argument("--h-freq", type=float, default=40.0, help="low-pass edge in Hz")
+    parser.add_argument("--tmin", type=float, default=-0.2, help="epoch start in seconds")
+    parser.add_argument("--tmax", type=float, default=0.8, help="epoch end in seconds")
+    parser.add_argument("--no-baseline", action="store_true", help="skip the pre-stimulus baseline correction")
+    args = parser.parse_args(argv)
+
+    params = {
+        'l_freq': args.l_freq,
+        'h_freq': args.h_freq,
+        'tmin': args.tmin,
+        'tmax': args.tmax,
+        'baseline': None if args.no_baseline else [None, 0.0]
+    }
+    summary = run_batch(args.study_dir, params, args.workers, args.force)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
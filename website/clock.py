@@ -0,0 +1,201 @@
+"""
+Project Clock
+
+One clock for every timestamp of the control application and the child
+programs, instead of LSL time on the EEG side and ``datetime.now()`` in
+the camera and stimulus programs:
+
+- :func:`now` is ``pylsl.local_clock()``, a monotonic high-resolution clock
+  that every process on the machine shares and in which the Muse samples
+  and the stimulus markers are already timestamped.
+- Wall-clock times are derived from it with one published offset,
+  :func:`wall_time`, so they do not jump when NTP adjusts the system time
+  and wall times written by different processes stay comparable to within
+  microseconds. The control application estimates the offset once at
+  startup and passes it to the child programs in the
+  :data:`WALL_OFFSET_ENV` environment variable.
+- :class:`ClockMonitor` re-estimates the offset periodically, together with
+  the LSL time correction of the Muse inlets, so the drift of the wall
+  clock and the uncertainty of every clock mapping are known; the
+  estimates are saved as ``clock_offsets.json`` in the session.
+
+Offsets are estimated like NTP does: the wall clock is read between two
+reads of the monotonic clock, and the estimate of the tightest of several
+brackets is kept, its half-width being the uncertainty.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+WALL_OFFSET_ENV = "NEUROCUE_WALL_OFFSET"  # offset published to the child programs
+OFFSET_SAMPLES = 20  # brackets per offset estimate
+MONITOR_INTERVAL = 30.0  # seconds between periodic estimates
+MONITOR_HISTORY = 2880  # estimates kept, i.e. a day at the default interval
+TIME_CORRECTION_TIMEOUT = 2.0  # seconds to wait for an LSL time correction
+CLOCK_OFFSETS_NAME = "clock_offsets.json"
+
+_local_clock = None
+_wall_offset = None
+
+
+def now():
+    """
+    Return the project clock time in seconds, i.e. ``pylsl.local_clock()``.
+
+    pylsl is imported on the first call, so importing this module keeps the
+    control application light (see the note in :mod:`website.app`).
+    """
+    global _local_clock
+    if _local_clock is None:
+        from pylsl import local_clock
+        _local_clock = local_clock
+    return _local_clock()
+
+
+def estimate_wall_offset(samples=OFFSET_SAMPLES):
+    """
+    Measure the offset from :func:`now` to the wall clock.
+
+    Returns:
+        tuple: (offset, uncertainty) in seconds, with
+        ``wall time = now() + offset``.
+    """
+    best = None
+    for _ in range(samples):
+        before = now()
+        wall = time.time()
+        after = now()
+        if best is None or after - before < best[1]:
+            best = (wall - (before + after) / 2.0, after - before)
+    return best[0], best[1] / 2.0
+
+
+def wall_offset():
+    """
+    Return the offset used by :func:`wall_time`.
+
+    The offset published in :data:`WALL_OFFSET_ENV` if there is one,
+    otherwise this process's own estimate, made on the first call.
+    """
+    global _wall_offset
+    if _wall_offset is None:
+        published = os.environ.get(WALL_OFFSET_ENV)
+        _wall_offset = float(published) if published else estimate_wall_offset()[0]
+    return _wall_offset
+
+
+def publish_wall_offset():
+    """
+    Estimate the offset and publish it to the processes started from now on.
+
+    Called by the control application before it starts the child programs.
+
+    Returns:
+        float: The published offset.
+    """
+    global _wall_offset
+    _wall_offset, _ = estimate_wall_offset()
+    os.environ[WALL_OFFSET_ENV] = repr(_wall_offset)
+    return _wall_offset
+
+
+def wall_time(timestamp=None):
+    """Return the wall-clock time (seconds since the epoch) of a :func:`now` timestamp, default now."""
+    return (now() if timestamp is None else timestamp) + wall_offset()
+
+
+def wall_datetime(timestamp=None):
+    """Return the local ``datetime`` of a :func:`now` timestamp, default now."""
+    return datetime.fromtimestamp(wall_time(timestamp))
+
+
+class ClockMonitor(threading.Thread):
+    """
+    Periodically estimates the clock offsets of the running session.
+
+    Each estimate holds the time (:func:`now`), the measured wall offset and
+    its uncertainty, the drift from the published offset, and the LSL time
+    correction (source clock to :func:`now`) of every inlet.
+
+    Args:
+        inlets (callable, optional): Returns the LSL inlets to query as a
+            dict of name to ``pylsl.StreamInlet``.
+        interval (float): Seconds between estimates.
+
+    Attributes:
+        estimates (collections.deque): The most recent estimates, oldest first.
+    """
+    def __init__(self, inlets=None, interval=MONITOR_INTERVAL):
+        super().__init__(daemon=True, name="ClockMonitor")
+        self.inlets = inlets
+        self.interval = interval
+        self.estimates = collections.deque(maxlen=MONITOR_HISTORY)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def estimate(self):
+        """Make one estimate, store it and return it."""
+        offset, uncertainty = estimate_wall_offset()
+        corrections = {}
+        for name, inlet in (self.inlets() if self.inlets is not None else {}).items():
+            try:
+                corrections[name] = inlet.time_correction(timeout=TIME_CORRECTION_TIMEOUT)
+            except Exception as e:
+                print(f"ClockMonitor: No time correction for {name}: {e}")
+        estimate = {
+            'time': now(),
+            'wall_offset': offset,
+            'uncertainty_ms': uncertainty * 1000.0,
+            'wall_drift_ms': (offset - wall_offset()) * 1000.0,
+            'time_corrections': corrections
+        }
+        with self._lock:
+            self.estimates.append(estimate)
+        return estimate
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.estimate()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def report(self, since=None):
+        """
+        Summarize the estimates.
+
+        Args:
+            since (float, optional): Only estimates at or after this :func:`now` time.
+
+        Returns:
+            dict: The published offset, the largest offset uncertainty and
+            wall-clock drift, the spread (max - min) of each inlet's time
+            correction, all in ms, and the estimates themselves.
+        """
+        with self._lock:
+            estimates = [e for e in self.estimates if since is None or e['time'] >= since]
+        spreads = {}
+        for estimate in estimates:
+            for name, correction in estimate['time_corrections'].items():
+                low, high = spreads.get(name, (correction, correction))
+                spreads[name] = (min(low, correction), max(high, correction))
+        return {
+            'wall_offset': wall_offset(),
+            'estimates_count': len(estimates),
+            'max_uncertainty_ms': max((e['uncertainty_ms'] for e in estimates), default=None),
+            'max_abs_wall_drift_ms': max((abs(e['wall_drift_ms']) for e in estimates), default=None),
+            'time_correction_spread_ms': {name: (high - low) * 1000.0 for name, (low, high) in spreads.items()},
+            'estimates': estimates
+        }
+
+    def save(self, path, since=None):
+        """Write :meth:`report` to a JSON file and return it."""
+        report = self.report(since)
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=4)
+        return report
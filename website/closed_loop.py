@@ -0,0 +1,232 @@
+"""
+Closed-Loop Stimulus Triggering
+
+Presents the next image of a run when a live EEG or PPG feature crosses a
+threshold, instead of after a fixed duration:
+
+1. A feature is updated on every chunk by the
+   :class:`~website.realtime.ProcessingWorker`: :class:`BandPowerFeature`
+   (band power of some EEG channels, e.g. frontal alpha) or
+   :class:`MetricFeature` (a metric of the
+   :class:`~website.ppg.HeartRateMonitor`, e.g. the heart rate).
+2. :class:`ClosedLoopTrigger` finds the sample at which the feature crosses
+   the threshold (with hysteresis and a refractory period) and sends a
+   trigger to the image program p2 as a one-way notification on its command
+   pipe, so the worker never waits for the child.
+3. p2 waits for triggers with the frames of the run already prepared, shows
+   the next one as soon as a trigger arrives, drops triggers that are too
+   old, and logs the timing of every trial.
+
+Every step is timestamped on the LSL clock, which all processes on the
+machine share, so the latency of each trial is split into its parts:
+
+- ``acquisition_ms``: crossing sample -> chunk pulled by the acquisition thread
+- ``processing_ms``: chunk pulled -> trigger decided by the worker
+- ``transport_ms``: trigger decided -> received by p2
+- ``display_ms``: received by p2 -> image on screen
+- ``total_ms``: chunk pulled -> image on screen
+
+The feature filters add their group delay on top, e.g. about 100 ms for the
+default band-power smoothing; it is a property of the feature, not of the
+system, and is not part of the logged latency.
+"""
+
+import time
+
+import numpy as np
+
+from website.command_bus import LatencyHistogram
+from website.realtime import HighPassFilter, LowPassFilter
+
+FEATURE_BANDS = {
+    'theta': (4.0, 8.0),
+    'alpha': (8.0, 13.0),
+    'beta': (13.0, 30.0)
+}
+FEATURE_CHANNELS = ('AF7', 'AF8')  # frontal channels
+FEATURE_SMOOTHING = 2.0  # Hz, low-pass of the band power
+REFRACTORY = 0.5  # seconds of sample time between two triggers
+
+
+class BandPowerFeature:
+    """
+    Smoothed power of an EEG frequency band, averaged over some channels.
+
+    The channels are band-passed with stateful filters, squared, averaged
+    and low-passed, so every sample gets a feature value at a cost linear
+    in the chunk size.
+
+    Args:
+        sfreq (float): EEG sample rate.
+        channels (list): EEG channel names.
+        band (str or tuple): Name in :data:`FEATURE_BANDS` or (low, high) in Hz.
+        picks (tuple): Channels averaged.
+        smoothing (float): Cutoff in Hz of the power low-pass.
+    """
+    def __init__(self, sfreq, channels, band='alpha', picks=FEATURE_CHANNELS, smoothing=FEATURE_SMOOTHING):
+        low, high = FEATURE_BANDS[band] if isinstance(band, str) else band
+        self.name = f"{band}_power" if isinstance(band, str) else f"{low:g}-{high:g}Hz_power"
+        self.unit = "uV^2"
+        self._indices = [list(channels).index(channel) for channel in picks]
+        self.filters = [HighPassFilter(low, order=4), LowPassFilter(high, order=4)]
+        for stage in self.filters:
+            stage.configure(sfreq, list(picks))
+        self.envelope = LowPassFilter(smoothing, order=2)
+        self.envelope.configure(sfreq, ['power'])
+
+    def update(self, timestamps, values):
+        """Return the (timestamps, feature values) of an EEG chunk."""
+        band = values[:, self._indices]
+        for stage in self.filters:
+            timestamps, band = stage.process(timestamps, band)
+        timestamps, power = self.envelope.process(timestamps, (band ** 2).mean(axis=1, keepdims=True))
+        return timestamps, np.maximum(power[:, 0], 0.0)
+
+
+class MetricFeature:
+    """
+    Metric of a :class:`~website.ppg.HeartRateMonitor`, read after each PPG chunk.
+
+    Must be registered for the PPG stream after the monitor, so it sees the
+    metrics updated with the same chunk.
+
+    Args:
+        monitor (HeartRateMonitor): Source of the metric.
+        metric (str): Name in :data:`website.ppg.METRIC_NAMES`, e.g. ``heart_rate``.
+    """
+    def __init__(self, monitor, metric='heart_rate'):
+        self.monitor = monitor
+        self.name = metric
+        self.unit = "bpm" if metric.endswith('heart_rate') else "ms"
+
+    def update(self, timestamps, values):
+        """Return the last timestamp of a PPG chunk and the current metric value."""
+        return timestamps[-1:], np.array([float(self.monitor.metrics[self.name])])
+
+
+class ClosedLoopTrigger:
+    """
+    Sends a trigger when a live feature crosses a threshold.
+
+    A trigger fires when the feature goes beyond the threshold while armed;
+    it is re-armed once the feature is back by more than ``hysteresis``
+    and no second trigger fires within ``refractory`` seconds. Triggers are
+    only sent while a closed-loop run is active.
+
+    Args:
+        feature (BandPowerFeature or MetricFeature): Feature computed on each chunk.
+        threshold (float): Threshold in the feature's unit.
+        send (callable): Called with each trigger dict; must not block,
+            e.g. :meth:`~website.command_bus.CommandBus.notify`.
+        direction (str): ``above`` (rising crossing) or ``below`` (falling).
+        hysteresis (float): Distance from the threshold needed to re-arm.
+        refractory (float): Minimum seconds of sample time between triggers.
+        clock (callable): Clock of the decision timestamps, the LSL clock in
+            the control application.
+        worker (ProcessingWorker, optional): Worker running the trigger,
+            whose ``arrival`` is the time the chunk was pulled.
+
+    Attributes:
+        active (bool): True during a closed-loop run.
+        value (float or None): Latest feature value.
+        triggers (int): Triggers sent in the current run.
+        cost (LatencyHistogram): Processing time per chunk.
+        decision_latency (LatencyHistogram): Chunk pulled -> trigger decided.
+    """
+    def __init__(self, feature, threshold, send, direction='above', hysteresis=0.0, refractory=REFRACTORY,
+                 clock=time.perf_counter, worker=None):
+        if direction not in ('above', 'below'):
+            raise ValueError(f"Unknown direction: {direction}")
+        self.feature = feature
+        self.threshold = threshold
+        self.send = send
+        self.direction = direction
+        self.hysteresis = hysteresis
+        self.refractory = refractory
+        self.clock = clock
+        self.worker = worker
+        self.active = False
+        self.armed = False
+        self.value = None
+        self.triggers = 0
+        self.last_trigger = None
+        self.cost = LatencyHistogram()
+        self.decision_latency = LatencyHistogram()
+
+    def start(self, threshold=None, direction=None):
+        """
+        Start sending triggers, optionally with a new threshold or direction.
+
+        Raises:
+            ValueError: If the threshold is not a number or the direction is unknown.
+        """
+        if direction is not None and direction not in ('above', 'below'):
+            raise ValueError(f"Unknown direction: {direction}")
+        if threshold is not None:
+            try:
+                threshold = float(threshold)
+            except (TypeError, ValueError):
+                raise ValueError(f"Threshold is not a number: {threshold!r}")
+            self.threshold = threshold
+        if direction is not None:
+            self.direction = direction
+        # A feature already beyond the threshold has to come back first
+        self.armed = False
+        self.triggers = 0
+        self.last_trigger = None
+        self.decision_latency = LatencyHistogram()
+        self.active = True
+
+    def stop(self):
+        """Stop sending triggers."""
+        self.active = False
+
+    def process(self, timestamps, values):
+        start = time.perf_counter()
+        times, feature = self.feature.update(timestamps, values)
+        if len(feature):
+            self.value = float(feature[-1])
+        if self.active:
+            if self.direction == 'above':
+                beyond = feature > self.threshold
+                back = feature <= self.threshold - self.hysteresis
+            else:
+                beyond = feature < self.threshold
+                back = feature >= self.threshold + self.hysteresis
+            for i in np.nonzero(beyond | back)[0]:
+                if self.armed and beyond[i]:
+                    if self.last_trigger is None or times[i] - self.last_trigger >= self.refractory:
+                        self._fire(float(times[i]), float(feature[i]))
+                elif not self.armed and back[i]:
+                    self.armed = True
+        self.cost.add((time.perf_counter() - start) * 1000.0)
+
+    def _fire(self, sample_time, value):
+        decision = self.clock()
+        arrival = self.worker.arrival if self.worker is not None else decision
+        self.armed = False
+        self.last_trigger = sample_time
+        self.triggers += 1
+        self.send({
+            'feature': self.feature.name,
+            'value': value,
+            'threshold': self.threshold,
+            'sample_time': sample_time,
+            'arrival': arrival,
+            'decision': decision
+        })
+        self.decision_latency.add((decision - arrival) * 1000.0)
+
+    def status(self):
+        return {
+            'active': self.active,
+            'feature': self.feature.name,
+            'unit': self.feature.unit,
+            'value': self.value,
+            'threshold': self.threshold,
+            'direction': self.direction,
+            'armed': self.armed,
+            'triggers': self.triggers,
+            'cost': self.cost.to_dict(),
+            'decision_latency': self.decision_latency.to_dict()
+        }
@@ -0,0 +1,318 @@
+"""
+Command Bus for the Child Programs
+
+Replaces the bare ``conn.send`` / ``conn.recv`` exchange with the child
+programs (p1, p2, p4) by request/reply messages that carry a request id.
+Each child pipe gets one :class:`CommandBus` in the control application
+with a dedicated dispatcher thread that routes replies to the waiting
+caller, so several Flask requests can have commands in flight on the same
+pipe, callers wait with a timeout, and a hung child cannot block a request
+thread forever.
+
+Message format:
+- Request: ``{"id": 7, "command": "start_stimuli", "data": None}``
+- Reply:   ``{"id": 7, "response": "Stimuli started"}``
+- Status:  ``{"event": "status", "status": "ready", "detail": {...}}``
+- Notification: ``{"command": "closed_loop_trigger", "data": {...}}``, a
+  one-way request without id that the child handles without replying
+
+Child programs use :func:`unpack_request` and :func:`send_reply`, which also
+accept plain command strings so the programs can still be driven manually,
+and report their startup progress with :func:`send_status` so the control
+application knows when a child is ready instead of sleeping a fixed time.
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+DEFAULT_TIMEOUT = 5.0  # seconds to wait for a reply
+
+# Component states reported with send_status
+STATUS_STARTING = "starting"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# Serializes sends on the child end, where the listener replies while other
+# threads report status
+_child_send_lock = threading.Lock()
+
+# Upper bucket edges (ms) of the per-command latency histograms
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class CommandTimeout(TimeoutError):
+    """Raised when a child does not reply to a command in time."""
+
+
+class LatencyHistogram:
+    """
+    Thread-safe histogram of command round-trip latencies.
+
+    Attributes:
+        counts (list): Number of samples per bucket of ``LATENCY_BUCKETS_MS``,
+            with one extra overflow bucket at the end.
+        count (int): Total number of samples.
+        total_ms (float): Sum of all latencies.
+        min_ms (float or None): Smallest latency.
+        max_ms (float or None): Largest latency.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms):
+        """Add one latency sample in milliseconds."""
+        index = len(LATENCY_BUCKETS_MS)
+        for i, edge in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= edge:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += latency_ms
+            self.min_ms = latency_ms if self.min_ms is None else min(self.min_ms, latency_ms)
+            self.max_ms = latency_ms if self.max_ms is None else max(self.max_ms, latency_ms)
+
+    def to_dict(self):
+        """
+        Return the histogram as a JSON-serializable dict.
+
+        Returns:
+            dict: ``count``, ``mean_ms``, ``min_ms``, ``max_ms`` and ``buckets``
+            mapping each upper edge (``"<=1ms"``, ..., ``">5000ms"``) to its count.
+        """
+        with self._lock:
+            labels = [f"<={edge}ms" for edge in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+            return {
+                'count': self.count,
+                'mean_ms': self.total_ms / self.count if self.count else None,
+                'min_ms': self.min_ms,
+                'max_ms': self.max_ms,
+                'buckets': dict(zip(labels, self.counts))
+            }
+
+
+class CommandBus:
+    """
+    Parent-side endpoint of a child program's command pipe.
+
+    Attributes:
+        conn (multiprocessing.Connection): Parent end of the pipe.
+        name (str): Name of the child program, used in log messages.
+        default_timeout (float): Seconds to wait for a reply by default.
+        closed (bool): True once the pipe has been closed by the child.
+        latency (dict): :class:`LatencyHistogram` per command.
+        status (str): Last state reported by the child (``starting``,
+            ``ready`` or ``failed``).
+        status_detail (dict): Details sent with the last status report.
+        started_at (float): ``time.perf_counter()`` when the bus was created.
+        ready_at (float or None): ``time.perf_counter()`` when the child
+            reported ``ready`` or ``failed``.
+    """
+    def __init__(self, conn, name, default_timeout=DEFAULT_TIMEOUT):
+        self.conn = conn
+        self.name = name
+        self.default_timeout = default_timeout
+        self.closed = False
+        self.latency = {}
+        self.status = STATUS_STARTING
+        self.status_detail = {}
+        self.started_at = time.perf_counter()
+        self.ready_at = None
+        self._ready_event = threading.Event()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._dispatcher = threading.Thread(target=self._dispatch, name=f"{name}-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def request(self, command, data=None, timeout=None):
+        """
+        Send a command and wait for its reply.
+
+        Safe to call from several threads at once.
+
+        Args:
+            command (str): Command string, e.g. ``start_stimuli``.
+            data (Any, optional): Payload sent with the command (e.g. JSON config).
+            timeout (float, optional): Seconds to wait, defaults to ``default_timeout``.
+
+        Returns:
+            Any: The child's response.
+
+        Raises:
+            CommandTimeout: If no reply arrives within the timeout.
+            ConnectionError: If the pipe to the child is closed.
+        """
+        if self.closed:
+            raise ConnectionError(f"{self.name}: command pipe is closed")
+        if timeout is None:
+            timeout = self.default_timeout
+
+        request_id = next(self._ids)
+        future = Future()
+        with self._pending_lock:
+            self._pending[request_id] = future
+
+        sent_at = time.perf_counter()
+        try:
+            with self._send_lock:
+                self.conn.send({'id': request_id, 'command': command, 'data': data})
+            response = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise CommandTimeout(f"{self.name}: no reply to '{command}' within {timeout} s")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+
+        latency_ms = (time.perf_counter() - sent_at) * 1000
+        self.latency.setdefault(command, LatencyHistogram()).add(latency_ms)
+        print(f"{self.name}: '{command}' -> {response} (round trip {latency_ms:.2f} ms)")
+        return response
+
+    def notify(self, command, data=None):
+        """
+        Send a command without waiting for a reply.
+
+        For time-critical one-way messages, e.g. closed-loop triggers sent
+        from the processing worker, which must not block on the child.
+
+        Args:
+            command (str): Command string.
+            data (Any, optional): Payload sent with the command.
+
+        Returns:
+            bool: False if the pipe to the child is closed.
+        """
+        if self.closed:
+            return False
+        try:
+            with self._send_lock:
+                self.conn.send({'command': command, 'data': data})
+        except OSError:
+            return False
+        return True
+
+    def _dispatch(self):
+        """Route replies from the child to the callers waiting for them."""
+        try:
+            while True:
+                message = self.conn.recv()
+                if isinstance(message, dict) and message.get('event') == 'status':
+                    self._update_status(message.get('status'), message.get('detail') or {})
+                    continue
+                if not isinstance(message, dict) or 'id' not in message:
+                    print(f"{self.name}: Ignoring unexpected message: {message}")
+                    continue
+                with self._pending_lock:
+                    future = self._pending.get(message['id'])
+                if future is not None and not future.done():
+                    future.set_result(message.get('response'))
+        except (EOFError, OSError):
+            print(f"{self.name}: Command pipe closed")
+        finally:
+            self.closed = True
+            if self.status == STATUS_STARTING:
+                self._update_status(STATUS_FAILED, {'error': 'command pipe closed'})
+            with self._pending_lock:
+                pending = list(self._pending.values())
+            for future in pending:
+                if not future.done():
+                    future.set_exception(ConnectionError(f"{self.name}: command pipe closed"))
+
+    def _update_status(self, status, detail):
+        self.status = status
+        self.status_detail = detail
+        if status in (STATUS_READY, STATUS_FAILED) and not self._ready_event.is_set():
+            self.ready_at = time.perf_counter()
+            self._ready_event.set()
+        print(f"{self.name}: status {status} {detail}")
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait until the child reports ``ready`` or ``failed``.
+
+        Args:
+            timeout (float, optional): Seconds to wait, None waits forever.
+
+        Returns:
+            bool: True if the child reported ``ready``.
+        """
+        self._ready_event.wait(timeout)
+        return self.status == STATUS_READY
+
+    def status_info(self):
+        """
+        Return the child's state as a JSON-serializable dict.
+
+        Returns:
+            dict: ``status``, ``detail`` and ``startup_ms`` (None while starting).
+        """
+        startup_ms = None
+        if self.ready_at is not None:
+            startup_ms = (self.ready_at - self.started_at) * 1000
+        return {'status': self.status, 'detail': self.status_detail, 'startup_ms': startup_ms}
+
+    def stats(self):
+        """Return the latency histogram of every command sent so far."""
+        return {command: histogram.to_dict() for command, histogram in self.latency.items()}
+
+
+def unpack_request(message):
+    """
+    Split a message received by a child program into its parts.
+
+    Args:
+        message (dict or str): Request dict from :class:`CommandBus` or a
+            plain command string.
+
+    Returns:
+        tuple: (request_id, command, data). ``request_id`` and ``data`` are
+        None for plain command strings.
+    """
+    if isinstance(message, dict):
+        return message.get('id'), message.get('command', ''), message.get('data')
+    return None, message, None
+
+
+def is_notification(message):
+    """Return True for a one-way message sent with :meth:`CommandBus.notify`, which gets no reply."""
+    return isinstance(message, dict) and 'id' not in message and 'command' in message
+
+
+def send_reply(conn, request_id, response):
+    """
+    Send a child program's response for a request.
+
+    Args:
+        conn (multiprocessing.Connection): Child end of the pipe.
+        request_id (int or None): Id from :func:`unpack_request`; None sends
+            the plain response as before.
+        response (Any): Response to send.
+    """
+    with _child_send_lock:
+        if request_id is None:
+            conn.send(response)
+        else:
+            conn.send({'id': request_id, 'response': response})
+
+
+def send_status(conn, status, **detail):
+    """
+    Report a child program's startup state to the control application.
+
+    Args:
+        conn (multiprocessing.Connection): Child end of the pipe.
+        status (str): ``starting``, ``ready`` or ``failed``.
+        **detail: JSON-serializable details, e.g. ``camera_opened=True``.
+    """
+    with _child_send_lock:
+        conn.send({'event': 'status', 'status': status, 'detail': detail})
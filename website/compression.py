@@ -0,0 +1,308 @@
+"""
+Compressed Chunked Recording Format
+
+Optional lossless encoding of recordings (``recorded_data_*.ncz``) as an
+alternative to the pretty-printed JSON written by the control application.
+
+Each stream is split into chunks of up to ``CHUNK_SAMPLES`` samples. In a
+chunk, the timestamps and every channel are encoded separately:
+
+1. The float64 values are reinterpreted as int64 bit patterns.
+2. A linear predictor of order 0, 1 (previous sample) or 2 (linear
+   extrapolation of the two previous samples) is subtracted with wrapping
+   integer arithmetic, which is exactly invertible. Timestamps are close
+   to regularly spaced, so order 1 leaves only the jitter; for the noisy
+   sensor values the prediction residual is about as large as the value
+   itself and order 0 compresses best (see ``benchmarks/compression.py``).
+3. The residual bytes are shuffled (all first bytes, then all second
+   bytes, ...) so the mostly-zero high bytes form long runs.
+4. The result is compressed with ``zlib`` or ``lzma`` from the standard
+   library.
+
+File layout: ``NCZ1`` magic, the compressed chunks, a JSON index of all
+chunks (stream, sample count, first/last timestamp, offset, length) and
+markers, and the index offset as the last 8 bytes. Reading a time range
+only decompresses the chunks that overlap it.
+
+Example:
+    >>> from website.compression import write_recording, CompressedRecording
+    >>> write_recording("data/recorded_data_x.ncz", recorded_data)
+    >>> CompressedRecording("data/recorded_data_x.ncz").read('eeg', 1200.0, 1210.0)
+"""
+
+import json
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"NCZ1"
+CHUNK_SAMPLES = 4096
+DEFAULT_CODEC = "zlib"
+DEFAULT_LEVEL = 1  # fast zlib level; the predictor does most of the work
+DEFAULT_TIMESTAMP_ORDER = 1
+DEFAULT_VALUE_ORDER = 0
+
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)
+}
+
+
+def predict_encode(values, order):
+    """
+    Replace float64 values by the residuals of a linear predictor on their bit patterns.
+
+    Args:
+        values (numpy.ndarray): 1-D float64 array.
+        order (int): 0 (no prediction), 1 (delta) or 2 (second difference).
+
+    Returns:
+        numpy.ndarray: int64 residuals of the same length.
+    """
+    residual = np.ascontiguousarray(values, dtype='<f8').view('<i8').copy()
+    # Each pass turns x[n] into x[n] - x[n-1]; int64 arithmetic wraps, so
+    # the inverse (cumulative sums) restores the exact bit patterns
+    with np.errstate(over='ignore'):
+        for _ in range(order):
+            residual[1:] = residual[1:] - residual[:-1]
+    return residual
+
+
+def predict_decode(residual, order):
+    """Invert :func:`predict_encode`."""
+    values = residual.astype('<i8', copy=True)
+    with np.errstate(over='ignore'):
+        for _ in range(order):
+            np.cumsum(values, out=values)
+    return values.view('<f8')
+
+
+def encode_column(values, codec=DEFAULT_CODEC, level=DEFAULT_LEVEL, order=0):
+    """Encode a 1-D float64 column: prediction, byte shuffle, compression."""
+    residual = predict_encode(values, order)
+    shuffled = residual.view(np.uint8).reshape(-1, 8).T.tobytes()
+    return CODECS[codec][0](shuffled, level)
+
+
+def decode_column(data, n, codec=DEFAULT_CODEC, order=0):
+    """Decode a column of ``n`` values encoded by :func:`encode_column`."""
+    shuffled = np.frombuffer(CODECS[codec][1](data), dtype=np.uint8)
+    residual = shuffled.reshape(8, n).T.copy().view('<i8').ravel()
+    return predict_decode(residual, order)
+
+
+class ChunkWriter:
+    """
+    Writes streams to a ``.ncz`` file chunk by chunk.
+
+    Samples can be appended in pieces of any size; a chunk is encoded and
+    written whenever a stream has ``chunk_samples`` pending samples, so
+    memory stays bounded by one chunk per stream.
+
+    Attributes:
+        codec (str): ``zlib`` or ``lzma``.
+        level (int): Compression level (zlib) or preset (lzma).
+        timestamp_order (int): Predictor order of the timestamps, 0 to 2.
+        value_order (int): Predictor order of the channel values, 0 to 2.
+        index (list): One dict per written chunk.
+    """
+    def __init__(self, path, codec=DEFAULT_CODEC, level=DEFAULT_LEVEL, timestamp_order=DEFAULT_TIMESTAMP_ORDER,
+                 value_order=DEFAULT_VALUE_ORDER, chunk_samples=CHUNK_SAMPLES):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.codec = codec
+        self.level = level
+        self.timestamp_order = timestamp_order
+        self.value_order = value_order
+        self.chunk_samples = chunk_samples
+        self.index = []
+        self.channels = {}
+        self._pending = {}
+
+    def append(self, stream, timestamps, values):
+        """
+        Append samples to a stream.
+
+        Args:
+            stream (str): Stream name, e.g. ``eeg``.
+            timestamps (array-like): (n,) timestamps.
+            values (array-like): (n, channels) samples.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), -1)
+        self.channels.setdefault(stream, values.shape[1])
+        pending = self._pending.setdefault(stream, [])
+        pending.append((timestamps, values))
+        while sum(len(t) for t, _ in pending) >= self.chunk_samples:
+            timestamps = np.concatenate([t for t, _ in pending])
+            values = np.concatenate([v for _, v in pending])
+            self._write_chunk(stream, timestamps[:self.chunk_samples], values[:self.chunk_samples])
+            pending[:] = [(timestamps[self.chunk_samples:], values[self.chunk_samples:])]
+
+    def _write_chunk(self, stream, timestamps, values):
+        if not len(timestamps):
+            return
+        columns = [encode_column(timestamps, self.codec, self.level, self.timestamp_order)]
+        columns += [encode_column(values[:, ch], self.codec, self.level, self.value_order)
+                    for ch in range(values.shape[1])]
+        offset = self.file.tell()
+        for column in columns:
+            self.file.write(column)
+        self.index.append({
+            'stream': stream,
+            'samples': len(timestamps),
+            'first_timestamp': float(timestamps[0]),
+            'last_timestamp': float(timestamps[-1]),
+            'offset': offset,
+            'lengths': [len(column) for column in columns]
+        })
+
+    def close(self, markers=None):
+        """
+        Flush the pending samples and write the index.
+
+        Args:
+            markers (list, optional): Marker dicts (``timestamp``, ``values``,
+                ``stream``) stored uncompressed in the index.
+        """
+        for stream, pending in self._pending.items():
+            if pending:
+                self._write_chunk(stream, np.concatenate([t for t, _ in pending]),
+                                  np.concatenate([v for _, v in pending]))
+        self._pending = {}
+        index_offset = self.file.tell()
+        self.file.write(json.dumps({
+            'codec': self.codec,
+            'timestamp_order': self.timestamp_order,
+            'value_order': self.value_order,
+            'channels': self.channels,
+            'chunks': self.index,
+            'markers': markers or []
+        }).encode('utf-8'))
+        self.file.write(struct.pack('<Q', index_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.file.closed:
+            self.close()
+
+
+class CompressedRecording:
+    """
+    Random-access reader of a ``.ncz`` file.
+
+    Attributes:
+        path (str): File path.
+        codec (str): Codec used by the writer.
+        timestamp_order (int): Predictor order of the timestamps.
+        value_order (int): Predictor order of the channel values.
+        channels (dict): Number of channels per stream.
+        chunks (list): Chunk index.
+        markers (list): Marker dicts stored with the recording.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a compressed NeuroCue recording")
+            file.seek(-8, 2)
+            end = file.tell()
+            index_offset = struct.unpack('<Q', file.read(8))[0]
+            file.seek(index_offset)
+            index = json.loads(file.read(end - index_offset).decode('utf-8'))
+        self.codec = index['codec']
+        self.timestamp_order = index['timestamp_order']
+        self.value_order = index['value_order']
+        self.channels = index['channels']
+        self.chunks = index['chunks']
+        self.markers = index['markers']
+
+    def _decode_chunk(self, file, chunk):
+        file.seek(chunk['offset'])
+        orders = [self.timestamp_order] + [self.value_order] * (len(chunk['lengths']) - 1)
+        columns = [decode_column(file.read(length), chunk['samples'], self.codec, order)
+                   for length, order in zip(chunk['lengths'], orders)]
+        return columns[0], np.column_stack(columns[1:]) if len(columns) > 1 else np.zeros((chunk['samples'], 0))
+
+    def iter_chunks(self, stream):
+        """
+        Decode the chunks of a stream one at a time, in file order.
+
+        Yields:
+            tuple: (timestamps, values) arrays of one chunk.
+        """
+        with open(self.path, 'rb') as file:
+            for chunk in self.chunks:
+                if chunk['stream'] == stream:
+                    yield self._decode_chunk(file, chunk)
+
+    def first_timestamp(self, stream):
+        """Return the first timestamp of a stream from the index, or None if it is empty."""
+        for chunk in self.chunks:
+            if chunk['stream'] == stream:
+                return chunk['first_timestamp']
+        return None
+
+    def read(self, stream, start=None, end=None):
+        """
+        Read the samples of a stream, optionally limited to a time range.
+
+        Args:
+            stream (str): Stream name.
+            start (float, optional): First timestamp to include.
+            end (float, optional): Last timestamp to include.
+
+        Returns:
+            tuple: (timestamps, values) arrays.
+        """
+        n_channels = self.channels.get(stream, 0)
+        timestamps, values = [np.zeros(0)], [np.zeros((0, n_channels))]
+        with open(self.path, 'rb') as file:
+            for chunk in self.chunks:
+                if chunk['stream'] != stream:
+                    continue
+                if (start is not None and chunk['last_timestamp'] < start) or \
+                        (end is not None and chunk['first_timestamp'] > end):
+                    continue
+                chunk_timestamps, chunk_values = self._decode_chunk(file, chunk)
+                keep = np.ones(len(chunk_timestamps), dtype=bool)
+                if start is not None:
+                    keep &= chunk_timestamps >= start
+                if end is not None:
+                    keep &= chunk_timestamps <= end
+                timestamps.append(chunk_timestamps[keep])
+                values.append(chunk_values[keep])
+        return np.concatenate(timestamps), np.concatenate(values)
+
+
+def write_recording(path, recorded_data, codec=DEFAULT_CODEC, level=DEFAULT_LEVEL,
+                    timestamp_order=DEFAULT_TIMESTAMP_ORDER, value_order=DEFAULT_VALUE_ORDER):
+    """
+    Write recorded data in the control application's in-memory format to a ``.ncz`` file.
+
+    Args:
+        path (str): Output path, e.g. ``data/recorded_data_*.ncz``.
+        recorded_data (dict): Stream name -> list of ``{"timestamp", "values"}``
+            dicts; ``markers`` are stored as they are.
+        codec (str): ``zlib`` or ``lzma``.
+        level (int): Compression level.
+        timestamp_order (int): Predictor order of the timestamps.
+        value_order (int): Predictor order of the channel values.
+    """
+    with ChunkWriter(path, codec, level, timestamp_order, value_order) as writer:
+        for stream, samples in recorded_data.items():
+            if stream == 'markers' or not samples:
+                continue
+            width = max(len(sample['values']) for sample in samples)
+            values = np.zeros((len(samples), width))
+            for i, sample in enumerate(samples):
+                values[i, :len(sample['values'])] = sample['values']
+            writer.append(stream, [sample['timestamp'] for sample in samples], values)
+        writer.close(recorded_data.get('markers', []))
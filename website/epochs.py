@@ -0,0 +1,182 @@
+"""
+Stimulus-Locked Epochs
+
+Cuts the recordings of a session into fixed windows around each stimulus
+event and returns them as a (trials x channels x samples) array, with
+optional baseline correction. Windows are extracted in one vectorized
+indexing pass per recording using the EEG sample index of each event from
+the session's alignment index (see :mod:`website.session`).
+
+Results are cached in the session's ``cache/`` directory, keyed by the
+session files and the epoching parameters, so re-running an analysis
+loads one ``.npz`` file instead of re-parsing the raw JSON recordings.
+
+Example:
+    >>> from website.epochs import load_epochs
+    >>> epochs = load_epochs("data/sessions/20250101_120000", tmin=-0.2, tmax=0.8, baseline=(None, 0))
+    >>> epochs['data'].shape  # (trials, channels, samples)
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from website.analysis import bandpass_filter
+from website.recordings import STREAM_CHANNELS, STREAM_RATES, load_recording
+from website.session import Session
+
+CACHE_DIR_NAME = "cache"
+CACHE_VERSION = 1  # bump when the epoch format changes to invalidate old caches
+
+# Stimulus labels left out by default (countdown steps before the first stimulus)
+EXCLUDED_LABEL_PREFIXES = ("initial_delay_",)
+
+
+def extract_epochs(values, event_samples, start, stop, baseline=None):
+    """
+    Extract fixed windows around events from a continuous recording.
+
+    Args:
+        values (numpy.ndarray): Samples of one stream, shape (samples, channels).
+        event_samples (numpy.ndarray): Sample index of each event.
+        start (int): First sample of the window relative to the event (e.g. -51).
+        stop (int): Last sample of the window relative to the event, exclusive.
+        baseline (tuple, optional): (first, last) sample offsets relative to
+            the event of the baseline interval, last exclusive. The mean over
+            that interval is subtracted per trial and channel.
+
+    Returns:
+        tuple: (epochs, kept) where ``epochs`` has shape (trials, channels,
+        samples) and ``kept`` is a boolean mask of the events whose whole
+        window lies inside the recording.
+    """
+    event_samples = np.asarray(event_samples, dtype=np.int64)
+    kept = (event_samples + start >= 0) & (event_samples + stop <= len(values)) & (event_samples >= 0)
+    offsets = np.arange(start, stop)
+    # (trials, samples) sample indices -> (trials, samples, channels) -> (trials, channels, samples)
+    indices = event_samples[kept, None] + offsets[None, :]
+    epochs = values[indices].transpose(0, 2, 1)
+    if baseline is not None and len(epochs):
+        first, last = baseline
+        window = (offsets >= first) & (offsets < last)
+        epochs = epochs - epochs[:, :, window].mean(axis=2, keepdims=True)
+    return epochs, kept
+
+
+def _cache_key(session, stream, tmin, tmax, baseline, labels, l_freq, h_freq):
+    """Hash the session's data files and the epoching parameters."""
+    files = [(f['name'], f['size'], f['mtime']) for f in session.scan_files()
+             if f['role'] in ('eeg_recording', 'image_stimuli_log', 'video_stimuli_log')]
+    params = {
+        'version': CACHE_VERSION,
+        'session': session.session_id,
+        'files': files,
+        'stream': stream,
+        'tmin': tmin,
+        'tmax': tmax,
+        'baseline': baseline,
+        'labels': sorted(labels) if labels is not None else None,
+        'l_freq': l_freq,
+        'h_freq': h_freq
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_epochs(session_path, tmin=-0.2, tmax=0.8, baseline=None, stream='eeg', labels=None,
+                l_freq=None, h_freq=None, use_cache=True):
+    """
+    Epoch a session's recordings around its stimulus events.
+
+    Args:
+        session_path (str): Session directory (see :mod:`website.session`).
+        tmin (float): Window start in seconds relative to each event.
+        tmax (float): Window end in seconds relative to each event.
+        baseline (tuple, optional): (start, end) in seconds of the baseline
+            interval; None for either end means the window start or the
+            event. No baseline correction if None.
+        stream (str): Stream to epoch: ``eeg``, ``acc``, ``gyro`` or ``ppg``.
+        labels (iterable, optional): Stimulus labels to keep. By default all
+            events except the countdown steps are kept.
+        l_freq (float, optional): High-pass edge (Hz) applied to the
+            continuous recording before epoching.
+        h_freq (float, optional): Low-pass edge (Hz) applied to the
+            continuous recording before epoching.
+        use_cache (bool): Load and store the result in the session cache.
+
+    Returns:
+        dict: ``data`` (trials, channels, samples), ``times`` (samples,),
+        ``labels`` and ``event_times`` (LSL clock) of the kept trials,
+        ``channels``, ``sfreq`` and ``dropped`` (events without a matched
+        EEG sample or a complete window).
+    """
+    session = Session(session_path)
+    sfreq = STREAM_RATES[stream]
+    if baseline is not None:
+        baseline = (tmin if baseline[0] is None else baseline[0], 0.0 if baseline[1] is None else baseline[1])
+
+    cache_path = None
+    if use_cache:
+        key = _cache_key(session, stream, tmin, tmax, baseline, labels, l_freq, h_freq)
+        cache_path = session.file_path(os.path.join(CACHE_DIR_NAME, f"epochs_{stream}_{key}.npz"))
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                epochs = {name: cached[name] for name in cached.files}
+            epochs['labels'] = epochs['labels'].tolist()
+            epochs['channels'] = epochs['channels'].tolist()
+            epochs['sfreq'] = float(epochs['sfreq'])
+            epochs['dropped'] = int(epochs['dropped'])
+            return epochs
+
+    # Use the alignment index of a finalized session, or align now
+    alignment = session.load_alignment()
+    if alignment is None:
+        session.manifest['files'] = session.scan_files()
+        alignment = session.build_alignment()
+
+    events = [event for event in alignment['events']
+              if (labels is None and not event['label'].startswith(EXCLUDED_LABEL_PREFIXES))
+              or (labels is not None and event['label'] in labels)]
+
+    start = int(round(tmin * sfreq))
+    stop = int(round(tmax * sfreq)) + 1
+    baseline_samples = None
+    if baseline is not None:
+        baseline_samples = (int(round(baseline[0] * sfreq)), int(round(baseline[1] * sfreq)))
+
+    data, kept_labels, event_times = [], [], []
+    for r, name in enumerate(alignment['recordings']):
+        recording_events = [event for event in events if event['eeg_recording'] == r]
+        if not recording_events:
+            continue
+        recording = load_recording(session.file_path(name))[stream]
+        event_times_lsl = np.array([event['lsl_timestamp'] for event in recording_events], dtype=np.float64)
+        if stream == 'eeg':
+            event_samples = np.array([event['eeg_sample'] for event in recording_events], dtype=np.int64)
+        else:
+            # Other streams have their own sample grid; find the first sample at or after the event
+            event_samples = np.searchsorted(recording['timestamps'], event_times_lsl)
+        values = bandpass_filter(recording['values'], sfreq, l_freq, h_freq)
+        epochs, kept = extract_epochs(values, event_samples, start, stop, baseline_samples)
+        data.append(epochs)
+        kept_labels.extend(event['label'] for event, keep in zip(recording_events, kept) if keep)
+        event_times.append(event_times_lsl[kept])
+
+    n_channels = len(STREAM_CHANNELS[stream])
+    epochs = {
+        'data': np.concatenate(data) if data else np.zeros((0, n_channels, stop - start)),
+        'times': np.arange(start, stop) / sfreq,
+        'labels': kept_labels,
+        'event_times': np.concatenate(event_times) if event_times else np.zeros(0),
+        'channels': STREAM_CHANNELS[stream],
+        'sfreq': float(sfreq),
+        'dropped': len(events) - len(kept_labels)
+    }
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = cache_path[:-len(".npz")] + ".tmp.npz"
+        np.savez(temp_path, **{name: np.asarray(value) for name, value in epochs.items()})
+        os.replace(temp_path, cache_path)
+    return epochs
@@ -0,0 +1,246 @@
+"""
+Online Event-Related Averaging
+
+Live ERPs while a stimulus run is going on, instead of waiting for the
+offline epoching of :mod:`website.epochs`:
+
+- :class:`OnlineERP` keeps the last seconds of the (filtered) EEG in a ring
+  buffer and a queue of pending stimulus onsets. As soon as the ring covers
+  an onset's post-stimulus window, the epoch is cut out, baseline-corrected
+  and added to the running mean and variance of its condition with
+  Welford's algorithm, which costs O(window) per trial and keeps memory
+  constant however many trials are run.
+- :class:`OnsetListener` feeds it the ``onset`` markers of the stimulus
+  programs from the :class:`~website.realtime.ProcessingWorker`.
+
+The means of the first :data:`MAX_CONDITIONS` conditions and their trial
+counts are published in shared memory (see :func:`shared_arrays`) and
+plotted by the control application's visualizer; the control application
+serves all of them with standard deviations at ``/erp``, which the live ERP
+card of the web interface plots.
+"""
+
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from website.command_bus import LatencyHistogram
+from website.epochs import EXCLUDED_LABEL_PREFIXES
+
+ERP_TMIN = -0.2  # seconds before the onset
+ERP_TMAX = 0.8  # seconds after the onset
+RING_SECONDS = 5.0  # EEG kept for epochs whose onset marker arrives late
+MAX_CONDITIONS = 8  # conditions published in shared memory
+
+
+def epoch_times(sfreq, tmin=ERP_TMIN, tmax=ERP_TMAX):
+    """Return the epoch sample times relative to the onset, in seconds."""
+    return np.arange(int(round(tmin * sfreq)), int(round(tmax * sfreq)) + 1) / sfreq
+
+
+def shared_arrays(buffer, channels, samples):
+    """
+    Return the arrays of an :class:`OnlineERP` shared block.
+
+    Args:
+        buffer (memoryview): Buffer of the block, e.g. ``SharedMemory.buf``.
+        channels (int): Number of EEG channels.
+        samples (int): Samples per epoch, ``len(epoch_times(...))``.
+
+    Returns:
+        tuple: (means, counts) float64 arrays of shape (MAX_CONDITIONS,
+        channels, samples) and (MAX_CONDITIONS,).
+    """
+    shape = (MAX_CONDITIONS, channels, samples)
+    means = np.ndarray(shape, dtype=np.float64, buffer=buffer)
+    counts = np.ndarray(MAX_CONDITIONS, dtype=np.float64, buffer=buffer, offset=int(np.prod(shape)) * 8)
+    return means, counts
+
+
+class ConditionAverage:
+    """
+    Running mean and variance of the epochs of one condition (Welford).
+
+    Attributes:
+        count (int): Number of trials.
+        mean (numpy.ndarray): (channels, samples) mean.
+        m2 (numpy.ndarray): (channels, samples) sum of squared deviations.
+    """
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, epoch):
+        """Add one (channels, samples) epoch."""
+        self.count += 1
+        delta = epoch - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (epoch - self.mean)
+
+    def std(self):
+        """Return the (channels, samples) standard deviation, NaN below two trials."""
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+        return np.sqrt(self.m2 / (self.count - 1))
+
+
+class OnlineERP:
+    """
+    Per-condition running averages of the EEG around stimulus onsets.
+
+    Args:
+        sfreq (float): EEG sample rate.
+        channels (list): EEG channel names.
+        tmin (float): Epoch start relative to the onset, in seconds.
+        tmax (float): Epoch end relative to the onset, in seconds.
+        baseline (bool): Subtract the mean of the pre-stimulus samples.
+        condition (callable, optional): Maps a stimulus label to its
+            condition, e.g. the stimulus directory. By default every
+            stimulus is its own condition.
+        shared (bool): Publish the means in shared memory.
+
+    Attributes:
+        times (numpy.ndarray): Epoch sample times relative to the onset.
+        conditions (dict): Condition label -> :class:`ConditionAverage`, in
+            order of appearance.
+        missed (int): Onsets whose window was no longer in the ring buffer.
+        shm (SharedMemory or None): Block with a (MAX_CONDITIONS, channels,
+            samples) float64 array of means followed by MAX_CONDITIONS counts.
+        cost (LatencyHistogram): Time to add one trial.
+    """
+    def __init__(self, sfreq, channels, tmin=ERP_TMIN, tmax=ERP_TMAX, baseline=True, condition=None,
+                 shared=True):
+        self.sfreq = sfreq
+        self.condition = condition
+        self.channels = list(channels)
+        self.start = int(round(tmin * sfreq))
+        self.stop = int(round(tmax * sfreq)) + 1
+        self.times = epoch_times(sfreq, tmin, tmax)
+        self.baseline = baseline and self.start < 0
+        self.conditions = {}
+        self.missed = 0
+        self.cost = LatencyHistogram()
+        size = int(RING_SECONDS * sfreq)
+        self._ring_times = np.full(size, np.nan)
+        self._ring_values = np.zeros((size, len(self.channels)))
+        self._filled = 0  # samples in the ring, the rest at its start is NaN
+        self._pending = []
+        self._lock = threading.Lock()
+
+        self.shm = None
+        self.shared_means = self.shared_counts = None
+        if shared:
+            shape = (MAX_CONDITIONS, len(self.channels), len(self.times))
+            self.shm = shared_memory.SharedMemory(create=True, size=(int(np.prod(shape)) + MAX_CONDITIONS) * 8)
+            self.shared_means, self.shared_counts = shared_arrays(self.shm.buf, len(self.channels), len(self.times))
+            self.shared_means[:] = 0.0
+            self.shared_counts[:] = 0.0
+
+    def add_onset(self, onset, label):
+        """Queue a stimulus onset (LSL time) of a condition."""
+        if label.startswith(EXCLUDED_LABEL_PREFIXES):
+            return
+        if self.condition is not None:
+            label = self.condition(label)
+        with self._lock:
+            self._pending.append((onset, label))
+
+    def process(self, timestamps, values):
+        """Append an EEG chunk to the ring and average the epochs it completes."""
+        n = min(len(timestamps), len(self._ring_times))
+        if not n:
+            return
+        self._ring_times[:-n] = self._ring_times[n:].copy()
+        self._ring_values[:-n] = self._ring_values[n:].copy()
+        self._ring_times[-n:] = timestamps[-n:]
+        self._ring_values[-n:] = values[-n:, :len(self.channels)]
+        self._filled = min(self._filled + n, len(self._ring_times))
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+        latest = self._ring_times[-1]
+        waiting = []
+        for onset, label in pending:
+            if onset + self.times[-1] > latest:
+                waiting.append((onset, label))
+                continue
+            self._add_trial(onset, label)
+        if waiting:
+            with self._lock:
+                self._pending = waiting + self._pending
+
+    def _add_trial(self, onset, label):
+        start = time.perf_counter()
+        # Only the filled end of the ring is sorted, the NaNs before it are not
+        empty = len(self._ring_times) - self._filled
+        index = empty + int(np.searchsorted(self._ring_times[empty:], onset))
+        first, last = index + self.start, index + self.stop
+        if first < empty or last > len(self._ring_times):
+            self.missed += 1
+            return
+        epoch = self._ring_values[first:last].T
+        if self.baseline:
+            epoch = epoch - epoch[:, :-self.start].mean(axis=1, keepdims=True)
+        with self._lock:
+            if label not in self.conditions:
+                self.conditions[label] = ConditionAverage(epoch.shape)
+            average = self.conditions[label]
+            average.add(epoch)
+        slot = list(self.conditions).index(label)
+        if self.shm is not None and slot < MAX_CONDITIONS:
+            self.shared_means[slot] = average.mean
+            self.shared_counts[slot] = average.count
+        self.cost.add((time.perf_counter() - start) * 1000.0)
+
+    def reset(self):
+        """Forget all trials, e.g. at the start of a stimulus run."""
+        with self._lock:
+            self.conditions = {}
+            self._pending = []
+            self.missed = 0
+        if self.shm is not None:
+            self.shared_means[:] = 0.0
+            self.shared_counts[:] = 0.0
+
+    def status(self):
+        """Return the epoch times and, per condition, the trial count, mean and standard deviation."""
+        with self._lock:
+            conditions = {}
+            for label, average in self.conditions.items():
+                std = average.std()
+                conditions[label] = {'count': average.count, 'mean': average.mean.tolist(),
+                                     'std': np.where(np.isnan(std), None, std).tolist()}
+        return {
+            'times': self.times.tolist(),
+            'channels': self.channels,
+            'conditions': conditions,
+            'pending': len(self._pending),
+            'missed': self.missed,
+            'shared_memory': self.shm.name if self.shm is not None else None,
+            'cost': self.cost.to_dict()
+        }
+
+    def close(self):
+        """Free the shared block."""
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+
+
+class OnsetListener:
+    """
+    Passes the ``onset`` markers of the stimulus programs to an :class:`OnlineERP`.
+
+    Registered for the marker stream of the :class:`~website.realtime.ProcessingWorker`.
+    """
+    def __init__(self, erp):
+        self.erp = erp
+
+    def process(self, timestamps, markers):
+        for timestamp, marker in zip(timestamps, markers):
+            event, _, label = str(marker[0]).partition(":")
+            if event == "onset" and label:
+                self.erp.add_onset(float(timestamp), label)
@@ -0,0 +1,420 @@
+"""
+EDF+/BDF and XDF Exporters
+
+Writes recordings in formats that EEG toolboxes read natively:
+- EDF+ (16-bit) and BDF+ (24-bit): Muse streams resampled onto their
+  nominal sample grid, with the stimulus events as annotations
+- XDF: every stream with its own LSL timestamps, plus the marker stream
+
+Both writers consume a recording stream by stream in fixed-size chunks
+(:func:`website.recordings.iter_stream_chunks`) and write as they go, so the
+memory used does not grow with the length of the session. Values that are
+only known at the end (number of EDF data records, XDF footers) are written
+into a header patched at the end or into trailing chunks.
+
+Example:
+    >>> from website.exporters import export_session
+    >>> export_session("data/sessions/20250101_120000", formats=("edf", "xdf"))
+"""
+
+import os
+import struct
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from website.recordings import (EEG_RANGE, STREAM_CHANNELS, STREAM_RATES, first_timestamp, iter_stream_chunks,
+                                load_markers)
+from website.session import Session
+
+CHUNK_SIZE = 4096  # samples read from the recording at a time
+
+# Physical range (min, max) and unit written to EDF/BDF per stream; the EEG
+# range is the output range of the Muse. Values outside are clipped and
+# reported.
+PHYSICAL_RANGES = {
+    'eeg': EEG_RANGE + ('uV',),
+    'acc': (-2.0, 2.0, 'g'),
+    'gyro': (-250.0, 250.0, 'deg/s'),
+    'ppg': (0.0, 4194304.0, '')
+}
+
+EDF_DIGITAL_RANGE = (-32768, 32767)
+BDF_DIGITAL_RANGE = (-8388608, 8388607)
+
+# XDF chunk tags and boundary marker
+XDF_FILE_HEADER = 1
+XDF_STREAM_HEADER = 2
+XDF_SAMPLES = 3
+XDF_BOUNDARY = 5
+XDF_STREAM_FOOTER = 6
+XDF_BOUNDARY_UUID = bytes([0x43, 0xA5, 0x46, 0xDC, 0xCB, 0xF5, 0x41, 0x0F,
+                           0xB3, 0x0E, 0xD5, 0x46, 0x73, 0x83, 0xCB, 0xE4])
+XDF_BOUNDARY_INTERVAL = 10.0  # seconds of data between boundary chunks
+
+
+class _GridStream:
+    """
+    Places the irregularly timestamped samples of one stream onto its
+    nominal sample grid, chunk by chunk.
+
+    Grid position ``k`` is time ``t0 + k / rate``; it takes the value of the
+    last sample at or before it (sample and hold), so gaps are filled with
+    the previous value and duplicate samples are dropped.
+    """
+    def __init__(self, chunks, rate, t0, n_channels):
+        self.chunks = chunks
+        self.rate = rate
+        self.t0 = t0
+        self.next_position = 0
+        self.last_value = np.zeros(n_channels)
+        self.pending = np.zeros((0, n_channels))
+        self.exhausted = False
+
+    def _feed(self):
+        try:
+            timestamps, values = next(self.chunks)
+        except StopIteration:
+            self.exhausted = True
+            return
+        positions = np.rint((timestamps - self.t0) * self.rate).astype(np.int64)
+        positions = np.maximum.accumulate(positions)  # tolerate out-of-order timestamps
+        if not len(positions) or positions[-1] < self.next_position:
+            return
+        grid = np.arange(self.next_position, positions[-1] + 1)
+        source = np.searchsorted(positions, grid, side='right') - 1
+        filled = np.where(source[:, None] >= 0, values[np.maximum(source, 0)], self.last_value)
+        self.pending = np.concatenate([self.pending, filled])
+        self.last_value = values[-1]
+        self.next_position = positions[-1] + 1
+
+    def take(self, n):
+        """Return the next ``n`` grid samples, padding with the last value after the stream ends."""
+        while len(self.pending) < n and not self.exhausted:
+            self._feed()
+        block = self.pending[:n]
+        self.pending = self.pending[n:]
+        if len(block) < n:
+            block = np.concatenate([block, np.tile(self.last_value, (n - len(block), 1))])
+        return block
+
+    def done(self):
+        """Return True once every sample of the stream has been taken."""
+        while not len(self.pending) and not self.exhausted:
+            self._feed()
+        return not len(self.pending)
+
+
+def _edf_field(value, width):
+    """Format a header field as left-aligned ASCII padded to ``width`` bytes."""
+    return str(value)[:width].ljust(width).encode('ascii', 'replace')
+
+
+def _format_number(value, width=8):
+    """Format a number to fit an 8-character EDF header field."""
+    text = f"{value:g}"
+    if len(text) > width:
+        text = f"{value:.{max(width - 6, 0)}e}"
+    return text[:width]
+
+
+def _tal(onset, text=None, duration=None):
+    """Return an EDF+ time-stamped annotation list entry."""
+    entry = f"{onset:+.4f}"
+    if duration is not None:
+        entry += f"\x15{duration:.4f}"
+    entry += "\x14" + ("" if text is None else text) + "\x14"
+    return entry.encode('utf-8') + b"\x00"
+
+
+def export_edf(recording_path, output_path, annotations=(), streams=('eeg',), bdf=False,
+               record_duration=1, start_datetime=None):
+    """
+    Write a recording as an EDF+ (or BDF+) file.
+
+    Each stream is resampled onto its nominal grid (see ``STREAM_RATES``),
+    starting at the first sample of the earliest stream, and written one
+    data record at a time.
+
+    Args:
+        recording_path (str): Path of a ``recorded_data_*.json`` or ``.ncz`` file.
+        output_path (str): Output ``.edf`` or ``.bdf`` path.
+        annotations (iterable): (lsl_timestamp, text) per event, e.g. the
+            stimulus onsets.
+        streams (tuple): Streams to include, e.g. ``('eeg', 'ppg')``.
+        bdf (bool): Write 24-bit BDF+ instead of 16-bit EDF+.
+        record_duration (int): Seconds per data record; every stream rate
+            times this must be an integer.
+        start_datetime (datetime, optional): Wall-clock time of the first
+            sample. Defaults to the recording's modification time minus its
+            duration.
+
+    Returns:
+        dict: ``records`` written, ``duration`` in seconds, ``annotations``
+        count and ``clipped``, the number of samples per signal label that
+        were outside the physical range and clipped to it.
+    """
+    first = {stream: first_timestamp(recording_path, stream) for stream in streams}
+    streams = [stream for stream in streams if first[stream] is not None]
+    if not streams:
+        raise ValueError(f"No samples to export in {recording_path}")
+    t0 = min(first[stream] for stream in streams)
+
+    grids = {stream: _GridStream(iter_stream_chunks(recording_path, stream, CHUNK_SIZE), STREAM_RATES[stream], t0,
+                                 len(STREAM_CHANNELS[stream]))
+             for stream in streams}
+    digital_min, digital_max = BDF_DIGITAL_RANGE if bdf else EDF_DIGITAL_RANGE
+    sample_bytes = 3 if bdf else 2
+
+    # Signals: (stream, channel index) plus the annotation signal
+    signals = []
+    for stream in streams:
+        physical_min, physical_max, unit = PHYSICAL_RANGES[stream]
+        for ch, name in enumerate(STREAM_CHANNELS[stream]):
+            label = name if stream == 'eeg' else f"{stream.upper()} {name}"
+            signals.append({'label': label, 'unit': unit, 'physical_min': physical_min,
+                            'physical_max': physical_max,
+                            'samples': STREAM_RATES[stream] * record_duration,
+                            'stream': stream, 'channel': ch, 'clipped': 0})
+
+    # Annotations are few, so they are sorted into records up front; the
+    # annotation signal is sized for the fullest record
+    annotations = sorted((float(ts) - t0, text) for ts, text in annotations if ts is not None and ts >= t0)
+    record_annotations = {}
+    for onset, text in annotations:
+        record_annotations.setdefault(int(onset // record_duration), []).append(_tal(onset, text, 0.0))
+    timekeeping_bytes = len(_tal(0.0)) + 12
+    annotation_bytes = max([timekeeping_bytes + sum(len(tal) for tal in tals)
+                            for tals in record_annotations.values()] + [timekeeping_bytes])
+    annotation_samples = -(-annotation_bytes // sample_bytes)
+    n_signals = len(signals) + 1
+    header_bytes = 256 * (n_signals + 1)
+
+    def header(n_records, start):
+        fields = [
+            (b"\xffBIOSEMI" if bdf else b"0       "),
+            _edf_field("X X X X", 80),
+            _edf_field(f"Startdate {start.strftime('%d-%b-%Y').upper()} X X NeuroCue", 80),
+            _edf_field(start.strftime('%d.%m.%y'), 8),
+            _edf_field(start.strftime('%H.%M.%S'), 8),
+            _edf_field(header_bytes, 8),
+            _edf_field("BDF+C" if bdf else "EDF+C", 44),
+            _edf_field(n_records, 8),
+            _edf_field(record_duration, 8),
+            _edf_field(n_signals, 4)
+        ]
+        labels = [s['label'] for s in signals] + ["BDF Annotations" if bdf else "EDF Annotations"]
+        per_signal = [
+            [_edf_field(label, 16) for label in labels],
+            [_edf_field("", 80) for _ in labels],
+            [_edf_field(s['unit'], 8) for s in signals] + [_edf_field("", 8)],
+            [_edf_field(_format_number(s['physical_min']), 8) for s in signals] + [_edf_field(-1, 8)],
+            [_edf_field(_format_number(s['physical_max']), 8) for s in signals] + [_edf_field(1, 8)],
+            [_edf_field(digital_min, 8) for _ in labels],
+            [_edf_field(digital_max, 8) for _ in labels],
+            [_edf_field("", 80) for _ in labels],
+            [_edf_field(s['samples'], 8) for s in signals] + [_edf_field(annotation_samples, 8)],
+            [_edf_field("", 32) for _ in labels]
+        ]
+        return b"".join(fields) + b"".join(b"".join(column) for column in per_signal)
+
+    def to_digital(values, signal):
+        scale = (digital_max - digital_min) / (signal['physical_max'] - signal['physical_min'])
+        digital = np.rint((values - signal['physical_min']) * scale + digital_min)
+        signal['clipped'] += int(np.count_nonzero((digital < digital_min) | (digital > digital_max)))
+        digital = np.clip(digital, digital_min, digital_max).astype('<i4')
+        if bdf:
+            return digital.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        return digital.astype('<i2').tobytes()
+
+    n_records = 0
+    with open(output_path, 'wb') as file:
+        file.write(b" " * header_bytes)  # patched once the number of records is known
+        while not all(grid.done() for grid in grids.values()) or n_records * record_duration <= (
+                annotations[-1][0] if annotations else -1):
+            blocks = {stream: grids[stream].take(STREAM_RATES[stream] * record_duration) for stream in streams}
+            parts = [to_digital(blocks[s['stream']][:, s['channel']], s) for s in signals]
+            tals = _tal(float(n_records * record_duration)) + b"".join(record_annotations.get(n_records, []))
+            parts.append(tals.ljust(annotation_samples * sample_bytes, b"\x00"))
+            file.write(b"".join(parts))
+            n_records += 1
+
+        duration = n_records * record_duration
+        if start_datetime is None:
+            start_datetime = datetime.fromtimestamp(os.path.getmtime(recording_path) - duration)
+        file.seek(0)
+        file.write(header(n_records, start_datetime))
+
+    clipped = {s['label']: s['clipped'] for s in signals if s['clipped']}
+    for label, count in clipped.items():
+        print(f"WARNING: {count} samples of {label} outside the physical range were clipped in {output_path}")
+    return {'records': n_records, 'duration': duration, 'annotations': len(annotations), 'clipped': clipped}
+
+
+def _xdf_chunk(tag, content):
+    """Encode one XDF chunk: variable-length size, tag and content."""
+    length = len(content) + 2
+    if length < 256:
+        size = struct.pack('<BB', 1, length)
+    elif length < 2 ** 32:
+        size = struct.pack('<BI', 4, length)
+    else:
+        size = struct.pack('<BQ', 8, length)
+    return size + struct.pack('<H', tag) + content
+
+
+def _xdf_count(n):
+    """Encode a variable-length sample count."""
+    if n < 256:
+        return struct.pack('<BB', 1, n)
+    if n < 2 ** 32:
+        return struct.pack('<BI', 4, n)
+    return struct.pack('<BQ', 8, n)
+
+
+def _xdf_numeric_samples(stream_id, timestamps, values):
+    """Encode a Samples chunk of float32 samples, each with its own timestamp."""
+    dtype = np.dtype([('timestamp_bytes', 'u1'), ('timestamp', '<f8'), ('values', '<f4', (values.shape[1],))])
+    samples = np.empty(len(timestamps), dtype=dtype)
+    samples['timestamp_bytes'] = 8
+    samples['timestamp'] = timestamps
+    samples['values'] = values
+    return _xdf_chunk(XDF_SAMPLES, struct.pack('<I', stream_id) + _xdf_count(len(timestamps)) + samples.tobytes())
+
+
+def _xdf_string_samples(stream_id, timestamps, values):
+    """Encode a Samples chunk of single-channel string samples."""
+    parts = [struct.pack('<I', stream_id), _xdf_count(len(timestamps))]
+    for timestamp, value in zip(timestamps, values):
+        encoded = value.encode('utf-8')
+        parts.append(struct.pack('<Bd', 8, timestamp) + _xdf_count(len(encoded)) + encoded)
+    return _xdf_chunk(XDF_SAMPLES, b"".join(parts))
+
+
+def _xdf_header(stream_id, name, stream_type, channels, rate, channel_format):
+    xml = (f'<?xml version="1.0"?><info><name>{escape(name)}</name><type>{escape(stream_type)}</type>'
+           f'<channel_count>{len(channels)}</channel_count><nominal_srate>{rate}</nominal_srate>'
+           f'<channel_format>{channel_format}</channel_format><source_id>neurocue-{escape(name)}</source_id>'
+           f'<desc><channels>'
+           + "".join(f'<channel><label>{escape(label)}</label></channel>' for label in channels)
+           + '</channels></desc></info>')
+    return _xdf_chunk(XDF_STREAM_HEADER, struct.pack('<I', stream_id) + xml.encode('utf-8'))
+
+
+def _xdf_footer(stream_id, first, last, count):
+    xml = (f'<?xml version="1.0"?><info><first_timestamp>{first if first is not None else 0}</first_timestamp>'
+           f'<last_timestamp>{last if last is not None else 0}</last_timestamp>'
+           f'<sample_count>{count}</sample_count><clock_offsets></clock_offsets></info>')
+    return _xdf_chunk(XDF_STREAM_FOOTER, struct.pack('<I', stream_id) + xml.encode('utf-8'))
+
+
+def export_xdf(recording_path, output_path, annotations=()):
+    """
+    Write a recording as an XDF file.
+
+    Every Muse stream is written with its original LSL timestamps, followed
+    by the recorded marker stream and, if given, a stream of annotations
+    (e.g. the stimulus log events).
+
+    Args:
+        recording_path (str): Path of a ``recorded_data_*.json`` or ``.ncz`` file.
+        output_path (str): Output ``.xdf`` path.
+        annotations (iterable): (lsl_timestamp, text) per event.
+
+    Returns:
+        dict: Number of samples written per stream.
+    """
+    counts = {}
+    with open(output_path, 'wb') as file:
+        file.write(b"XDF:")
+        file.write(_xdf_chunk(XDF_FILE_HEADER, b'<?xml version="1.0"?><info><version>1.0</version></info>'))
+
+        stream_id = 0
+        for stream, channels in STREAM_CHANNELS.items():
+            stream_id += 1
+            file.write(_xdf_header(stream_id, f"Muse-{stream.upper()}", stream.upper(), channels,
+                                   STREAM_RATES[stream], 'float32'))
+            first = last = None
+            count = 0
+            next_boundary = None
+            for timestamps, values in iter_stream_chunks(recording_path, stream, CHUNK_SIZE):
+                file.write(_xdf_numeric_samples(stream_id, timestamps, values))
+                first = float(timestamps[0]) if first is None else first
+                last = float(timestamps[-1])
+                count += len(timestamps)
+                if next_boundary is None:
+                    next_boundary = first + XDF_BOUNDARY_INTERVAL
+                if last >= next_boundary:
+                    file.write(_xdf_chunk(XDF_BOUNDARY, XDF_BOUNDARY_UUID))
+                    next_boundary = last + XDF_BOUNDARY_INTERVAL
+            file.write(_xdf_footer(stream_id, first, last, count))
+            counts[stream] = count
+
+        marker_streams = [('markers', load_markers(recording_path))]
+        annotations = sorted((float(ts), text) for ts, text in annotations if ts is not None)
+        if annotations:
+            marker_streams.append(('annotations', {'timestamps': np.array([ts for ts, _ in annotations]),
+                                                   'values': [text for _, text in annotations]}))
+        for name, markers in marker_streams:
+            stream_id += 1
+            file.write(_xdf_header(stream_id, f"NeuroCue-{name}", "Markers", ["marker"], 0, 'string'))
+            timestamps = markers['timestamps']
+            for start in range(0, len(timestamps), CHUNK_SIZE):
+                file.write(_xdf_string_samples(stream_id, timestamps[start:start + CHUNK_SIZE],
+                                               markers['values'][start:start + CHUNK_SIZE]))
+            file.write(_xdf_footer(stream_id, float(timestamps[0]) if len(timestamps) else None,
+                                   float(timestamps[-1]) if len(timestamps) else None, len(timestamps)))
+            counts[name] = len(timestamps)
+    return counts
+
+
+def export_session(session_path, formats=('edf',), streams=('eeg',), output_dir=None):
+    """
+    Export every recording of a session with its stimulus events as annotations.
+
+    Args:
+        session_path (str): Session directory (see :mod:`website.session`).
+        formats (tuple): Any of ``edf``, ``bdf`` and ``xdf``.
+        streams (tuple): Streams written to EDF/BDF; XDF always has all streams.
+        output_dir (str, optional): Output directory, defaults to the
+            session's ``exports/`` directory.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    session = Session(session_path)
+    alignment = session.load_alignment()
+    if alignment is None:
+        session.manifest['files'] = session.scan_files()
+        alignment = session.build_alignment()
+    output_dir = output_dir or session.file_path("exports")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Offset between the wall clock and the LSL clock from the stimulus logs,
+    # used to set the EDF start time
+    offsets = [event['timestamp'] - event['lsl_timestamp'] for event in alignment['events']
+               if event['lsl_timestamp'] is not None]
+    clock_offset = float(np.median(offsets)) if offsets else None
+
+    written = []
+    for r, name in enumerate(alignment['recordings']):
+        path = session.file_path(name)
+        base = os.path.join(output_dir, os.path.splitext(name)[0])
+        annotations = [(event['lsl_timestamp'], event['label']) for event in alignment['events']
+                       if event['eeg_recording'] == r]
+        for export_format in formats:
+            if export_format in ('edf', 'bdf'):
+                start_datetime = None
+                if clock_offset is not None:
+                    first = min(t for t in (first_timestamp(path, stream) for stream in streams) if t is not None)
+                    start_datetime = datetime.fromtimestamp(first + clock_offset)
+                export_edf(path, f"{base}.{export_format}", annotations, streams,
+                           bdf=export_format == 'bdf', start_datetime=start_datetime)
+                written.append(f"{base}.{export_format}")
+            elif export_format == 'xdf':
+                export_xdf(path, f"{base}.xdf", annotations)
+                written.append(f"{base}.xdf")
+            else:
+                raise ValueError(f"Unknown export format: {export_format}")
+    return written
@@ -0,0 +1,27 @@
+"""
+Child Program Launcher
+
+Lightweight process entry point for the child programs (p1, p2, p4). The
+control application passes :func:`run_program` as the ``multiprocessing``
+target together with the program's module name, so OpenCV, VLC, Pillow and
+tkinter are imported only inside the child process that uses them and never
+in the Flask control process.
+"""
+
+import importlib
+import time
+
+
+def run_program(module_name, conn):
+    """
+    Import a child program module and run its ``main`` function.
+
+    Args:
+        module_name (str): Module of the program, e.g. ``website.p1``.
+        conn (multiprocessing.Connection): Child end of the command pipe,
+            passed on to ``main``.
+    """
+    import_start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    print(f"Launcher: {module_name} imported in {(time.perf_counter() - import_start) * 1000:.1f} ms")
+    module.main(conn)
@@ -0,0 +1,80 @@
+"""
+LSL Marker Streams for Stimulus Events
+
+Publishes stimulus onsets and offsets as an LSL marker stream so that they
+are timestamped with the project clock (:func:`website.clock.now`, i.e.
+``pylsl.local_clock()``), the same clock domain as the
+EEG samples pulled from the Muse streams. The control application records
+these markers next to the EEG data, which removes the need to align the
+stimulus logs with the recordings afterwards.
+
+Markers are single-channel strings of the form ``<event>:<label>``, e.g.
+``onset:image_stimuli/a.png`` or ``offset:black_screen``.
+"""
+
+from pylsl import StreamInfo, StreamOutlet, IRREGULAR_RATE
+
+from website import clock
+
+MARKER_STREAM_TYPE = "Markers"
+
+
+def format_marker(event, label):
+    """Return the marker string for an event (``onset``, ``offset``, ...) and a label."""
+    return f"{event}:{label}"
+
+
+def parse_marker(marker):
+    """
+    Split a marker string into its event and label.
+
+    Args:
+        marker (str): Marker string produced by :func:`format_marker`.
+
+    Returns:
+        tuple: (event, label). The label is empty for markers without one.
+    """
+    event, _, label = marker.partition(":")
+    return event, label
+
+
+class MarkerOutlet:
+    """
+    LSL outlet publishing string markers for one stimulus program.
+
+    If the outlet cannot be created (e.g. liblsl is unavailable), markers
+    are not published but :meth:`push` still returns LSL clock timestamps,
+    so callers do not need a separate code path.
+
+    Attributes:
+        name (str): LSL stream name, e.g. ``NeuroCue-ImageStimuli``.
+        outlet (pylsl.StreamOutlet or None): Underlying LSL outlet.
+    """
+    def __init__(self, name, source_id):
+        self.name = name
+        self.outlet = None
+        try:
+            info = StreamInfo(name, MARKER_STREAM_TYPE, 1, IRREGULAR_RATE, 'string', source_id)
+            self.outlet = StreamOutlet(info)
+            print(f"Marker outlet '{name}' created")
+        except Exception as e:
+            print(f"ERROR: Could not create marker outlet '{name}': {e}")
+
+    def push(self, event, label, timestamp=None):
+        """
+        Publish a marker.
+
+        Args:
+            event (str): Event type, e.g. ``onset``, ``offset``, ``run_start``.
+            label (str): Stimulus label, e.g. the file shown.
+            timestamp (float, optional): LSL clock timestamp of the event.
+                Defaults to :func:`website.clock.now` at the time of the call.
+
+        Returns:
+            float: The LSL clock timestamp attached to the marker.
+        """
+        if timestamp is None:
+            timestamp = clock.now()
+        if self.outlet is not None:
+            self.outlet.push_sample([format_marker(event, label)], timestamp)
+        return timestamp
@@ -5,6 +5,9 @@ import os
 import multiprocessing
 import json
 from datetime import datetime
+from website.command_bus import unpack_request, send_reply, send_status
+from website.command_bus import STATUS_STARTING, STATUS_READY, STATUS_FAILED
+from website import clock
 
 class VideoRecorder:
     """
@@ -16,7 +19,13 @@ class VideoRecorder:
         video_writer (cv2.VideoWriter): OpenCV video writer object.
         capture (cv2.VideoCapture): OpenCV camera capture object.
         output_filename (str): Filename for saved video.
-        frame_timestamps (list): Timestamps for each recorded frame.
+        output_dir (str): Directory of new recordings, e.g. the current session.
+        frame_timestamps (list): Wall-clock timestamps for each recorded
+            frame, derived from the project clock (:mod:`website.clock`).
+        frame_lsl_timestamps (list): Project (LSL) clock timestamps for each recorded frame.
+        frame_size (tuple or None): (width, height) of the camera frames.
+        record_from (float or None): LSL time from which captured frames are
+            recorded, e.g. a scheduled session start.
     """
     def __init__(self):
         self.recording = False
@@ -24,7 +33,11 @@ class VideoRecorder:
         self.video_writer = None
         self.capture = None
         self.output_filename = None
+        self.output_dir = "data"
         self.frame_timestamps = []
+        self.frame_lsl_timestamps = []
+        self.frame_size = None
+        self.record_from = None
         self.lock = threading.Lock()
         self.capture_thread = None
         self.display_thread = None
@@ -46,11 +59,12 @@ class VideoRecorder:
             print(f"Camera Program p1: Maximum FPS supported by camera: {max_fps}")
             self.capture.set(cv2.CAP_PROP_FPS, max_fps)
             
-            ret, _ = self.capture.read()
+            ret, frame = self.capture.read()
             if not ret:
                 print("Camera Program p1: ERROR: Could not read frame from camera!")
                 self.capture.release()
                 return False
+            self.frame_size = (frame.shape[1], frame.shape[0])
                 
             print("Camera Program p1: Camera initialized successfully")
             return True
@@ -68,13 +82,15 @@ class VideoRecorder:
         try:
             while self.recording or self.show_feed:
                 ret, frame = self.capture.read()
+                captured_at = clock.now()
                 if not ret:
                     print("Camera Program p1: ERROR: Failed to read frame from camera")
                     break
                     
                 with self.lock:
-                    if self.recording and self.video_writer is not None:
-                        self.frame_timestamps.append(datetime.now().timestamp())
+                    if self.recording and self.video_writer is not None and captured_at >= self.record_from:
+                        self.frame_timestamps.append(clock.wall_time(captured_at))
+                        self.frame_lsl_timestamps.append(captured_at)
                         self.video_writer.write(frame)
                         
                     if self.show_feed:
@@ -89,36 +105,47 @@ class VideoRecorder:
         finally:
             print("Camera Program p1: Frame capture stopped")
 
-    def start_recording(self):
+    def start_recording(self, start_at=None):
         """
         Start recording video.
         Saves video to a timestamped file and stores frame timestamps.
+
+        The video writer is opened with the frame size found by
+        :meth:`setup_camera`, so no frame is read while holding the lock;
+        the capture thread records every frame from then on.
+
+        Args:
+            start_at (float, optional): LSL time of a scheduled session start.
+                The recording is armed now and only frames captured from
+                that time on are recorded.
+
+        Returns:
+            str or None: Why the recording did not start, None if it started.
         """
         with self.lock:
             if self.recording:
                 print("Camera Program p1: Already recording")
-                return
+                return "Already recording"
+            if self.capture is None or self.frame_size is None:
+                print("Camera Program p1: ERROR: Camera is not initialized")
+                return "Camera is not initialized"
                 
             try:
-                ret, frame = self.capture.read()
-                if not ret:
-                    print("Camera Program p1: ERROR: Couldn't read frame to start recording")
-                    return
-                    
                 timestamp = time.strftime('%Y%m%d_%H%M%S')
-                self.output_filename = f"data/recording_start_time_{timestamp}.avi"
-                self.frame_timestamps = [datetime.now().timestamp()]
+                self.output_filename = f"{self.output_dir}/recording_start_time_{timestamp}.avi"
+                self.frame_timestamps = []
+                self.frame_lsl_timestamps = []
+                self.record_from = clock.now() if start_at is None else start_at
                 
                 fourcc = cv2.VideoWriter_fourcc(*'XVID')
-                h, w = frame.shape[:2]
                 max_fps = self.capture.get(cv2.CAP_PROP_FPS)
-                self.video_writer = cv2.VideoWriter(self.output_filename, fourcc, max_fps, (w, h))
+                self.video_writer = cv2.VideoWriter(self.output_filename, fourcc, max_fps, self.frame_size)
                 
                 if not self.video_writer.isOpened():
                     print(f"Camera Program p1: ERROR: Failed to open video writer for file: {self.output_filename}")
-                    return
+                    self.video_writer = None
+                    return f"Failed to open video writer for file: {self.output_filename}"
                     
-                self.video_writer.write(frame)
                 self.recording = True
                 
                 # Start capture thread if not already running
@@ -127,12 +154,15 @@ class VideoRecorder:
                     self.capture_thread.start()
                     
                 print(f"Camera Program p1: Recording started - saving to {self.output_filename} at {max_fps} FPS")
+                return None
                 
             except Exception as e:
                 print(f"Camera Program p1: ERROR starting recording: {e}")
+                self.recording = False
                 if self.video_writer is not None:
                     self.video_writer.release()
                     self.video_writer = None
+                return f"Error starting recording: {e}"
 
     def stop_recording(self):
         """
@@ -154,8 +184,9 @@ class VideoRecorder:
                         json_data = [{
                             'frame_number': i,
                             'timestamp': ts,
+                            'lsl_timestamp': lsl_ts,
                             'datetime': datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')
-                        } for i, ts in enumerate(self.frame_timestamps)]
+                        } for i, (ts, lsl_ts) in enumerate(zip(self.frame_timestamps, self.frame_lsl_timestamps))]
                         json.dump(json_data, jsonfile, indent=4)
                                     
                     print(f"Camera Program p1: Recording stopped and saved to {self.output_filename}")
@@ -172,6 +203,22 @@ class VideoRecorder:
             finally:
                 self.recording = False
 
+    def sync_status(self):
+        """
+        Return the start of the current recording for the session start report.
+
+        Returns:
+            dict: ``record_from`` and ``first_frame`` (LSL times, None if
+            unknown) and the nominal ``frame_period`` in seconds.
+        """
+        with self.lock:
+            fps = self.capture.get(cv2.CAP_PROP_FPS) if self.capture is not None else 0
+            return {
+                'record_from': self.record_from,
+                'first_frame': self.frame_lsl_timestamps[0] if self.frame_lsl_timestamps else None,
+                'frame_period': 1.0 / fps if fps else None
+            }
+
     def display_feed(self):
         """
         Start displaying the live camera feed in a separate window.
@@ -226,38 +273,51 @@ class VideoRecorder:
                 
             print("Camera Program p1: All resources cleaned up")
 
-def handle_command(recorder, command, conn):
+def handle_command(recorder, command, data=None):
     """
     Handle a command string received from the parent program.
 
     Args:
         recorder (VideoRecorder): Instance of VideoRecorder to execute commands.
         command (str): Command string.
-        conn (multiprocessing.Connection): Pipe connection to send back responses.
+        data (Any, optional): Payload sent with the command, e.g. the
+            directory for ``set_session_dir`` or the scheduled ``start_at``
+            for ``start_recording``.
+
+    Returns:
+        str or dict: Response sent back to the parent program; a dict with
+        an ``error`` message if the command failed.
     """
     command = command.strip().lower()
     print(f"Camera Program p1: Received command: {command}")
     
     if command == "show_feed":
         recorder.display_feed()
-        conn.send("Camera Feed started")
+        return "Camera Feed started"
     elif command == "close_feed":
         recorder.close_feed()
-        conn.send("Camera Feed closed")
+        return "Camera Feed closed"
     elif command == "start_recording":
-        recorder.start_recording()
-        conn.send("Recording started")
+        error = recorder.start_recording((data or {}).get('start_at'))
+        if error is not None:
+            return {'error': f"Recording not started: {error}"}
+        return "Recording started"
+    elif command == "sync_status":
+        return recorder.sync_status()
     elif command == "stop_recording":
         recorder.stop_recording()
-        conn.send("Recording stopped")
+        return "Recording stopped"
     elif command == "video_clean_up":
         recorder.video_clean_up()
-        conn.send("Cleaned up video data")
+        return "Cleaned up video data"
     elif command == "initialize_camera":
         recorder.setup_camera()
-        conn.send("Initialized camera")
+        return "Initialized camera"
+    elif command == "set_session_dir":
+        recorder.output_dir = data or "data"
+        return f"Recording to {recorder.output_dir}"
     else:
-        conn.send(f"Unknown command: {command}")
+        return f"Unknown command: {command}"
 
 def command_listener(recorder, conn):
     """
@@ -271,16 +331,23 @@ def command_listener(recorder, conn):
         print("Camera Program p1: Command listener started. Waiting for commands...")
         
         while True:
-            if conn.poll():
-                command = conn.recv()
-                if command == "exit":
-                    print("Camera Program p1: Received exit command. Shutting down...")
-                    recorder.video_clean_up()
-                    print("Camera Program p1: Program exited")
-                    break
-                if command:
-                    handle_command(recorder, command, conn)
-                    
+            message = conn.recv()  # Blocks until the parent sends a command
+            request_id, command, data = unpack_request(message)
+            if command == "exit":
+                print("Camera Program p1: Received exit command. Shutting down...")
+                recorder.video_clean_up()
+                print("Camera Program p1: Program exited")
+                if request_id is not None:
+                    send_reply(conn, request_id, "Exiting")
+                break
+            if command:
+                received_at = time.perf_counter()
+                response = handle_command(recorder, command, data)
+                send_reply(conn, request_id, response)
+                print(f"Camera Program p1: Handled command in {(time.perf_counter() - received_at) * 1000:.2f} ms")
+                
+    except EOFError:
+        print("Camera Program p1: Parent connection closed.")
     except Exception as e:
         print(f"Camera Program p1: Command listener error: {e}")
     finally:
@@ -291,6 +358,9 @@ def main(conn):
     """
     Main entry point for the video program.
 
+    Opens the camera on startup and reports ``ready`` (or ``failed`` if the
+    camera cannot be opened) to the parent over the command pipe.
+
     Args:
         conn (multiprocessing.Connection): Pipe connection to receive commands.
     """
@@ -301,11 +371,18 @@ def main(conn):
         listener_thread = threading.Thread(target=command_listener, args=(recorder, conn))
         listener_thread.daemon = True
         listener_thread.start()
+        send_status(conn, STATUS_STARTING, stage="imports_done")
+
+        # Open the camera right away and report readiness to the parent
+        camera_opened = recorder.setup_camera()
+        send_status(conn, STATUS_READY if camera_opened else STATUS_FAILED, camera_opened=camera_opened)
         
         print("Camera Program p1: Video Program ready. Run Parent Program to send commands.")
         
-        while True:
-            time.sleep(1)
+        # Wait for the listener to finish (exit command); the timeout keeps
+        # the main thread responsive to KeyboardInterrupt on Windows
+        while listener_thread.is_alive():
+            listener_thread.join(timeout=1)
             
     except KeyboardInterrupt:
         print("Camera Program p1: Program interrupted by user")
@@ -2,12 +2,18 @@ import json
 import os
 import time
 import tkinter as tk
-from tkinter import messagebox
 import multiprocessing
 import threading
 import queue
 import json
 from datetime import datetime
+from PIL import ImageTk
+from website.stimulus_cache import ImageStimulusCache, resolve_image_path, IMAGE_EXTENSIONS
+from website.scheduler import StimulusScheduler, timing_report_path
+from website.markers import MarkerOutlet
+from website.command_bus import unpack_request, send_reply, send_status, is_notification, LatencyHistogram
+from website.command_bus import STATUS_STARTING, STATUS_READY, STATUS_FAILED
+from website import clock
 
 # Global variables
 config = {}
@@ -17,7 +23,29 @@ tkinter_thread = None  # Thread for running Tkinter
 root = None  # Tkinter root window
 label = None  # Tkinter label for displaying images
 stop_event = threading.Event()  # Event to signal threads to stop
+run_generation = 0  # Incremented by every start and stop, a queued run only starts if still current
+run_lock = threading.Lock()  # Guards run_generation and the stop of the active run
+RUN_TASKS = ("start_stimuli", "start_closed_loop")  # Display tasks that start a run
 window_destroyed = False  # Flag to track if the Tkinter window is destroyed
+image_cache = ImageStimulusCache()  # Decoded, screen-scaled images shared across runs
+frames = {}  # Prepared PhotoImages of the persistent window, keyed by (path, mtime, size)
+SCALE_TO_SCREEN = True  # Scale images to fit the screen resolution before the run
+COUNTDOWN_FONT = ("Arial", 100)  # Font of the initial delay countdown
+IDLE_UPDATE_INTERVAL = 0.5  # seconds between Tkinter updates while the window is hidden
+EXIT_TIMEOUT = 5.0  # seconds to wait for the display thread to close the window on exit
+scheduler = StimulusScheduler()  # Deadline-based onset scheduling and timing report
+marker_outlet = None  # LSL marker outlet for stimulus onsets/offsets, created in main()
+current_stimulus = None  # Label of the stimulus currently on screen
+stimuli_timestamps = []  # Wall-clock onset timestamps of the current run, from the project clock
+stimuli_lsl_timestamps = []  # Project (LSL) clock onset timestamps of the current run
+stimuli_file = []  # Labels of the stimuli shown in the current run
+output_dir = "data"  # Directory of the stimuli logs, e.g. the current session
+closed_loop_triggers = queue.Queue()  # Closed-loop triggers from the control application
+TRIGGER_MAX_AGE = 0.05  # seconds; older triggers are dropped, bounding the decision-to-onset latency
+# Parts of the closed-loop latency, each from the previous timestamp of a trial (see website.closed_loop)
+LATENCY_PARTS = (('acquisition_ms', 'sample_time', 'arrival'), ('processing_ms', 'arrival', 'decision'),
+                 ('transport_ms', 'decision', 'received'), ('display_ms', 'received', 'onset'),
+                 ('total_ms', 'arrival', 'onset'))
 
 def load_stimuli():
     """
@@ -59,7 +87,11 @@ def save_config(json_data):
 
 def initialize_tkinter():
     """
-    Initialize a fullscreen Tkinter window in a separate thread.
+    Initialize the persistent fullscreen Tkinter window.
+
+    Called once from the display thread when the program starts. The window
+    is warmed up (fullscreen mapping, countdown font loaded) and then hidden
+    until a run shows it again with :func:`show_window`.
 
     Returns:
         tuple:
@@ -71,30 +103,55 @@ def initialize_tkinter():
     # Reset flags
     window_destroyed = False
     
-    # Create the Tkinter window in the main thread
+    # Create the Tkinter window in the display thread
     root = tk.Tk()
     root.attributes("-fullscreen", True)
     root.configure(background='black')
-    label = tk.Label(root, bg='black')
+    label = tk.Label(root, bg='black', fg='white', font=COUNTDOWN_FONT)
     label.pack(expand=True, fill=tk.BOTH)
     
     # Protocol for window closing
     root.protocol("WM_DELETE_WINDOW", lambda: stop_event.set())
+
+    # Render the countdown digits once so the font is loaded before the first run
+    for digit in "0123456789":
+        label.config(text=digit)
+        root.update_idletasks()
+    label.config(text="")
+    root.update()
+    root.withdraw()
     
     print("Image Stimuli Program p2: Tkinter window initialized.")
     return root, label
 
+def show_window():
+    """Map the persistent window fullscreen in front of other windows."""
+    root.deiconify()
+    root.attributes("-fullscreen", True)
+    root.lift()
+    root.focus_force()
+    root.update()
+
+def hide_window():
+    """Blank the persistent window and hide it until the next run."""
+    label.config(image="", text="")
+    label.image = None
+    root.withdraw()
+    root.update()
+
 def update_ui(task_type, data=None):
     """
     Update the Tkinter UI depending on the given task type.
 
     Args:
         task_type (str): One of ``update_label``, ``display_image``,
-            or ``close_window``.
+            or ``close_window``. ``close_window`` hides the persistent
+            window and saves the stimuli log.
         data (Any, optional): Data associated with the task:
             - For ``update_label``: a string to display.
-            - For ``display_image``: path to an image file.
-            - For ``close_window``: list [timestamps, filenames, json_filename].
+            - For ``display_image``: a prepared ``ImageTk.PhotoImage``.
+            - For ``close_window``: list [timestamps, filenames, json_filename,
+              lsl_timestamps].
     """
     global root, label, window_destroyed
     
@@ -103,29 +160,25 @@ def update_ui(task_type, data=None):
         
     try:
         if task_type == "update_label":
-            label.config(text=data, fg='white', font=("Arial", 100))
+            label.config(image="", text=data)
 
         elif task_type == "display_image":
-            image = tk.PhotoImage(file=data)
-            label.config(image=image, text="")
-            label.image = image  # Keep a reference to avoid garbage collection
+            label.config(image=data, text="")
+            label.image = data  # Keep a reference to avoid garbage collection
 
         elif task_type == "close_window":
-            if not window_destroyed:
-                print("Image Stimuli Program p2: Closing Tkinter window...")
-                window_destroyed = True
-                root.destroy()
-                root = None
-                label = None
+            print("Image Stimuli Program p2: Hiding Tkinter window...")
+            hide_window()
 
             # save stimuli timestamps to json
             with open(data[2], 'w') as jsonfile:
                 json_data = []
-                for i, (ts, fn) in enumerate(zip(data[0], data[1])):
+                for i, (ts, fn, lsl_ts) in enumerate(zip(data[0], data[1], data[3])):
                     dt = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')
                     json_data.append({
                         'file_shown': fn,
                         'timestamp': ts,
+                        'lsl_timestamp': lsl_ts,
                         'datetime': dt
                     })
                 json.dump(json_data, jsonfile, indent=4)
@@ -136,65 +189,119 @@ def update_ui(task_type, data=None):
 
 def cleanup():
     """
-    Clean up resources, stop threads, and reset global variables.
+    Stop a running stimuli presentation and cancel queued runs.
+
+    Safe to call from any thread: Tkinter is only touched by the display
+    thread, which ends the run, hides the window and keeps it for the next
+    run. ``stop_event`` is cleared again when the next run starts.
 
     Side effects:
-        - Stops all active threads by setting ``stop_event``.
-        - Closes Tkinter window if open.
-        - Clears timestamps and filenames for stimuli.
+        - Advances ``run_generation``, so runs queued before are skipped.
+        - Stops the active run by setting ``stop_event``.
+        - Drops pending start tasks from ``tkinter_queue``; other tasks
+          (``prepare``, ``exit``) are kept in order.
+
+    Returns:
+        int: The new run generation, to queue the next run with.
     """
-    global stop_event, tkinter_thread, window_destroyed, root, label, stimuli_timestamps, stimuli_file
-    
-    # Signal all threads to stop
-    stop_event.set()
-    
-    # Close Tkinter window if it exists
-    if root is not None:
+    global stop_event, run_generation
+
+    # Cancel queued runs and stop the active one together, see start_run()
+    with run_lock:
+        run_generation += 1
+        generation = run_generation
+        stop_event.set()
+
+    # Drop queued starts, keep the other display tasks
+    pending = []
+    while True:
         try:
-            print("Image Stimuli Program p2: Closing Tkinter window from cleanup...")
-            window_destroyed = True
-            root.destroy()
-        except Exception as e:
-            print(f"Image Stimuli Program p2: Error closing Tkinter window: {e}")
-    
-    # Reset all Tkinter-related variables
-    root = None
-    label = None
-    window_destroyed = True
-    
-    # Reset event for future use
-    stop_event.clear()
+            pending.append(tkinter_queue.get_nowait())
+        except queue.Empty:
+            break
+    for task in pending:
+        if task[0] not in RUN_TASKS:
+            tkinter_queue.put(task)
 
-    stimuli_timestamps = []
-    stimuli_file = []
-    
     print("Image Stimuli Program p2: Cleanup completed.")
+    return generation
 
-def start_stimuli():
+def start_run(generation=None):
     """
-    Start displaying images according to the loaded configuration.
+    Reset ``stop_event`` for a run, unless the run was cancelled meanwhile.
 
-    Uses ``config`` values for:
-        - fileSequence: Comma-separated image names.
-        - fileDuration: Comma-separated durations for each image.
-        - initialDelay: Countdown time before starting.
+    The check and the reset hold ``run_lock`` like ``cleanup()``, so a stop
+    either cancels the run here or sets ``stop_event`` after it was cleared.
 
-    Displays each image sequentially in a fullscreen Tkinter window,
-    logs timestamps, and saves output to JSON.
+    Args:
+        generation (int, optional): Generation the run was queued with.
+            ``None`` starts the run unconditionally.
+
+    Returns:
+        bool: True if the run may start.
     """
-    global config, root, label, stop_event, window_destroyed, stimuli_timestamps, stimuli_file
+    with run_lock:
+        if generation is not None and generation != run_generation:
+            print("Image Stimuli Program p2: Run cancelled before it started.")
+            return False
+        stop_event.clear()
+        return True
+
+def log_onset(stimulus, onset=None):
+    """
+    Log the onset of a stimulus that has just been presented.
 
-    # Initialize frame timestamps list
-    stimuli_timestamps = []
-    stimuli_file = []
-    
-    # Reset stop event
-    stop_event.clear()
-    
+    Records wall-clock and LSL clock timestamps, publishes an ``offset``
+    marker for the previous stimulus and an ``onset`` marker for this one
+    with the same LSL timestamp, and records the onset in the scheduler.
+
+    Args:
+        stimulus (str): Label of the stimulus (file shown or countdown step).
+        onset (float, optional): Intended onset in seconds from the run start.
+
+    Returns:
+        float: LSL timestamp of the onset.
+    """
+    global current_stimulus
+
+    lsl_timestamp = clock.now()
+    if marker_outlet is not None:
+        if current_stimulus is not None:
+            marker_outlet.push("offset", current_stimulus, lsl_timestamp)
+        marker_outlet.push("onset", stimulus, lsl_timestamp)
+    current_stimulus = stimulus
+
+    stimuli_timestamps.append(clock.wall_time(lsl_timestamp))
+    stimuli_lsl_timestamps.append(lsl_timestamp)
+    stimuli_file.append(stimulus)
+    if onset is not None:
+        scheduler.record(stimulus, onset)
+    return lsl_timestamp
+
+def log_run_end():
+    """Publish the ``offset`` marker of the last stimulus shown in the run."""
+    global current_stimulus
+
+    if marker_outlet is not None and current_stimulus is not None:
+        marker_outlet.push("offset", current_stimulus)
+    current_stimulus = None
+
+def read_sequence():
+    """
+    Read the image sequence from the loaded configuration.
+
+    Image files are resolved up front and missing ones are dropped from the
+    sequence with an error message.
+
+    Returns:
+        tuple or None: (sequence, initial_delay) where ``sequence`` is a list
+        of (image_path, duration) pairs, or None if the configuration is
+        missing or invalid.
+    """
     with config_lock:
         if not config:
             print("Image Stimuli Program p2: No configuration loaded. Please load or save a configuration first.")
-            return
+            return None
 
         # Extract values from the configuration
         file_sequence = config.get("fileSequence", "").split(",")
@@ -207,89 +314,418 @@ def start_stimuli():
         # Check if the number of files and durations match
         if len(file_sequence) != len(file_duration):
             print("Image Stimuli Program p2: ERROR: The number of files and durations do not match.")
-            return
+            return None
+
+    # Resolve image files up front and drop missing ones from the sequence
+    sequence = []
+    for file, duration in zip(file_sequence, file_duration):
+        image_path = resolve_image_path(file)
+        if image_path is None:
+            print(f"Image Stimuli Program p2: ERROR: File image_stimuli/{file} not found "
+                  f"(tried {', '.join(IMAGE_EXTENSIONS)}).")
+            continue
+        sequence.append((image_path, duration))
+
+    return sequence, initial_delay
+
+def prepare_frames(sequence):
+    """
+    Decode, scale and convert the images of a sequence to PhotoImages.
+
+    Must run in the display thread. Frames already prepared for the
+    persistent window are reused as long as the file is unchanged, so
+    preparing on configuration load makes the following run start without
+    any decoding. Frames of images no longer in the sequence are released.
+
+    Args:
+        sequence (list): (image_path, duration) pairs from :func:`read_sequence`.
+
+    Returns:
+        dict: Mapping of image path to its prepared ``ImageTk.PhotoImage``.
+    """
+    screen_size = (root.winfo_screenwidth(), root.winfo_screenheight()) if SCALE_TO_SCREEN else None
+    preload_start = time.perf_counter()
+    keys = {path: (path, os.stat(path).st_mtime_ns, screen_size) for path, _ in sequence}
+    missing = [path for path, key in keys.items() if key not in frames]
+    images = image_cache.preload(missing, screen_size)
+    for path, image in images.items():
+        frames[keys[path]] = ImageTk.PhotoImage(image, master=root)
+    for key in set(frames) - set(keys.values()):
+        del frames[key]
+    print(f"Image Stimuli Program p2: Prepared {len(images)} new images in "
+          f"{(time.perf_counter() - preload_start) * 1000:.1f} ms "
+          f"(hits={image_cache.hits}, disk={image_cache.disk_hits}, decoded={image_cache.misses})")
+    return {path: frames[key] for path, key in keys.items()}
+
+def run_countdown(initial_delay, onset=0.0):
+    """
+    Show the initial delay countdown, one step per second.
+
+    Args:
+        initial_delay (int): Seconds of countdown.
+        onset (float): Onset of the first step in seconds from the run start.
+
+    Returns:
+        float: Onset after the countdown, whether or not it was interrupted.
+    """
+    for i in range(initial_delay, 0, -1):
+        if not scheduler.wait_until(onset, stop_event):
+            break  # Exit if stop event is set
+        update_ui("update_label", str(i))
+        log_onset(f"initial_delay_{i}", onset)
+        onset += 1
+    return onset
+
+def start_stimuli(requested_at=None, start_at=None, generation=None):
+    """
+    Start displaying images according to the loaded configuration.
+
+    Uses ``config`` values for:
+        - fileSequence: Comma-separated image names.
+        - fileDuration: Comma-separated durations for each image.
+        - initialDelay: Countdown time before starting.
+
+    Displays each image sequentially in a fullscreen Tkinter window,
+    logs timestamps, and saves output to JSON.
+
+    All images of the sequence are decoded and scaled before the countdown
+    starts, so no file access or decoding happens at stimulus onset. Onsets
+    are scheduled against absolute deadlines from the run start, and the
+    intended vs. actual onset of each trial is written to a
+    ``*_timing.json`` report next to the stimuli log.
+
+    Runs in the display thread and reuses the persistent window, which is
+    shown for the run and hidden again afterwards.
+
+    Args:
+        requested_at (float, optional): Project clock time of the
+            start request, used to report the request-to-first-onset latency.
+        start_at (float, optional): Project clock time of a scheduled session start.
+            The run is prepared right away and its first onset is scheduled
+            at that time.
+        generation (int, optional): Run generation the start was queued
+            with; the run is skipped if it was stopped meanwhile.
+    """
+    global config, root, label, stop_event, window_destroyed, stimuli_timestamps, stimuli_file
+    global stimuli_lsl_timestamps, current_stimulus
+
+    # Reset stop event, unless the run was stopped while queued
+    if not start_run(generation):
+        return
+
+    # Initialize frame timestamps list
+    stimuli_timestamps = []
+    stimuli_lsl_timestamps = []
+    stimuli_file = []
+    current_stimulus = None
+    
+    loaded = read_sequence()
+    if loaded is None:
+        return
+    sequence, initial_delay = loaded
     
-    # Initialize Tkinter window
     try:
-        # Create new Tkinter window
-        global root, label
-        root, label = initialize_tkinter()
-        window_destroyed = False
+        # Decode and scale images not prepared yet, then show the warm window
+        sequence_frames = prepare_frames(sequence)
+        show_window()
 
         timestamp = time.strftime('%Y%m%d_%H%M%S')
-        output_filename = f"data/image_stimuli_start_time_{timestamp}.json"
+        output_filename = f"{output_dir}/image_stimuli_start_time_{timestamp}.json"
 
-        # Initial delay countdown
-        for i in range(initial_delay, 0, -1):
-            if stop_event.is_set():
-                break  # Exit if stop event is set
-            stimuli_timestamps.append(datetime.now().timestamp())
-            stimuli_file.append(f"initial_delay_{i}")
-            update_ui("update_label", str(i))
-            time.sleep(1)
+        # All onsets are scheduled as absolute offsets from a single run start,
+        # now or at a scheduled session start
+        scheduler.start(requested_at, start_at)
+        onset = run_countdown(initial_delay)
 
         # Display each image for the specified duration
-        for file, duration in zip(file_sequence, file_duration):
-            if stop_event.is_set():
+        for image_path, duration in sequence:
+            if not scheduler.wait_until(onset, stop_event):
                 break  # Exit if stop event is set
 
             try:
-                image_path = f"image_stimuli/{file}.png"
-                if not os.path.exists(image_path):
-                    print(f"Image Stimuli Program p2: ERROR: File {image_path} not found.")
-                    continue
-
                 # Display the image
-                stimuli_timestamps.append(datetime.now().timestamp())
-                stimuli_file.append(image_path)
-                update_ui("display_image", image_path)
-
-                # Wait for the specified duration
-                time.sleep(duration)
+                update_ui("display_image", sequence_frames[image_path])
+                log_onset(image_path, onset)
             except Exception as e:
                 print(f"Image Stimuli Program p2: ERROR displaying image: {e}")
+            onset += duration
+
+        # Keep the last image on screen for its full duration
+        scheduler.wait_until(onset, stop_event)
         
         # Close the window after displaying all images
-        update_ui("close_window", [stimuli_timestamps, stimuli_file, output_filename])
+        log_run_end()
+        update_ui("close_window", [stimuli_timestamps, stimuli_file, output_filename, stimuli_lsl_timestamps])
+
+        report = scheduler.save_report(timing_report_path(output_filename))
+        if report['trials']:
+            print(f"Image Stimuli Program p2: Onset error mean {report['mean_abs_error_ms']:.3f} ms, "
+                  f"max {report['max_abs_error_ms']:.3f} ms")
     except Exception as e:
         print(f"Image Stimuli Program p2: ERROR in start_stimuli: {e}")
+        hide_window()
+
+def drain_triggers():
+    """Discard the queued closed-loop triggers and return how many there were."""
+    count = 0
+    while True:
+        try:
+            closed_loop_triggers.get_nowait()
+        except queue.Empty:
+            return count
+        count += 1
+
+def wait_for_trigger():
+    """
+    Wait for the next closed-loop trigger that is recent enough to act on.
+
+    Triggers decided more than ``TRIGGER_MAX_AGE`` ago are dropped. The
+    window is kept responsive while waiting.
+
+    Returns:
+        tuple or None: (trigger, dropped), or None if the run was stopped.
+    """
+    dropped = 0
+    while not stop_event.is_set():
+        try:
+            trigger = closed_loop_triggers.get(timeout=IDLE_UPDATE_INTERVAL)
+        except queue.Empty:
+            root.update()
+            continue
+        if clock.now() - trigger['decision'] > TRIGGER_MAX_AGE:
+            dropped += 1
+            continue
+        return trigger, dropped
+    return None
+
+def save_closed_loop_report(path, trials, dropped):
+    """
+    Write the per-trial latencies of a closed-loop run and their summary to JSON.
+
+    Args:
+        path (str): Output path, e.g. ``data/image_stimuli_start_time_*_closed_loop.json``.
+        trials (list): Trial dicts with the timestamps of :data:`LATENCY_PARTS`.
+        dropped (int): Triggers dropped as too old or arriving while an image
+            was held for its minimum duration.
+
+    Returns:
+        dict: The report that was written.
+    """
+    histograms = {name: LatencyHistogram() for name, _, _ in LATENCY_PARTS}
+    for trial in trials:
+        for name, start, end in LATENCY_PARTS:
+            trial[name] = (trial[end] - trial[start]) * 1000.0
+            histograms[name].add(trial[name])
+    report = {
+        'trials': len(trials),
+        'dropped_triggers': dropped,
+        'trigger_max_age_ms': TRIGGER_MAX_AGE * 1000.0,
+        'latency': {name: histogram.to_dict() for name, histogram in histograms.items()},
+        'trial_latency': trials
+    }
+    with open(path, 'w') as jsonfile:
+        json.dump(report, jsonfile, indent=4)
+    return report
+
+def start_closed_loop(requested_at=None, generation=None):
+    """
+    Run the image sequence in closed loop: each image is shown on a trigger.
+
+    After the countdown the screen stays blank until the first trigger from
+    the control application; each trigger then shows the next image of
+    ``fileSequence``. ``fileDuration`` is the minimum time an image stays
+    on screen: triggers arriving during it are dropped. The run ends after
+    the last image was shown for its duration, or when it is stopped.
+
+    Frames are prepared before the countdown and this thread waits on the
+    trigger queue, so a trigger is shown without any decoding or polling
+    delay. The sample, arrival, decision, reception and onset times of
+    every trial are written to a ``*_closed_loop.json`` report next to the
+    stimuli log.
+
+    Args:
+        requested_at (float, optional): Project clock time of the
+            start request.
+        generation (int, optional): Run generation the start was queued
+            with; the run is skipped if it was stopped meanwhile.
+    """
+    global stimuli_timestamps, stimuli_file, stimuli_lsl_timestamps, current_stimulus
+
+    if not start_run(generation):
+        return
+
+    stimuli_timestamps = []
+    stimuli_lsl_timestamps = []
+    stimuli_file = []
+    current_stimulus = None
+
+    loaded = read_sequence()
+    if loaded is None:
+        return
+    sequence, initial_delay = loaded
+
+    try:
+        sequence_frames = prepare_frames(sequence)
+        show_window()
+
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        output_filename = f"{output_dir}/image_stimuli_start_time_{timestamp}.json"
+
+        scheduler.start(requested_at)
+        onset = run_countdown(initial_delay)
+        scheduler.wait_until(onset, stop_event)
+        update_ui("update_label", "")
+
+        # Triggers sent during the countdown are not acted on
+        dropped = drain_triggers()
+        trials = []
+        for image_path, duration in sequence:
+            waited = wait_for_trigger()
+            if waited is None:
+                break  # Exit if stop event is set
+            trigger, stale = waited
+            dropped += stale
+            update_ui("display_image", sequence_frames[image_path])
+            trigger['onset'] = log_onset(image_path)
+            trigger['label'] = image_path
+            trials.append(trigger)
+            # Minimum display duration, triggers meanwhile are dropped
+            if stop_event.wait(duration):
+                break
+            dropped += drain_triggers()
+
+        log_run_end()
+        update_ui("close_window", [stimuli_timestamps, stimuli_file, output_filename, stimuli_lsl_timestamps])
+
+        report = save_closed_loop_report(output_filename.replace('.json', '_closed_loop.json'), trials, dropped)
+        if trials:
+            total = report['latency']['total_ms']
+            print(f"Image Stimuli Program p2: Closed loop arrival-to-onset latency mean {total['mean_ms']:.3f} ms, "
+                  f"max {total['max_ms']:.3f} ms, {dropped} triggers dropped")
+    except Exception as e:
+        print(f"Image Stimuli Program p2: ERROR in start_closed_loop: {e}")
+        hide_window()
+
+def display_loop(conn):
+    """
+    Own the persistent Tkinter window and run display tasks.
+
+    Creates the window once, then executes tasks from ``tkinter_queue``:
+    ``("prepare", None)`` prepares frames for the loaded sequence,
+    ``("start_stimuli", (requested_at, start_at, generation))`` runs a presentation,
+    ``("start_closed_loop", (requested_at, generation))`` a closed-loop presentation and
+    ``("exit", None)`` destroys the window. The hidden window is kept responsive
+    between tasks.
+
+    Reports ``ready`` to the parent once the window is warmed up, or
+    ``failed`` if it cannot be created.
+
+    Args:
+        conn (multiprocessing.Connection): Pipe used to report readiness.
+    """
+    global window_destroyed
+
+    try:
+        initialize_tkinter()
+    except Exception as e:
+        print(f"Image Stimuli Program p2: ERROR creating stimulus window: {e}")
+        send_status(conn, STATUS_FAILED, display=False, error=str(e))
+        return
+    send_status(conn, STATUS_READY, display=True)
+
+    try:
+        while True:
+            try:
+                task, data = tkinter_queue.get(timeout=IDLE_UPDATE_INTERVAL)
+            except queue.Empty:
+                root.update()
+                continue
+
+            if task == "exit":
+                break
+            elif task == "prepare":
+                loaded = read_sequence()
+                if loaded is not None:
+                    prepare_frames(loaded[0])
+            elif task == "start_stimuli":
+                start_stimuli(*data)
+            elif task == "start_closed_loop":
+                start_closed_loop(*data)
+    except Exception as e:
+        print(f"Image Stimuli Program p2: Display thread error: {e}")
     finally:
-        cleanup()
+        window_destroyed = True
+        root.destroy()
+        print("Image Stimuli Program p2: Tkinter window closed.")
 
-def handle_command(command, conn):
+def handle_command(command, data=None):
     """
     Handle commands received from parent program.
 
     Args:
         command (str): Command string such as ``load_stimuli``, ``save_config``,
-            ``start_stimuli``, or ``stop_stimuli``.
+            ``start_stimuli``, ``start_closed_loop``, ``stop_stimuli``,
+            ``sync_status`` or ``set_session_dir``.
+        data (Any, optional): Payload sent with the command, e.g. the JSON
+            configuration for ``save_config`` or the scheduled ``start_at``
+            for ``start_stimuli``.
 
-    Sends back responses over the connection.
+    Returns:
+        str or dict: Response sent back to the parent program.
     """
+    global output_dir
+
     command = command.strip().lower()
     print(f"Image Stimuli Program p2: Received command: {command}")
 
     if command == "load_stimuli":
         load_stimuli()
-        conn.send("Stimuli configuration loaded")
+        tkinter_queue.put(("prepare", None))
+        return "Stimuli configuration loaded"
     elif command == "save_config":
-        json_data = conn.recv()
-        save_config(json_data)
-        conn.send("Configuration saved")
+        save_config(data)
+        tkinter_queue.put(("prepare", None))
+        return "Configuration saved"
     elif command == "start_stimuli":
-        # Make sure any previous resources are cleaned up
-        cleanup()
-        # Start new stimuli session in a new thread
-        start_thread = threading.Thread(target=start_stimuli)
-        start_thread.daemon = True
-        start_thread.start()
-        conn.send("Stimuli started")
+        # Make sure any previous run is stopped
+        generation = cleanup()
+        # Run the new stimuli session in the display thread
+        tkinter_queue.put(("start_stimuli", (clock.now(), (data or {}).get('start_at'), generation)))
+        return "Stimuli started"
+    elif command == "start_closed_loop":
+        generation = cleanup()
+        tkinter_queue.put(("start_closed_loop", (clock.now(), generation)))
+        return "Closed-loop stimuli started"
     elif command == "stop_stimuli":
-        stop_event.set()  # Signal to stop
+        # Stops the active run and cancels the queued ones
         cleanup()
-        conn.send("Stimuli stopped")
+        return "Stimuli stopped"
+    elif command == "sync_status":
+        # First onset of the current run, for the session start report
+        return {'first_onset': stimuli_lsl_timestamps[0] if stimuli_lsl_timestamps else None}
+    elif command == "set_session_dir":
+        output_dir = data or "data"
+        return f"Saving stimuli logs to {output_dir}"
     else:
-        conn.send(f"Unknown command: {command}")
+        return f"Unknown command: {command}"
+
+def handle_notification(command, data=None):
+    """
+    Handle a one-way message from the parent program, which gets no reply.
+
+    ``closed_loop_trigger`` is timestamped on arrival and queued for the
+    closed-loop run in the display thread.
+
+    Args:
+        command (str): Notification command.
+        data (dict, optional): Payload, e.g. the trigger timing.
+    """
+    if command == "closed_loop_trigger":
+        trigger = dict(data or {})
+        trigger['received'] = clock.now()
+        closed_loop_triggers.put(trigger)
+    else:
+        print(f"Image Stimuli Program p2: Unknown notification: {command}")
 
 def command_listener(conn):
     """
@@ -304,16 +740,26 @@ def command_listener(conn):
     try:
         print("Image Stimuli Program p2: Command listener started. Waiting for commands...")
         while True:
-            if conn.poll():
-                command = conn.recv()
-                if command == "exit":
-                    print("Image Stimuli Program p2: Received exit command. Shutting down...")
-                    stop_event.set()
-                    cleanup()
-                    break
-                if command:
-                    handle_command(command, conn)
-            time.sleep(0.1)  # Small delay to prevent high CPU usage
+            message = conn.recv()  # Blocks until the parent sends a command
+            if is_notification(message):
+                handle_notification(message['command'], message.get('data'))
+                continue
+            request_id, command, data = unpack_request(message)
+            if command == "exit":
+                print("Image Stimuli Program p2: Received exit command. Shutting down...")
+                stop_event.set()
+                cleanup()
+                tkinter_queue.put(("exit", None))
+                if request_id is not None:
+                    send_reply(conn, request_id, "Exiting")
+                break
+            if command:
+                received_at = time.perf_counter()
+                response = handle_command(command, data)
+                send_reply(conn, request_id, response)
+                print(f"Image Stimuli Program p2: Handled command in {(time.perf_counter() - received_at) * 1000:.2f} ms")
+    except EOFError:
+        print("Image Stimuli Program p2: Parent connection closed.")
     except Exception as e:
         print(f"Image Stimuli Program p2: Command listener error: {e}")
     finally:
@@ -322,21 +768,36 @@ def command_listener(conn):
 
 def main(conn):
     """Main function to start the program."""
+    global marker_outlet, tkinter_thread
+
     print("Image Stimuli Program p2: Program starting...")
+    send_status(conn, STATUS_STARTING, stage="imports_done")
+    marker_outlet = MarkerOutlet("NeuroCue-ImageStimuli", "neurocue-p2")
     try:
+        # Create the persistent stimulus window in the display thread
+        tkinter_thread = threading.Thread(target=display_loop, args=(conn,))
+        tkinter_thread.daemon = True
+        tkinter_thread.start()
+
         # Start command listener in a separate thread
         listener_thread = threading.Thread(target=command_listener, args=(conn,))
         listener_thread.daemon = True
         listener_thread.start()
 
         print("Image Stimuli Program p2: Program ready. Run another program to send commands.")
-        while True:
-            time.sleep(1)
+        # Wait for the listener to finish (exit command); the timeout keeps
+        # the main thread responsive to KeyboardInterrupt on Windows
+        while listener_thread.is_alive():
+            listener_thread.join(timeout=1)
     except KeyboardInterrupt:
         print("Image Stimuli Program p2: Program interrupted by user")
     finally:
         stop_event.set()
         cleanup()
+        tkinter_queue.put(("exit", None))
+        # Let the display thread destroy the window before the process ends
+        if tkinter_thread is not None:
+            tkinter_thread.join(timeout=EXIT_TIMEOUT)
         print("Image Stimuli Program p2: Program exited")
 
 if __name__ == "__main__":
@@ -2,15 +2,16 @@ import json
 import os
 import time
 import tkinter as tk
-from tkinter import messagebox
 import multiprocessing
 import threading
 import queue
 from datetime import datetime
-import cv2
-from PIL import Image, ImageTk
-import vlc
-import platform
+from website.scheduler import StimulusScheduler, timing_report_path
+from website.markers import MarkerOutlet
+from website.video_player import VideoPlayer
+from website.command_bus import unpack_request, send_reply, send_status
+from website.command_bus import STATUS_STARTING, STATUS_READY, STATUS_FAILED
+from website import clock
 
 # Global variables
 config = {}
@@ -21,6 +22,18 @@ root = None  # Tkinter root window
 label = None  # Tkinter label for displaying videos
 stop_event = threading.Event()  # Event to signal threads to stop
 window_destroyed = False  # Flag to track if the Tkinter window is destroyed
+scheduler = StimulusScheduler()  # Deadline-based onset scheduling and timing report
+COUNTDOWN_FONT = ("Arial", 100)  # Font of the initial delay countdown
+IDLE_UPDATE_INTERVAL = 0.5  # seconds between Tkinter updates while the window is hidden
+EXIT_TIMEOUT = 5.0  # seconds to wait for the display thread to close the window on exit
+VIDEO_UPDATE_INTERVAL = 0.05  # seconds between Tkinter updates while a video plays
+marker_outlet = None  # LSL marker outlet for stimulus onsets/offsets, created in main()
+current_stimulus = None  # Label of the stimulus currently on screen
+stimuli_timestamps = []  # Wall-clock onset timestamps of the current run
+stimuli_lsl_timestamps = []  # LSL clock onset timestamps of the current run
+stimuli_file = []  # Labels of the stimuli shown in the current run
+output_dir = "data"  # Directory of the stimuli logs, e.g. the current session
+video_player = None  # VLC instance and player shared by all videos of the current run
 
 def load_stimuli():
     """
@@ -65,7 +78,11 @@ def save_config(json_data):
 
 def initialize_tkinter():
     """
-    Initialize a fullscreen Tkinter window for video display.
+    Initialize the persistent fullscreen Tkinter window for video display.
+
+    Called once from the display thread when the program starts. The window
+    is warmed up (fullscreen mapping, countdown font loaded) and then hidden
+    until a run shows it again with :func:`show_window`.
 
     Returns:
         tuple: (root, label)
@@ -77,19 +94,41 @@ def initialize_tkinter():
     # Reset flags
     window_destroyed = False
     
-    # Create the Tkinter window in the main thread
+    # Create the Tkinter window in the display thread
     root = tk.Tk()
     root.attributes("-fullscreen", True)
     root.configure(background='black')
-    label = tk.Label(root, bg='black')
+    label = tk.Label(root, bg='black', fg='white', font=COUNTDOWN_FONT)
     label.pack(expand=True, fill=tk.BOTH)
     
     # Protocol for window closing
     root.protocol("WM_DELETE_WINDOW", lambda: stop_event.set())
+
+    # Render the countdown digits once so the font is loaded before the first run
+    for digit in "0123456789":
+        label.config(text=digit)
+        root.update_idletasks()
+    label.config(text="")
+    root.update()
+    root.withdraw()
     
     print("Video Stimuli Program p4: Tkinter window initialized.")
     return root, label
 
+def show_window():
+    """Map the persistent window fullscreen in front of other windows."""
+    root.deiconify()
+    root.attributes("-fullscreen", True)
+    root.lift()
+    root.focus_force()
+    root.update()
+
+def hide_window():
+    """Blank the persistent window and hide it until the next run."""
+    label.config(image="", text="", bg='black')
+    root.withdraw()
+    root.update()
+
 def update_ui(task_type, data=None):
     """
     Update the Tkinter UI depending on the task type.
@@ -98,7 +137,7 @@ def update_ui(task_type, data=None):
         task_type (str): Type of update. Supported values:
             - "update_label" -> Display countdown numbers.
             - "black_screen" -> Replace content with a black screen.
-            - "close_window" -> Destroy Tkinter window and save results.
+            - "close_window" -> Hide the persistent window and save results.
         data (Any): Extra data required by task_type.
     """
     global root, label, window_destroyed
@@ -108,27 +147,24 @@ def update_ui(task_type, data=None):
         
     try:
         if task_type == "update_label":
-            label.config(text=data, fg='white', font=("Arial", 100))
+            label.config(text=data)
 
         elif task_type == "black_screen":
             label.config(image='', text="", bg='black')
 
         elif task_type == "close_window":
-            if not window_destroyed:
-                print("Video Stimuli Program p4: Closing Tkinter window...")
-                window_destroyed = True
-                root.destroy()
-                root = None
-                label = None
+            print("Video Stimuli Program p4: Hiding Tkinter window...")
+            hide_window()
 
             # save stimuli timestamps to json
             with open(data[2], 'w') as jsonfile:
                 json_data = []
-                for i, (ts, fn) in enumerate(zip(data[0], data[1])):
+                for i, (ts, fn, lsl_ts) in enumerate(zip(data[0], data[1], data[3])):
                     dt = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')
                     json_data.append({
                         'file_shown': fn,
                         'timestamp': ts,
+                        'lsl_timestamp': lsl_ts,
                         'datetime': dt
                     })
                 json.dump(json_data, jsonfile, indent=4)
@@ -137,92 +173,119 @@ def update_ui(task_type, data=None):
     except Exception as e:
         print(f"Video Stimuli Program p4: ERROR updating UI: {e}")
 
-def play_video(video_path, stimuli_timestamps, stimuli_file):
+def log_onset(stimulus, onset=None, lsl_timestamp=None):
     """
-    Play a video file (with audio) inside the Tkinter window using VLC.
+    Log the onset of a stimulus.
+
+    Records wall-clock and LSL clock timestamps, publishes an ``offset``
+    marker for the previous stimulus and an ``onset`` marker for this one
+    with the same LSL timestamp, and records the onset in the scheduler.
+
+    Args:
+        stimulus (str): Label of the stimulus (file shown or countdown step).
+        onset (float, optional): Intended onset in seconds from the run start.
+        lsl_timestamp (float, optional): LSL clock time at which the stimulus
+            appeared, e.g. the first video frame reported by VLC. Defaults
+            to now; the wall-clock and scheduler times are derived from it.
+    """
+    global current_stimulus
+
+    if lsl_timestamp is None:
+        lsl_timestamp = clock.now()
+    if marker_outlet is not None:
+        if current_stimulus is not None:
+            marker_outlet.push("offset", current_stimulus, lsl_timestamp)
+        marker_outlet.push("onset", stimulus, lsl_timestamp)
+    current_stimulus = stimulus
+
+    stimuli_timestamps.append(clock.wall_time(lsl_timestamp))
+    stimuli_lsl_timestamps.append(lsl_timestamp)
+    stimuli_file.append(stimulus)
+    if onset is not None:
+        scheduler.record(stimulus, onset, lsl_timestamp)
+
+def log_run_end():
+    """Publish the ``offset`` marker of the last stimulus shown in the run."""
+    global current_stimulus
+
+    if marker_outlet is not None and current_stimulus is not None:
+        marker_outlet.push("offset", current_stimulus)
+    current_stimulus = None
+
+def play_video(video_path, onset=None, next_path=None):
+    """
+    Play a video file (with audio) inside the Tkinter window using the run's
+    shared :class:`~website.video_player.VideoPlayer`.
+
+    The onset is logged through :func:`log_onset` with the time VLC
+    presented the first frame, and the next video is pre-parsed while this
+    one plays. The end of the video is signalled by VLC's end-reached event.
 
     Args:
         video_path (str): Path to the video file (.mp4 expected).
-        stimuli_timestamps (list): List to append presentation timestamps.
-        stimuli_file (list): List to append filenames of presented stimuli.
+        onset (float, optional): Intended onset in seconds from the run start,
+            recorded in the scheduler's timing report.
+        next_path (str, optional): Path of the next video to pre-parse.
 
     Returns:
-        bool: True if playback succeeded, False otherwise.
+        dict or None: The video's playback record with LSL clock
+        ``first_frame`` and ``end`` times, or None if playback failed.
     """
-    global stop_event, root, label
-
-    player = None
-    instance = None
+    global stop_event, root
 
     if not os.path.exists(video_path):
         print(f"Video Stimuli Program p4: ERROR: Video file {video_path} not found.")
-        return False
+        return None
 
     try:
-        # Create VLC player
-        instance = vlc.Instance('--quiet', '--no-video-title-show', '--no-osd', '--no-snapshot-preview')
-        player = instance.media_player_new()
-        
-
-        # Set the video file
-        media = instance.media_new(video_path)
-        player.set_media(media)
-
         # sound control
-        # player.audio_set_mute(True)
-        # player.audio_set_mute(False)
-        # player.audio_set_volume(100)
-
-        # Set the output to Tkinter window
-        hwnd = label.winfo_id()  # Get the window handle
-        player.set_hwnd(hwnd)    # Windows
-        # For Linux: player.set_xwindow(hwnd)
-        # For Mac: player.set_nsobject(hwnd)
-
-        # Record start time
-        stimuli_timestamps.append(datetime.now().timestamp())
-        stimuli_file.append(video_path)
-        # Play the video
-        player.play()
-        print(f"Video Stimuli Program p4: Playing {video_path}...")
-
-        # Wait until the video is finished or stop_event is set
+        # video_player.player.audio_set_mute(True)
+        # video_player.player.audio_set_volume(100)
+
+        # Play the video and log the onset at its first frame
+        record = video_player.play(video_path)
+        if record is None:
+            print(f"Video Stimuli Program p4: ERROR: {video_path} did not start playing.")
+            video_player.stop()
+            return None
+        log_onset(video_path, onset, record['first_frame'])
+        print(f"Video Stimuli Program p4: Playing {video_path} "
+              f"(first frame after {record['start_latency_ms']:.1f} ms)")
+
+        if next_path is not None:
+            video_player.preload(next_path)
+
+        # Wait for the end-reached event or stop_event, keeping the window responsive
         while not stop_event.is_set():
-            state = player.get_state()
-            if state in [vlc.State.Ended, vlc.State.Error]:
+            if video_player.wait_finished(VIDEO_UPDATE_INTERVAL):
                 break
             root.update()
-            time.sleep(0.1)
 
-        # Stop the player
-        player.stop()
+        # Stop the player; it is reused for the next video
+        video_player.stop()
 
-        return True
+        return record
 
     except Exception as e:
         print(f"Video Stimuli Program p4: ERROR playing video {video_path}: {e}")
-        return False
-    finally:
-        # Ensure proper cleanup of VLC resources
-        if player is not None:
-            player.stop()
-            player.release()
-        if instance is not None:
-            instance.release()
+        video_player.stop()
+        return None
     
 def cleanup():
     """
-    Clean up resources and stop all active threads.
+    Stop a running presentation and drop pending display tasks.
+
+    Safe to call from any thread: Tkinter is only touched by the display
+    thread, which ends the run, hides the window and keeps it for the next
+    run. ``stop_event`` is cleared again when the next run starts.
 
     Actions:
     - Set stop_event.
     - Clear Tkinter queue.
-    - Destroy Tkinter window if active.
-    - Reset global variables and clear stimulus lists.
     """
-    global stop_event, tkinter_thread, window_destroyed, root, label, stimuli_timestamps, stimuli_file, tkinter_queue
+    global stop_event, tkinter_queue
     
-    # Signal all threads to stop
+    # Signal the running presentation to stop
     stop_event.set()
     
     # Clear the queue
@@ -232,39 +295,34 @@ def cleanup():
         except queue.Empty:
             break
     
-    # Close Tkinter window if it exists
-    if root is not None:
-        try:
-            print("Video Stimuli Program p4: Closing Tkinter window from cleanup...")
-            window_destroyed = True
-            root.after(100, root.destroy)  # Give time for pending operations
-        except Exception as e:
-            print(f"Video Stimuli Program p4: Error closing Tkinter window: {e}")
-    
-    # Reset all variables
-    root = None
-    label = None
-    window_destroyed = True
-    
-    # Clear stimuli lists
-    stimuli_timestamps = []
-    stimuli_file = []
-    
-    # Reset event for future use
-    if stop_event.is_set():
-        stop_event.clear()
-    
     print("Video Stimuli Program p4: Cleanup completed.")
 
-def start_stimuli():
+def start_stimuli(requested_at=None, start_at=None):
     """
     Start presenting video stimuli according to the loaded configuration.
+
+    Countdown steps, videos and black screens are scheduled against absolute
+    deadlines from the run start, and the intended vs. actual onset of each
+    trial is written to a ``*_timing.json`` report next to the stimuli log.
+
+    Runs in the display thread and reuses the persistent window, which is
+    shown for the run and hidden again afterwards.
+
+    Args:
+        requested_at (float, optional): Project clock time of the
+            start request, used to report the request-to-first-onset latency.
+        start_at (float, optional): Project clock time of a scheduled session start.
+            The run is prepared right away and its first onset is scheduled
+            at that time.
     """
     global config, root, label, stop_event, window_destroyed, stimuli_timestamps, stimuli_file
+    global stimuli_lsl_timestamps, current_stimulus, video_player
 
     # Initialize frame timestamps list
     stimuli_timestamps = []
+    stimuli_lsl_timestamps = []
     stimuli_file = []
+    current_stimulus = None
     
     # Reset stop event
     stop_event.clear()
@@ -287,88 +345,169 @@ def start_stimuli():
             print("Video Stimuli Program p4: ERROR: The number of files and durations do not match.")
             return
     
-    # Initialize Tkinter window
     try:
-        # Create new Tkinter window
-        global root, label
-        root, label = initialize_tkinter()
-        window_destroyed = False
+        # Show the warm persistent window
+        show_window()
+
+        # One VLC player for the whole run, with the first video parsed
+        # during the countdown
+        video_paths = [f"video_stimuli/{file}.mp4" for file in file_sequence]  # Assuming video files are in MP4 format
+        video_player = VideoPlayer(label.winfo_id())
+        video_player.preload(video_paths[0])
 
         timestamp = time.strftime('%Y%m%d_%H%M%S')
-        output_filename = f"data/video_stimuli_start_time_{timestamp}.json"
+        output_filename = f"{output_dir}/video_stimuli_start_time_{timestamp}.json"
         
+        # All onsets are scheduled as absolute offsets from a single run start,
+        # now or at a scheduled session start
+        scheduler.start(requested_at, start_at)
+        onset = 0.0
+
         # Initial delay countdown
         for i in range(initial_delay, 0, -1):
-            if stop_event.is_set():
+            if not scheduler.wait_until(onset, stop_event):
                 break  # Exit if stop event is set
-            stimuli_timestamps.append(datetime.now().timestamp())
-            stimuli_file.append(f"initial_delay_{i}")
             update_ui("update_label", str(i))
-            time.sleep(1)
+            log_onset(f"initial_delay_{i}", onset)
+            onset += 1
 
         # Display each video with black screen intervals
-        for file, duration in zip(file_sequence, file_duration):
-            if stop_event.is_set():
+        for i, (video_path, duration) in enumerate(zip(video_paths, file_duration)):
+            if not scheduler.wait_until(onset, stop_event):
                 break  # Exit if stop event is set
 
             try:
-                video_path = f"video_stimuli/{file}.mp4"  # Assuming video files are in MP4 format
-                
+                next_path = video_paths[i + 1] if i + 1 < len(video_paths) else None
+
                 # Play the video
-                if not play_video(video_path, stimuli_timestamps, stimuli_file):
+                record = play_video(video_path, onset, next_path)
+                if record is None:
                     continue
                 
-                # Show black screen for the specified duration
+                # Show black screen for the specified duration. The video length
+                # is only known once it ends, so the black screen is scheduled
+                # from the end reported by VLC and the next video from the black screen.
                 if not stop_event.is_set():
-                    stimuli_timestamps.append(datetime.now().timestamp())
-                    stimuli_file.append("black_screen")
                     update_ui("black_screen")
-                    time.sleep(duration)
+                    onset = record['end'] - scheduler.run_start
+                    log_onset("black_screen", onset, record['end'])
+                    onset += duration
                     
             except Exception as e:
                 print(f"Video Stimuli Program p4: ERROR displaying video: {e}")
+
+        # Keep the last black screen for its full duration
+        scheduler.wait_until(onset, stop_event)
         
         # Close the window after displaying all videos
-        update_ui("close_window", [stimuli_timestamps, stimuli_file, output_filename])
+        log_run_end()
+        update_ui("close_window", [stimuli_timestamps, stimuli_file, output_filename, stimuli_lsl_timestamps])
+
+        transitions = video_player.transition_report()
+        report = scheduler.save_report(timing_report_path(output_filename), {'video_transitions': transitions})
+        if report['trials']:
+            print(f"Video Stimuli Program p4: Onset error mean {report['mean_abs_error_ms']:.3f} ms, "
+                  f"max {report['max_abs_error_ms']:.3f} ms")
+        if transitions['mean_start_latency_ms'] is not None:
+            print(f"Video Stimuli Program p4: Video start latency mean {transitions['mean_start_latency_ms']:.1f} ms, "
+                  f"max {transitions['max_start_latency_ms']:.1f} ms")
     except Exception as e:
         print(f"Video Stimuli Program p4: ERROR in start_stimuli: {e}")
+        hide_window()
     finally:
-        cleanup()
+        if video_player is not None:
+            video_player.release()
+            video_player = None
+
+def display_loop(conn):
+    """
+    Own the persistent Tkinter window and run display tasks.
+
+    Creates the window once, then executes tasks from ``tkinter_queue``:
+    ``("start_video_stimuli", (requested_at, start_at))`` runs a presentation and
+    ``("exit", None)`` destroys the window. The hidden window is kept
+    responsive between tasks.
+
+    Reports ``ready`` to the parent once the window is warmed up, or
+    ``failed`` if it cannot be created.
+
+    Args:
+        conn (multiprocessing.Connection): Pipe used to report readiness.
+    """
+    global window_destroyed
+
+    try:
+        initialize_tkinter()
+    except Exception as e:
+        print(f"Video Stimuli Program p4: ERROR creating stimulus window: {e}")
+        send_status(conn, STATUS_FAILED, display=False, error=str(e))
+        return
+    send_status(conn, STATUS_READY, display=True)
 
-def handle_command(command, conn):
+    try:
+        while True:
+            try:
+                task, data = tkinter_queue.get(timeout=IDLE_UPDATE_INTERVAL)
+            except queue.Empty:
+                root.update()
+                continue
+
+            if task == "exit":
+                break
+            elif task == "start_video_stimuli":
+                start_stimuli(*data)
+    except Exception as e:
+        print(f"Video Stimuli Program p4: Display thread error: {e}")
+    finally:
+        window_destroyed = True
+        root.destroy()
+        print("Video Stimuli Program p4: Tkinter window closed.")
+
+def handle_command(command, data=None):
     """
     Handle commands received from parent program via Pipe.
 
     Supported commands:
         - "load_video_stimuli" : Load configuration.
-        - "save_video_config"  : Save configuration received via Pipe.
-        - "start_video_stimuli": Start presenting stimuli.
+        - "save_video_config"  : Save the JSON configuration passed as ``data``.
+        - "start_video_stimuli": Start presenting stimuli, at the scheduled
+          ``start_at`` LSL time if ``data`` has one.
         - "stop_stimuli"       : Stop presentation and cleanup.
+        - "sync_status"        : Return the first onset of the current run.
+        - "set_session_dir"    : Save stimuli logs to the directory passed as ``data``.
+
+    Returns:
+        str or dict: Response sent back to the parent program.
     """
+    global output_dir
+
     command = command.strip().lower()
     print(f"Video Stimuli Program p4: Received command: {command}")
 
     if command == "load_video_stimuli":
         load_stimuli()
-        conn.send("Stimuli configuration loaded")
+        return "Stimuli configuration loaded"
     elif command == "save_video_config":
-        json_data = conn.recv()
-        save_config(json_data)
-        conn.send("Configuration saved")
+        save_config(data)
+        return "Configuration saved"
     elif command == "start_video_stimuli":
-        # Make sure any previous resources are cleaned up
+        # Make sure any previous run is stopped
         cleanup()
-        # Start new stimuli session in a new thread
-        start_thread = threading.Thread(target=start_stimuli)
-        start_thread.daemon = True
-        start_thread.start()
-        conn.send("Stimuli started")
+        # Run the new stimuli session in the display thread
+        tkinter_queue.put(("start_video_stimuli", (clock.now(), (data or {}).get('start_at'))))
+        return "Stimuli started"
     elif command == "stop_stimuli":
         stop_event.set()  # Signal to stop
         cleanup()
-        conn.send("Stimuli stopped")
+        return "Stimuli stopped"
+    elif command == "sync_status":
+        # First onset of the current run, for the session start report
+        return {'first_onset': stimuli_lsl_timestamps[0] if stimuli_lsl_timestamps else None}
+    elif command == "set_session_dir":
+        output_dir = data or "data"
+        return f"Saving stimuli logs to {output_dir}"
     else:
-        conn.send(f"Unknown command: {command}")
+        return f"Unknown command: {command}"
 
 def command_listener(conn):
     """
@@ -380,16 +519,23 @@ def command_listener(conn):
     try:
         print("Video Stimuli Program p4: Command listener started. Waiting for commands...")
         while True:
-            if conn.poll():
-                command = conn.recv()
-                if command == "exit":
-                    print("Video Stimuli Program p4: Received exit command. Shutting down...")
-                    stop_event.set()
-                    cleanup()
-                    break
-                if command:
-                    handle_command(command, conn)
-            time.sleep(0.1)  # Small delay to prevent high CPU usage
+            message = conn.recv()  # Blocks until the parent sends a command
+            request_id, command, data = unpack_request(message)
+            if command == "exit":
+                print("Video Stimuli Program p4: Received exit command. Shutting down...")
+                stop_event.set()
+                cleanup()
+                tkinter_queue.put(("exit", None))
+                if request_id is not None:
+                    send_reply(conn, request_id, "Exiting")
+                break
+            if command:
+                received_at = time.perf_counter()
+                response = handle_command(command, data)
+                send_reply(conn, request_id, response)
+                print(f"Video Stimuli Program p4: Handled command in {(time.perf_counter() - received_at) * 1000:.2f} ms")
+    except EOFError:
+        print("Video Stimuli Program p4: Parent connection closed.")
     except Exception as e:
         print(f"Video Stimuli Program p4: Command listener error: {e}")
     finally:
@@ -403,21 +549,36 @@ def main(conn):
     Starts the command listener thread and waits for external commands.
     Exits gracefully on KeyboardInterrupt or "exit" command.
     """
+    global marker_outlet, tkinter_thread
+
     print("Video Stimuli Program p4: Program starting...")
+    send_status(conn, STATUS_STARTING, stage="imports_done")
+    marker_outlet = MarkerOutlet("NeuroCue-VideoStimuli", "neurocue-p4")
     try:
+        # Create the persistent stimulus window in the display thread
+        tkinter_thread = threading.Thread(target=display_loop, args=(conn,))
+        tkinter_thread.daemon = True
+        tkinter_thread.start()
+
         # Start command listener in a separate thread
         listener_thread = threading.Thread(target=command_listener, args=(conn,))
         listener_thread.daemon = True
         listener_thread.start()
 
         print("Video Stimuli Program p4: Program ready. Run another program to send commands.")
-        while True:
-            time.sleep(1)
+        # Wait for the listener to finish (exit command); the timeout keeps
+        # the main thread responsive to KeyboardInterrupt on Windows
+        while listener_thread.is_alive():
+            listener_thread.join(timeout=1)
     except KeyboardInterrupt:
         print("Video Stimuli Program p4: Program interrupted by user")
     finally:
         stop_event.set()
         cleanup()
+        tkinter_queue.put(("exit", None))
+        # Let the display thread destroy the window before the process ends
+        if tkinter_thread is not None:
+            tkinter_thread.join(timeout=EXIT_TIMEOUT)
         print("Video Stimuli Program p4: Program exited")
 
 if __name__ == "__main__":
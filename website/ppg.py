@@ -0,0 +1,184 @@
+"""
+Real-Time Heart Rate and HRV from the PPG Stream
+
+Streaming processor for the Muse PPG, run by the
+:class:`~website.realtime.ProcessingWorker` next to the EEG processing:
+
+1. The selected PPG channel is band-passed to 0.5-4 Hz (30-240 bpm) with
+   the stateful filters of :mod:`website.realtime`.
+2. Beats are the local maxima of the filtered signal above an adaptive
+   threshold and at least a refractory period apart. The last samples, the
+   last beat and the threshold are carried between chunks, so a beat at a
+   chunk boundary is found exactly once. Peaks and troughs occur once per
+   beat, so the polarity of the sensor does not matter. The threshold
+   decays while no beat is found, so it recovers from a motion artifact
+   that raised it.
+3. Inter-beat intervals (IBIs) outside the physiological range or far from
+   the median of the recent intervals are rejected as artifacts. The
+   median is taken over all recent in-range intervals, accepted or not, so
+   a sustained change of the heart rate is followed within a few beats.
+4. Instantaneous heart rate (last IBI), heart rate (median of the recent
+   IBIs) and RMSSD and SDNN over a rolling window are updated after every
+   beat.
+
+The metrics are published in a small shared-memory array (see
+:data:`METRIC_NAMES`) and served by the control application's
+``/heart_rate`` endpoint.
+"""
+
+import collections
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from website.command_bus import LatencyHistogram
+from website.realtime import HighPassFilter, LowPassFilter
+
+PPG_CHANNEL = 'PPG2'  # infrared channel of the Muse
+PPG_BAND = (0.5, 4.0)  # Hz
+REFRACTORY = 0.33  # seconds, i.e. at most 180 bpm
+IBI_RANGE = (0.33, 1.5)  # seconds, 40-180 bpm
+IBI_MAX_DEVIATION = 0.3  # largest relative deviation from the median of the recent IBIs
+HR_BEATS = 5  # IBIs in the median heart rate
+HRV_WINDOW = 60.0  # seconds of IBIs for RMSSD and SDNN
+THRESHOLD_FACTOR = 0.5  # fraction of the running peak amplitude a peak must exceed
+PEAK_DECAY = 0.9  # weight of the previous amplitude in the running peak amplitude
+PEAK_HALF_LIFE = 1.0  # seconds, half-life of the peak amplitude once no beat is found within IBI_RANGE
+
+# Values of the shared metrics array, in order
+METRIC_NAMES = ('last_beat', 'heart_rate', 'instant_heart_rate', 'rmssd_ms', 'sdnn_ms', 'beats', 'rejected')
+
+
+class HeartRateMonitor:
+    """
+    Incremental beat detection and heart-rate/HRV metrics for one PPG channel.
+
+    Args:
+        sfreq (float): PPG sample rate.
+        channels (list): PPG channel names.
+        channel (str): Channel used for the beats.
+        shared (bool): Publish the metrics in shared memory.
+
+    Attributes:
+        metrics (dict): Current value of every name in :data:`METRIC_NAMES`;
+            NaN until known.
+        ibis (collections.deque): (beat time, IBI in seconds) of the
+            accepted intervals within ``HRV_WINDOW``.
+        shm (multiprocessing.shared_memory.SharedMemory or None): Block with
+            the metrics as float64 in :data:`METRIC_NAMES` order.
+        cost (LatencyHistogram): Processing time per chunk.
+    """
+    def __init__(self, sfreq, channels, channel=PPG_CHANNEL, shared=True):
+        self.sfreq = sfreq
+        self.index = list(channels).index(channel)
+        self.filters = [HighPassFilter(PPG_BAND[0]), LowPassFilter(PPG_BAND[1])]
+        for stage in self.filters:
+            stage.configure(sfreq, [channel])
+        self.metrics = {name: np.nan for name in METRIC_NAMES}
+        self.metrics['beats'] = 0
+        self.metrics['rejected'] = 0
+        self.ibis = collections.deque()
+        self.cost = LatencyHistogram()
+        self.shm = None
+        self.shared = None
+        if shared:
+            self.shm = shared_memory.SharedMemory(create=True, size=len(METRIC_NAMES) * 8)
+            self.shared = np.ndarray(len(METRIC_NAMES), dtype=np.float64, buffer=self.shm.buf)
+            self.shared[:] = [self.metrics[name] for name in METRIC_NAMES]
+        self._lock = threading.Lock()
+        self._tail_times = np.zeros(0)
+        self._tail_values = np.zeros(0)
+        self._last_beat = None
+        self._amplitude = None
+        self._intervals = collections.deque(maxlen=HR_BEATS)
+
+    def process(self, timestamps, values):
+        """Filter a chunk of PPG samples and update the metrics for every beat in it."""
+        start = time.perf_counter()
+        signal = values[:, self.index:self.index + 1]
+        for stage in self.filters:
+            timestamps, signal = stage.process(timestamps, signal)
+        # Prepend the last two samples so maxima at the chunk boundary are seen
+        times = np.concatenate([self._tail_times, timestamps])
+        samples = np.concatenate([self._tail_values, signal[:, 0]])
+        self._tail_times, self._tail_values = times[-2:], samples[-2:]
+        if len(samples) >= 3:
+            middle = samples[1:-1]
+            peaks = np.nonzero((middle > samples[:-2]) & (middle >= samples[2:]) & (middle > 0))[0] + 1
+            for peak in peaks:
+                self._candidate(times[peak], samples[peak])
+        self.cost.add((time.perf_counter() - start) * 1000.0)
+
+    def _candidate(self, time_, amplitude):
+        """Accept a local maximum as a beat if it passes the threshold and refractory period."""
+        time_, amplitude = float(time_), float(amplitude)
+        reference = self._amplitude
+        if reference is not None and self._last_beat is not None:
+            # No beat for longer than the longest IBI: the amplitude is stale,
+            # e.g. raised by an artifact, so let the threshold come down
+            overdue = time_ - self._last_beat - IBI_RANGE[1]
+            if overdue > 0:
+                reference *= 0.5 ** (overdue / PEAK_HALF_LIFE)
+        if reference is not None and amplitude < THRESHOLD_FACTOR * reference:
+            return
+        if self._last_beat is not None and time_ - self._last_beat < REFRACTORY:
+            # A second maximum of the same beat, e.g. after the dicrotic notch
+            return
+        self._amplitude = amplitude if reference is None else \
+            PEAK_DECAY * reference + (1 - PEAK_DECAY) * amplitude
+        previous, self._last_beat = self._last_beat, time_
+        with self._lock:
+            self.metrics['beats'] += 1
+            self.metrics['last_beat'] = time_
+            if previous is not None:
+                self._add_ibi(time_, time_ - previous)
+        self._publish()
+
+    def _add_ibi(self, time_, ibi):
+        if not IBI_RANGE[0] <= ibi <= IBI_RANGE[1]:
+            self.metrics['rejected'] += 1
+            return
+        # Judged against the recent intervals whether accepted or not, so
+        # the reference follows a sustained change of the heart rate
+        recent = list(self._intervals)
+        self._intervals.append(ibi)
+        if len(recent) >= 3 and abs(ibi - np.median(recent)) > IBI_MAX_DEVIATION * np.median(recent):
+            self.metrics['rejected'] += 1
+            return
+        self.ibis.append((time_, ibi))
+        while self.ibis and self.ibis[0][0] < time_ - HRV_WINDOW:
+            self.ibis.popleft()
+        intervals = np.array([interval for _, interval in self.ibis])
+        self.metrics['instant_heart_rate'] = 60.0 / ibi
+        self.metrics['heart_rate'] = 60.0 / float(np.median(intervals[-HR_BEATS:]))
+        if len(intervals) >= 2:
+            self.metrics['rmssd_ms'] = float(np.sqrt(np.mean(np.diff(intervals) ** 2))) * 1000.0
+            self.metrics['sdnn_ms'] = float(np.std(intervals, ddof=1)) * 1000.0
+
+    def _publish(self):
+        if self.shared is not None:
+            self.shared[:] = [self.metrics[name] for name in METRIC_NAMES]
+
+    def status(self):
+        """
+        Return the current metrics, the accepted IBIs of the HRV window and
+        the processing cost per chunk; NaN metrics are returned as None.
+        """
+        with self._lock:
+            metrics = {name: None if isinstance(value, float) and np.isnan(value) else value
+                       for name, value in self.metrics.items()}
+            ibis = [{'time': t, 'ibi_ms': ibi * 1000.0} for t, ibi in self.ibis]
+        return {
+            'metrics': metrics,
+            'ibis': ibis,
+            'shared_memory': self.shm.name if self.shm is not None else None,
+            'cost': self.cost.to_dict()
+        }
+
+    def close(self):
+        """Free the shared metrics block."""
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
@@ -0,0 +1,304 @@
+"""
+Min/Max Pyramid for Browsing Long Recordings
+
+Drawing a zoomed-out view of a recording only needs the minimum and maximum
+of each channel per screen pixel. Instead of reading every sample, each
+recording carries a pyramid of min/max summaries per stream: level 0 holds
+the min/max of blocks of ``LEVEL_FACTOR`` samples, and every further level
+combines ``LEVEL_FACTOR`` blocks of the previous one. The levels are stored
+as ``.npy`` files in a ``recorded_data_*.pyramid/`` directory next to the
+recording and are read as memory maps.
+
+:class:`PyramidBuilder` builds the levels incrementally from chunks of
+samples, so the pyramid can be built while recording or, as the control
+application does, in a pass over the saved recording. :func:`read_range`
+answers a request for a time range at a pixel width from the coarsest level
+that still has at least one block per pixel, and from the samples
+themselves when the range is short enough to draw every sample.
+
+A pyramid is built into a temporary directory that replaces the old one
+when it is complete, and builds and reads of the same recording are
+serialized by a per-recording lock, so a read never sees a half-written
+level and no file is overwritten while it is memory-mapped (which Windows
+does not allow). :func:`is_building` tells whether a build is running.
+"""
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from website.compression import CompressedRecording
+from website.recordings import STREAM_CHANNELS, iter_stream_chunks, load_recording
+
+LEVEL_FACTOR = 4  # samples (or blocks) combined per block of the next level
+MAX_LEVELS = 16
+PYRAMID_VERSION = 1  # bump when the layout changes to rebuild all pyramids
+PYRAMID_META_NAME = "meta.json"
+CHUNK_SAMPLES = 65536  # samples read from the recording at a time
+
+_locks = {}  # pyramid directory -> lock serializing its builds and reads
+_locks_lock = threading.Lock()
+_building = set()  # pyramid directories being built
+
+
+def pyramid_dir(path):
+    """Return the pyramid directory of a recording."""
+    return os.path.splitext(path)[0] + ".pyramid"
+
+
+def _lock(path):
+    """Return the lock serializing the builds and reads of a recording's pyramid."""
+    with _locks_lock:
+        return _locks.setdefault(pyramid_dir(path), threading.RLock())
+
+
+def is_building(path):
+    """Return True while the pyramid of a recording is being built."""
+    return pyramid_dir(path) in _building
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return {'version': PYRAMID_VERSION, 'factor': LEVEL_FACTOR,
+            'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+class PyramidBuilder:
+    """
+    Builds the min/max levels of one stream from consecutive chunks of samples.
+
+    Each level keeps the samples (or blocks) that do not fill a block yet
+    and carries them over to the next chunk. NaN samples are ignored.
+
+    Attributes:
+        factor (int): Samples (or blocks) per block.
+        levels (list): Per level, lists of ``timestamps`` (first sample of
+            each block), ``min`` and ``max`` arrays built so far.
+    """
+    def __init__(self, factor=LEVEL_FACTOR, max_levels=MAX_LEVELS):
+        self.factor = factor
+        self.max_levels = max_levels
+        self.levels = []
+        self._carry = []
+
+    def append(self, timestamps, values):
+        """
+        Add a chunk of samples.
+
+        Args:
+            timestamps (numpy.ndarray): (n,) timestamps.
+            values (numpy.ndarray): (n, channels) samples.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self._push(0, np.asarray(timestamps, dtype=np.float64), values, values)
+
+    def _level(self, k):
+        while len(self.levels) <= k:
+            self.levels.append({'timestamps': [], 'min': [], 'max': []})
+            self._carry.append(None)
+        return self.levels[k]
+
+    def _push(self, k, timestamps, low, high):
+        """Add samples or blocks to the input of level ``k``."""
+        if k >= self.max_levels or not len(timestamps):
+            return
+        level = self._level(k)
+        if self._carry[k] is not None:
+            carry_timestamps, carry_low, carry_high = self._carry[k]
+            timestamps = np.concatenate([carry_timestamps, timestamps])
+            low = np.concatenate([carry_low, low])
+            high = np.concatenate([carry_high, high])
+        full = len(timestamps) // self.factor * self.factor
+        self._carry[k] = (timestamps[full:], low[full:], high[full:]) if full < len(timestamps) else None
+        if not full:
+            return
+        blocks = (full // self.factor, self.factor, low.shape[1])
+        block_timestamps = timestamps[:full:self.factor]
+        with np.errstate(invalid='ignore'):
+            block_low = np.fmin.reduce(low[:full].reshape(blocks), axis=1)
+            block_high = np.fmax.reduce(high[:full].reshape(blocks), axis=1)
+        level['timestamps'].append(block_timestamps)
+        level['min'].append(block_low)
+        level['max'].append(block_high)
+        self._push(k + 1, block_timestamps, block_low, block_high)
+
+    def finish(self):
+        """
+        Close the incomplete blocks at the end of the stream.
+
+        Returns:
+            list: Per level, a dict of ``timestamps``, ``min`` and ``max``
+            arrays. Levels stop at the first one with a single block.
+        """
+        k = 0
+        while k < len(self.levels):
+            if self._carry[k] is not None:
+                timestamps, low, high = self._carry[k]
+                self._carry[k] = None
+                with np.errstate(invalid='ignore'):
+                    block_low = np.fmin.reduce(low, axis=0, keepdims=True)
+                    block_high = np.fmax.reduce(high, axis=0, keepdims=True)
+                level = self.levels[k]
+                level['timestamps'].append(timestamps[:1])
+                level['min'].append(block_low)
+                level['max'].append(block_high)
+                # The incomplete block also enters the next level, if that level is needed
+                if sum(len(t) for t in level['timestamps']) > 1:
+                    self._push(k + 1, timestamps[:1], block_low, block_high)
+            k += 1
+
+        levels = []
+        for level in self.levels:
+            if not level['timestamps']:
+                break
+            levels.append({key: np.concatenate(arrays) for key, arrays in level.items()})
+            if len(levels[-1]['timestamps']) <= 1:
+                break
+        return levels
+
+
+def build_pyramid(path, chunk_samples=CHUNK_SAMPLES):
+    """
+    Build and save the pyramids of all streams of a recording.
+
+    Waits for a build or read of the same recording in progress.
+
+    Args:
+        path (str): Path of a ``recorded_data_*.json`` or ``.ncz`` file.
+        chunk_samples (int): Samples read at a time.
+
+    Returns:
+        dict: The pyramid metadata written to ``meta.json``.
+    """
+    directory = pyramid_dir(path)
+    with _lock(path):
+        _building.add(directory)
+        try:
+            # Build next to the pyramid and swap it in when complete
+            building = directory + ".building"
+            shutil.rmtree(building, ignore_errors=True)
+            os.makedirs(building)
+            meta = dict(_source_signature(path), streams={})
+            for stream in STREAM_CHANNELS:
+                builder = PyramidBuilder()
+                samples = 0
+                for timestamps, values in iter_stream_chunks(path, stream, chunk_samples):
+                    builder.append(timestamps, values)
+                    samples += len(timestamps)
+                levels = builder.finish()
+                for k, level in enumerate(levels):
+                    for key, array in level.items():
+                        np.save(os.path.join(building, f"{stream}_L{k}_{key}.npy"), array)
+                meta['streams'][stream] = {'samples': samples,
+                                           'levels': [len(level['timestamps']) for level in levels]}
+            with open(os.path.join(building, PYRAMID_META_NAME), 'w') as file:
+                json.dump(meta, file)
+
+            old = directory + ".old"
+            shutil.rmtree(old, ignore_errors=True)
+            if os.path.exists(directory):
+                os.replace(directory, old)
+            os.replace(building, directory)
+            shutil.rmtree(old, ignore_errors=True)
+        finally:
+            _building.discard(directory)
+    return meta
+
+
+def load_pyramid(path):
+    """
+    Load the pyramid metadata of a recording, building the pyramid if it
+    is missing or older than the recording.
+
+    Args:
+        path (str): Path of a ``recorded_data_*.json`` or ``.ncz`` file.
+
+    Returns:
+        dict: Source signature and, per stream, ``samples`` and the number
+        of blocks of each level.
+    """
+    meta_path = os.path.join(pyramid_dir(path), PYRAMID_META_NAME)
+    with _lock(path):
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as file:
+                meta = json.load(file)
+            if all(meta.get(key) == value for key, value in _source_signature(path).items()):
+                return meta
+        return build_pyramid(path)
+
+
+def _bin_edges(start, stop, width):
+    """Split ``[start, stop)`` into at most ``width`` bins of whole elements."""
+    return np.unique(np.linspace(start, stop, width + 1).astype(np.int64))
+
+
+def _read_samples(path, stream, start, end):
+    if path.endswith(".ncz"):
+        return CompressedRecording(path).read(stream, start, end)
+    data = load_recording(path)[stream]
+    timestamps = data['timestamps']
+    first = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+    last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='right'))
+    return np.asarray(timestamps[first:last]), np.asarray(data['values'][first:last])
+
+
+def read_range(path, stream, start=None, end=None, width=1000):
+    """
+    Read a time range of a stream summarized for ``width`` pixels.
+
+    Args:
+        path (str): Path of a ``recorded_data_*.json`` or ``.ncz`` file.
+        stream (str): ``eeg``, ``acc``, ``gyro`` or ``ppg``.
+        start (float, optional): First timestamp, defaults to the start.
+        end (float, optional): Last timestamp, defaults to the end.
+        width (int): Number of pixels (bins) requested.
+
+    Returns:
+        dict: ``level`` (-1 for samples), ``samples_per_bin`` and per bin
+        ``timestamps``, ``min`` and ``max`` arrays (bins, channels). For
+        the samples, ``min`` and ``max`` are both the sample values.
+        Waits for a build of the pyramid in progress.
+    """
+    with _lock(path):
+        width = max(int(width), 1)
+        meta = load_pyramid(path)['streams'][stream]
+        directory = pyramid_dir(path)
+
+        # Coarsest level with at least one block per pixel in the range
+        level = -1
+        first = last = 0
+        for k in reversed(range(len(meta['levels']))):
+            timestamps = np.load(os.path.join(directory, f"{stream}_L{k}_timestamps.npy"), mmap_mode='r')
+            # Include the block that contains ``start``
+            first = 0 if start is None else max(int(np.searchsorted(timestamps, start, side='right')) - 1, 0)
+            last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='right'))
+            if last - first >= width:
+                level = k
+                break
+
+        if level < 0:
+            timestamps, values = _read_samples(path, stream, start, end)
+            if len(timestamps) <= 2 * width:
+                return {'level': -1, 'samples_per_bin': 1, 'timestamps': timestamps, 'min': values, 'max': values}
+            edges = _bin_edges(0, len(timestamps), width)
+            low, high, samples_per_bin = values, values, 1
+        else:
+            def column(key):
+                array = np.load(os.path.join(directory, f"{stream}_L{level}_{key}.npy"), mmap_mode='r')
+                return np.asarray(array[first:last])
+            timestamps, low, high = column('timestamps'), column('min'), column('max')
+            edges = _bin_edges(0, len(timestamps), width)
+            samples_per_bin = LEVEL_FACTOR ** (level + 1)
+
+        bins = edges[:-1]
+        with np.errstate(invalid='ignore'):
+            return {
+                'level': level,
+                'samples_per_bin': samples_per_bin * int(np.ceil(len(timestamps) / max(len(bins), 1))),
+                'timestamps': timestamps[bins],
+                'min': np.fmin.reduceat(low, bins, axis=0),
+                'max': np.fmax.reduceat(high, bins, axis=0)
+            }
@@ -0,0 +1,332 @@
+"""
+Signal-Quality and Timing Report
+
+Checks everything recorded in a session (see :mod:`website.session`) and
+writes a compact ``quality.json`` into the session directory:
+
+- Muse streams of every recording: effective sample rate against the
+  nominal one, gaps, duplicated and out-of-order timestamps, and per
+  channel the fraction of flat-line, saturated and missing (NaN) samples
+- Camera videos: frame-interval jitter and dropped frames, from the frame
+  timestamps saved by the camera program (p1)
+- Stimuli: onset errors of the timing reports, stimulus onsets without an
+  LSL marker in the recordings, and the distance of every event to its
+  EEG sample in the alignment index
+
+All checks are vectorized numpy operations on the columnar recordings
+(see :mod:`website.recordings`), so a multi-hour session takes seconds and
+the control application runs the report after each recording.
+
+Usage:
+    python -m website.quality data/sessions/<session_id>
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from website.recordings import (EEG_RANGE, STREAM_CHANNELS, STREAM_RATES, load_recording, load_camera_timestamps,
+                                load_stimulus_log, nearest_indices)
+from website.session import Session
+
+QUALITY_REPORT_NAME = "quality.json"
+
+GAP_FACTOR = 2.0  # intervals longer than this many sample periods are gaps
+FLAT_SECONDS = 1.0  # shortest run of identical values reported as flat line
+MAX_LISTED = 20  # longest gaps / largest camera stalls listed individually
+
+# Output range of the Muse streams; samples at or beyond a limit are saturated
+SATURATION_LIMITS = {'eeg': EEG_RANGE}
+
+# Largest distance (seconds) between a logged onset and its LSL marker
+MARKER_TOLERANCE = 0.005
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+def _run_fraction(mask, min_length):
+    """
+    Return the fraction of samples that lie in runs of True of at least ``min_length``.
+
+    Args:
+        mask (numpy.ndarray): (n, channels) boolean array.
+        min_length (int): Shortest run counted.
+
+    Returns:
+        numpy.ndarray: Fraction per channel.
+    """
+    n = mask.shape[0]
+    if n == 0:
+        return np.zeros(mask.shape[1])
+    padded = np.zeros((n + 2, mask.shape[1]), dtype=np.int8)
+    padded[1:-1] = mask
+    edges = np.diff(padded, axis=0)
+    # Run starts and ends come out of np.nonzero in the same channel order
+    starts = np.nonzero(edges.T == 1)
+    ends = np.nonzero(edges.T == -1)
+    lengths = ends[1] - starts[1]
+    long_runs = lengths >= min_length
+    counts = np.bincount(starts[0][long_runs], weights=lengths[long_runs], minlength=mask.shape[1])
+    return counts / n
+
+
+def stream_quality(timestamps, values, nominal_rate, saturation=None):
+    """
+    Check the timing and signal of one stream.
+
+    Args:
+        timestamps (numpy.ndarray): (n,) timestamps in seconds.
+        values (numpy.ndarray): (n, channels) samples.
+        nominal_rate (float): Nominal sample rate in Hz.
+        saturation (tuple, optional): (low, high) output range of the device.
+
+    Returns:
+        dict: ``samples``, ``duration_s``, ``effective_rate``,
+        ``rate_error_percent``, ``duplicates``, ``out_of_order``, ``gaps``
+        (count, total, longest and the longest ones) and ``channels`` (flat,
+        saturated and NaN fraction per channel).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(timestamps)
+    report = {'samples': n, 'duration_s': 0.0, 'effective_rate': None, 'rate_error_percent': None,
+              'duplicates': 0, 'out_of_order': 0,
+              'gaps': {'count': 0, 'total_s': 0.0, 'longest_s': 0.0, 'longest': []}, 'channels': []}
+    if n < 2:
+        return report
+
+    intervals = np.diff(timestamps)
+    duration = float(np.nanmax(timestamps) - np.nanmin(timestamps))
+    report['duration_s'] = duration
+    if duration > 0:
+        report['effective_rate'] = (n - 1) / duration
+        report['rate_error_percent'] = (report['effective_rate'] / nominal_rate - 1.0) * 100.0
+    report['duplicates'] = int(np.count_nonzero(intervals == 0))
+    report['out_of_order'] = int(np.count_nonzero(intervals < 0))
+
+    gap_indices = np.nonzero(intervals > GAP_FACTOR / nominal_rate)[0]
+    if len(gap_indices):
+        # Time missing beyond the one expected sample period
+        missing = intervals[gap_indices] - 1.0 / nominal_rate
+        longest = gap_indices[np.argsort(missing)[::-1][:MAX_LISTED]]
+        report['gaps'] = {
+            'count': len(gap_indices),
+            'total_s': float(missing.sum()),
+            'longest_s': float(missing.max()),
+            'longest': [{'start': float(timestamps[i]), 'duration_s': float(intervals[i])} for i in sorted(longest)]
+        }
+
+    flat = _run_fraction(np.diff(values, axis=0) == 0, int(FLAT_SECONDS * nominal_rate))
+    nan = np.isnan(values).mean(axis=0)
+    if saturation is not None:
+        low, high = saturation
+        with np.errstate(invalid='ignore'):
+            saturated = ((values <= low) | (values >= high)).mean(axis=0)
+    else:
+        saturated = np.zeros(values.shape[1])
+    report['channels'] = [{'flat_fraction': float(flat[ch]), 'saturated_fraction': float(saturated[ch]),
+                           'nan_fraction': float(nan[ch])} for ch in range(values.shape[1])]
+    return report
+
+
+def camera_quality(frame_timestamps):
+    """
+    Check the frame timing of one camera video.
+
+    The camera program does not store its frame rate, so the median frame
+    interval serves as the nominal one. An interval of ``k`` nominal
+    intervals (rounded, ``k >= 2``) counts as ``k - 1`` dropped frames.
+
+    Args:
+        frame_timestamps (numpy.ndarray): Timestamp per frame number, NaN
+            for frames without a timestamp.
+
+    Returns:
+        dict: ``frames``, ``missing_timestamps``, ``fps``, interval
+        statistics in ms, ``dropped_frames`` and the ``longest_stalls``.
+    """
+    frame_timestamps = np.asarray(frame_timestamps, dtype=np.float64)
+    valid = frame_timestamps[~np.isnan(frame_timestamps)]
+    report = {'frames': len(frame_timestamps), 'missing_timestamps': int(len(frame_timestamps) - len(valid)),
+              'fps': None, 'interval_ms': None, 'dropped_frames': 0, 'longest_stalls': []}
+    if len(valid) < 2:
+        return report
+
+    intervals = np.diff(valid)
+    period = float(np.median(intervals))
+    if period <= 0:
+        return report
+    steps = np.rint(intervals / period)
+    stalls = np.nonzero(steps >= 2)[0]
+    longest = stalls[np.argsort(intervals[stalls])[::-1][:MAX_LISTED]]
+    report.update({
+        'fps': 1.0 / period,
+        'interval_ms': {
+            'median': period * 1000.0,
+            'std': float(intervals.std()) * 1000.0,
+            'p95': _percentile(intervals, 95) * 1000.0,
+            'max': float(intervals.max()) * 1000.0
+        },
+        # Jitter of the frames that were not dropped
+        'jitter_ms': float(np.abs(intervals[steps == 1] - period).mean()) * 1000.0 if np.any(steps == 1) else None,
+        'dropped_frames': int((steps[stalls] - 1).sum()),
+        'longest_stalls': [{'start': float(valid[i]), 'duration_ms': float(intervals[i]) * 1000.0}
+                           for i in sorted(longest)]
+    })
+    return report
+
+
+def timing_report_quality(path):
+    """Summarize the onset errors of a timing report written by :mod:`website.scheduler`."""
+    with open(path, 'r') as file:
+        report = json.load(file)
+    errors = np.array([trial['error_ms'] for trial in report.get('trial_timing', [])], dtype=np.float64)
+    summary = {'trials': len(errors), 'mean_abs_error_ms': None, 'p95_abs_error_ms': None,
+               'max_abs_error_ms': None, 'drift_ms_per_min': report.get('drift_ms_per_min'),
+               'late_over_1ms': 0}
+    if len(errors):
+        summary.update({
+            'mean_abs_error_ms': float(np.abs(errors).mean()),
+            'p95_abs_error_ms': _percentile(np.abs(errors), 95),
+            'max_abs_error_ms': float(np.abs(errors).max()),
+            'late_over_1ms': int(np.count_nonzero(errors > 1.0))
+        })
+    return summary
+
+
+def marker_quality(log_lsl_timestamps, marker_timestamps):
+    """
+    Check that every logged stimulus onset has an LSL marker in the recordings.
+
+    Args:
+        log_lsl_timestamps (numpy.ndarray): LSL onset times of the stimulus logs.
+        marker_timestamps (numpy.ndarray): Onset marker times of the recordings.
+
+    Returns:
+        dict: ``onsets`` with an LSL time, ``missing_markers`` and the
+        ``offset_ms`` statistics of the matched ones.
+    """
+    onsets = log_lsl_timestamps[~np.isnan(log_lsl_timestamps)]
+    report = {'onsets': len(onsets), 'missing_markers': len(onsets), 'offset_ms': None}
+    if not len(onsets) or not len(marker_timestamps):
+        return report
+    markers = np.sort(marker_timestamps)
+    indices = nearest_indices(markers, onsets, MARKER_TOLERANCE)
+    matched = indices >= 0
+    offsets = np.abs(markers[indices[matched]] - onsets[matched]) * 1000.0
+    report['missing_markers'] = int(np.count_nonzero(~matched))
+    if len(offsets):
+        report['offset_ms'] = {'mean': float(offsets.mean()), 'max': float(offsets.max())}
+    return report
+
+
+def session_quality(session_path):
+    """
+    Compute the quality report of a session.
+
+    Args:
+        session_path (str): Session directory.
+
+    Returns:
+        dict: ``recordings`` (per stream reports), ``cameras``, ``stimuli``
+        and ``warnings`` summarizing the problems found.
+    """
+    start = time.perf_counter()
+    session = Session(session_path)
+    session.manifest['files'] = session.scan_files()
+    report = {'session': session.session_id, 'recordings': {}, 'cameras': {}, 'stimuli': {}, 'warnings': []}
+    warnings = report['warnings']
+
+    marker_times = []
+    for path in session.files_with_role('eeg_recording'):
+        name = os.path.basename(path)
+        recording = load_recording(path)
+        report['recordings'][name] = {}
+        for stream, channels in STREAM_CHANNELS.items():
+            data = recording[stream]
+            if not len(data['timestamps']):
+                continue
+            quality = stream_quality(data['timestamps'], data['values'], STREAM_RATES[stream],
+                                     SATURATION_LIMITS.get(stream))
+            report['recordings'][name][stream] = quality
+            if quality['rate_error_percent'] is not None and abs(quality['rate_error_percent']) > 1.0:
+                warnings.append(f"{name} {stream}: effective rate {quality['effective_rate']:.2f} Hz "
+                                f"(nominal {STREAM_RATES[stream]} Hz)")
+            if quality['gaps']['count']:
+                warnings.append(f"{name} {stream}: {quality['gaps']['count']} gaps, "
+                                f"{quality['gaps']['total_s']:.2f} s missing")
+            if quality['duplicates'] or quality['out_of_order']:
+                warnings.append(f"{name} {stream}: {quality['duplicates']} duplicated and "
+                                f"{quality['out_of_order']} out-of-order timestamps")
+            for channel, channel_quality in zip(channels, quality['channels']):
+                for check in ('flat_fraction', 'saturated_fraction', 'nan_fraction'):
+                    if channel_quality[check] > 0.01:
+                        warnings.append(f"{name} {stream} {channel}: {check.replace('_fraction', '')} "
+                                        f"{channel_quality[check] * 100:.1f}% of samples")
+        markers = recording['markers']
+        onset_markers = [i for i, value in enumerate(markers['values']) if value.partition(":")[0] == "onset"]
+        marker_times.append(markers['timestamps'][onset_markers])
+
+    for path in session.files_with_role('camera_timestamps'):
+        name = os.path.basename(path)
+        quality = camera_quality(load_camera_timestamps(path))
+        report['cameras'][name] = quality
+        if quality['dropped_frames']:
+            warnings.append(f"{name}: {quality['dropped_frames']} dropped frames")
+
+    log_lsl_times = []
+    for role in ('image_stimuli_log', 'video_stimuli_log'):
+        for path in session.files_with_role(role):
+            log_lsl_times.append(load_stimulus_log(path)['lsl_timestamps'])
+    timing = {os.path.basename(path): timing_report_quality(path) for path in session.files_with_role('timing_report')}
+    report['stimuli'] = {
+        'timing_reports': timing,
+        'markers': marker_quality(np.concatenate(log_lsl_times) if log_lsl_times else np.zeros(0),
+                                  np.concatenate(marker_times) if marker_times else np.zeros(0))
+    }
+    for name, quality in timing.items():
+        if quality['max_abs_error_ms'] is not None and quality['max_abs_error_ms'] > 1.0:
+            warnings.append(f"{name}: onset error up to {quality['max_abs_error_ms']:.1f} ms")
+    if marker_times and report['stimuli']['markers']['missing_markers']:
+        warnings.append(f"{report['stimuli']['markers']['missing_markers']} stimulus onsets without an LSL marker")
+
+    alignment = session.load_alignment()
+    if alignment is not None:
+        events = alignment['events']
+        unmatched = sum(1 for event in events if event['eeg_sample'] < 0)
+        report['stimuli']['alignment'] = {'events': len(events), 'eeg_unmatched': unmatched,
+                                          'camera_unmatched': sum(1 for event in events if event['camera_frame'] < 0)}
+        if unmatched:
+            warnings.append(f"{unmatched} of {len(events)} stimulus events outside the EEG recordings")
+
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def write_quality_report(session_path):
+    """
+    Compute the quality report of a session and save it as ``quality.json``.
+
+    Args:
+        session_path (str): Session directory.
+
+    Returns:
+        dict: The report that was written.
+    """
+    report = session_quality(session_path)
+    with open(os.path.join(session_path, QUALITY_REPORT_NAME), 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"Quality report of {report['session']} written in {report['seconds']:.2f} s "
+          f"({len(report['warnings'])} warnings)")
+    for warning in report['warnings']:
+        print(f"    {warning}")
+    return report
+
+
+if __name__ == "__main__":
+    write_quality_report(sys.argv[1])
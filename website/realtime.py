@@ -0,0 +1,530 @@
+"""
+Real-Time Processing of the Muse Streams
+
+Runs derived computations on the acquisition side of the control
+application instead of in the visualization process or offline:
+
+- :class:`Stage` subclasses process whole chunks of samples and keep their
+  state (filter delays, resampling phase) between chunks: notch filter,
+  high-pass and low-pass filters, re-referencing and resampling.
+- A :class:`Pipeline` runs its stages in order on the chunks of one stream,
+  publishes the result to a :class:`SharedRingBuffer` that other processes
+  can attach to by name, optionally records it, and measures the cost of
+  every stage per chunk.
+- The :class:`ProcessingWorker` thread receives the raw chunks from the
+  acquisition thread through a queue and hands them to every processor
+  registered for their stream, so processing never delays acquisition.
+
+Processors only need a ``process(timestamps, values)`` method, so other
+real-time consumers of the streams attach to the worker the same way.
+
+Example:
+    >>> worker = ProcessingWorker()
+    >>> pipeline = Pipeline('eeg_clean', 'eeg', build_stages([('notch', 50), ('high_pass', 1.0)]),
+    ...                     256, ['TP9', 'AF7', 'AF8', 'TP10'])
+    >>> worker.add('eeg', pipeline)
+    >>> worker.start()
+    >>> worker.submit('eeg', timestamps, chunk)  # from the acquisition thread
+"""
+
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import signal
+
+from website.command_bus import LatencyHistogram
+
+MARKER_STREAM = "markers"  # samples of this stream are marker strings, passed on as lists
+BUFFER_SECONDS = 10  # seconds kept in the shared ring buffers, as in the visualization
+QUEUE_SIZE = 1024  # chunks waiting for the worker before new ones are dropped
+
+
+class Stage:
+    """
+    Base class of the pipeline stages.
+
+    :meth:`configure` is called once with the rate and channels of the
+    stage's input and returns those of its output; :meth:`process` is then
+    called for every chunk in order.
+    """
+    name = "stage"
+
+    def configure(self, sfreq, channels):
+        """
+        Prepare the stage for an input stream.
+
+        Args:
+            sfreq (float): Sample rate of the input in Hz.
+            channels (list): Channel names of the input.
+
+        Returns:
+            tuple: (sfreq, channels) of the output.
+        """
+        return sfreq, channels
+
+    def process(self, timestamps, values):
+        """
+        Process one chunk.
+
+        Args:
+            timestamps (numpy.ndarray): (n,) timestamps.
+            values (numpy.ndarray): (n, channels) samples.
+
+        Returns:
+            tuple: (timestamps, values) of the output chunk, possibly empty.
+        """
+        return timestamps, values
+
+    def reset(self):
+        """Forget the state carried between chunks."""
+
+
+class _SosFilterStage(Stage):
+    """Causal IIR filter in second-order sections with its delay state carried between chunks."""
+    def __init__(self):
+        self.sos = None
+        self._zi = None
+
+    def design(self, sfreq):
+        raise NotImplementedError
+
+    def configure(self, sfreq, channels):
+        self.sos = self.design(sfreq)
+        self._zi = None
+        return sfreq, channels
+
+    def process(self, timestamps, values):
+        if not len(values):
+            return timestamps, values
+        if self._zi is None:
+            # Start in the steady state of the first sample, avoiding a step transient
+            self._zi = signal.sosfilt_zi(self.sos)[:, :, None] * values[0]
+        filtered, self._zi = signal.sosfilt(self.sos, values, axis=0, zi=self._zi)
+        return timestamps, filtered
+
+    def reset(self):
+        self._zi = None
+
+
+class NotchFilter(_SosFilterStage):
+    """
+    Removes power-line interference at ``freq`` and its harmonics below Nyquist.
+
+    Args:
+        freq (float): Line frequency, 50 or 60 Hz.
+        quality (float): Quality factor of each notch.
+        harmonics (bool): Also notch the multiples of ``freq``.
+    """
+    name = "notch"
+
+    def __init__(self, freq=50.0, quality=30.0, harmonics=True):
+        super().__init__()
+        self.freq = freq
+        self.quality = quality
+        self.harmonics = harmonics
+
+    def design(self, sfreq):
+        nyquist = sfreq / 2.0
+        freqs = np.arange(self.freq, nyquist, self.freq) if self.harmonics else [self.freq]
+        sections = [signal.tf2sos(*signal.iirnotch(f, self.quality, sfreq)) for f in freqs if f < nyquist]
+        return np.vstack(sections)
+
+
+class HighPassFilter(_SosFilterStage):
+    """
+    Butterworth high-pass filter removing the electrode drift.
+
+    Args:
+        cutoff (float): Edge frequency in Hz.
+        order (int): Filter order.
+    """
+    name = "high_pass"
+
+    def __init__(self, cutoff=1.0, order=2):
+        super().__init__()
+        self.cutoff = cutoff
+        self.order = order
+
+    def design(self, sfreq):
+        return signal.butter(self.order, self.cutoff, btype='highpass', fs=sfreq, output='sos')
+
+
+class LowPassFilter(_SosFilterStage):
+    """
+    Butterworth low-pass filter.
+
+    Args:
+        cutoff (float): Edge frequency in Hz.
+        order (int): Filter order.
+    """
+    name = "low_pass"
+
+    def __init__(self, cutoff=40.0, order=4):
+        super().__init__()
+        self.cutoff = cutoff
+        self.order = order
+
+    def design(self, sfreq):
+        return signal.butter(self.order, self.cutoff, btype='lowpass', fs=sfreq, output='sos')
+
+
+class Rereference(Stage):
+    """
+    Subtracts a reference from every channel.
+
+    Args:
+        reference (list, optional): Names of the reference channels, e.g.
+            ``['TP9', 'TP10']`` for linked mastoids. None for the common
+            average of all channels.
+    """
+    name = "rereference"
+
+    def __init__(self, reference=None):
+        self.reference = reference
+        self._indices = None
+
+    def configure(self, sfreq, channels):
+        if self.reference is None:
+            self._indices = list(range(len(channels)))
+        else:
+            self._indices = [channels.index(channel) for channel in self.reference]
+        return sfreq, channels
+
+    def process(self, timestamps, values):
+        return timestamps, values - values[:, self._indices].mean(axis=1, keepdims=True)
+
+
+class Resample(Stage):
+    """
+    Resamples the stream onto a regular grid at ``sfreq`` Hz.
+
+    Output samples are linearly interpolated between the input samples on
+    the input timestamps, so the irregular LSL timestamps are regularized as
+    well. When downsampling, an anti-aliasing low-pass at 0.45 times the new
+    rate is applied first. The last input sample and the time of the next
+    output sample are carried to the next chunk.
+
+    Args:
+        sfreq (float): Output sample rate in Hz.
+    """
+    name = "resample"
+
+    def __init__(self, sfreq):
+        self.sfreq = sfreq
+        self._anti_alias = None
+        self.reset()
+
+    def configure(self, sfreq, channels):
+        self._anti_alias = None
+        if self.sfreq < sfreq:
+            self._anti_alias = LowPassFilter(0.45 * self.sfreq)
+            self._anti_alias.configure(sfreq, channels)
+        self.reset()
+        return self.sfreq, channels
+
+    def process(self, timestamps, values):
+        if not len(timestamps):
+            return timestamps, values
+        if self._anti_alias is not None:
+            timestamps, values = self._anti_alias.process(timestamps, values)
+        if self._last_time is not None:
+            timestamps = np.concatenate([[self._last_time], timestamps])
+            values = np.concatenate([self._last_values[None, :], values])
+        if self._start is None:
+            self._start = timestamps[0]
+        # Output times are computed from a sample counter to avoid accumulating rounding errors
+        last = int(np.floor((timestamps[-1] - self._start) * self.sfreq))
+        counts = np.arange(self._count, last + 1)
+        output_times = self._start + counts / self.sfreq
+        output = np.empty((len(counts), values.shape[1]))
+        for ch in range(values.shape[1]):
+            output[:, ch] = np.interp(output_times, timestamps, values[:, ch])
+        self._count = last + 1
+        self._last_time = timestamps[-1]
+        self._last_values = values[-1]
+        return output_times, output
+
+    def reset(self):
+        self._start = None
+        self._count = 0
+        self._last_time = None
+        self._last_values = None
+        if self._anti_alias is not None:
+            self._anti_alias.reset()
+
+
+# Stage classes by the names used in pipeline specifications
+STAGE_TYPES = {
+    'notch': NotchFilter,
+    'high_pass': HighPassFilter,
+    'low_pass': LowPassFilter,
+    'rereference': Rereference,
+    'resample': Resample
+}
+
+
+def build_stages(spec):
+    """
+    Create stages from a specification.
+
+    Args:
+        spec (list): ``(name, parameter)`` pairs in processing order, e.g.
+            ``[('notch', 50), ('high_pass', 1.0), ('rereference', ['TP9', 'TP10'])]``.
+            The parameter is passed as the first argument of the stage; None
+            keeps its default.
+
+    Returns:
+        list: The stages.
+    """
+    stages = []
+    for name, parameter in spec:
+        stage_type = STAGE_TYPES[name]
+        stages.append(stage_type() if parameter is None else stage_type(parameter))
+    return stages
+
+
+class SharedRingBuffer:
+    """
+    The most recent samples of a stream in shared memory.
+
+    The block holds a (channels + 1, size) float64 array: row 0 has the
+    timestamps and the other rows the channels, with the newest sample in
+    the last column, like the raw stream buffers of the control application.
+    Other processes attach with ``SharedRingBuffer(name=..., ...)``.
+
+    Attributes:
+        shm (multiprocessing.shared_memory.SharedMemory): The block.
+        array (numpy.ndarray): View of the block.
+        name (str): Name of the block.
+    """
+    def __init__(self, n_channels, size, name=None):
+        shape = (n_channels + 1, size)
+        nbytes = int(np.prod(shape)) * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=nbytes)
+        self.array = np.ndarray(shape, dtype=np.float64, buffer=self.shm.buf)
+        if name is None:
+            self.array[:] = np.nan
+        self.name = self.shm.name
+
+    def write(self, timestamps, values):
+        """Append samples, dropping the oldest ones."""
+        n = min(len(timestamps), self.array.shape[1])
+        if not n:
+            return
+        self.array[:, :-n] = self.array[:, n:].copy()
+        self.array[0, -n:] = timestamps[-n:]
+        self.array[1:, -n:] = values[-n:].T
+
+    def close(self, unlink=False):
+        """Detach from the block, and free it if ``unlink`` (by its creator)."""
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Pipeline:
+    """
+    Runs stages in order on the chunks of one stream.
+
+    Attributes:
+        name (str): Name of the derived stream, e.g. ``eeg_clean``.
+        stream (str): Name of the input stream.
+        n_inputs (int): Number of input channels used.
+        stages (list): The :class:`Stage` objects.
+        sfreq (float): Sample rate of the output.
+        channels (list): Channel names of the output.
+        buffer (SharedRingBuffer or None): Shared buffer of the output.
+        costs (dict): :class:`~website.command_bus.LatencyHistogram` of the
+            processing time per chunk for every stage and ``total``.
+        recording (bool): True while the output is being recorded.
+        listeners (list): Processors that receive every output chunk.
+    """
+    def __init__(self, name, stream, stages, sfreq, channels, buffer_seconds=BUFFER_SECONDS, shared=True):
+        self.name = name
+        self.stream = stream
+        self.stages = stages
+        self.n_inputs = len(channels)
+        for stage in stages:
+            sfreq, channels = stage.configure(sfreq, list(channels))
+        self.sfreq = sfreq
+        self.channels = channels
+        self.buffer = SharedRingBuffer(len(channels), int(buffer_seconds * sfreq)) if shared else None
+        self.costs = {f"{i}_{stage.name}": LatencyHistogram() for i, stage in enumerate(stages)}
+        self.costs['total'] = LatencyHistogram()
+        self.chunks = 0
+        self.recording = False
+        self.listeners = []
+        self._recorded = []
+        self._record_from = None
+        self._lock = threading.Lock()
+
+    def process(self, timestamps, values):
+        """
+        Run a chunk through the stages and publish the output.
+
+        Returns:
+            tuple: (timestamps, values) of the output chunk.
+        """
+        start = time.perf_counter()
+        values = values[:, :self.n_inputs]  # e.g. drop the Muse's auxiliary EEG channel
+        for key, stage in zip(self.costs, self.stages):
+            stage_start = time.perf_counter()
+            timestamps, values = stage.process(timestamps, values)
+            self.costs[key].add((time.perf_counter() - stage_start) * 1000.0)
+        if self.buffer is not None:
+            self.buffer.write(timestamps, values)
+        with self._lock:
+            if self.recording and len(timestamps):
+                self._recorded.append((timestamps, values))
+        self.chunks += 1
+        self.costs['total'].add((time.perf_counter() - start) * 1000.0)
+        for listener in self.listeners:
+            listener.process(timestamps, values)
+        return timestamps, values
+
+    def start_recording(self, start_at=None):
+        """
+        Start keeping the output for :meth:`stop_recording`.
+
+        Args:
+            start_at (float, optional): Timestamp of a scheduled start; output
+                samples before it are not kept.
+        """
+        with self._lock:
+            self._recorded = []
+            self._record_from = start_at
+            self.recording = True
+
+    def stop_recording(self):
+        """
+        Stop recording the output.
+
+        Returns:
+            dict: ``timestamps`` (n,) and ``values`` (n, channels) recorded
+            since :meth:`start_recording`, plus ``sfreq`` and ``channels``.
+        """
+        with self._lock:
+            self.recording = False
+            recorded, self._recorded = self._recorded, []
+        timestamps = np.concatenate([t for t, _ in recorded]) if recorded else np.zeros(0)
+        values = np.concatenate([v for _, v in recorded]) if recorded else np.zeros((0, len(self.channels)))
+        if self._record_from is not None:
+            keep = timestamps >= self._record_from
+            timestamps, values = timestamps[keep], values[keep]
+        return {
+            'timestamps': timestamps,
+            'values': values,
+            'sfreq': self.sfreq,
+            'channels': self.channels
+        }
+
+    def reset(self):
+        """Reset the state of every stage, e.g. after a reconnection."""
+        for stage in self.stages:
+            stage.reset()
+
+    def status(self):
+        """Return the output description and the per-stage cost histograms."""
+        return {
+            'stream': self.stream,
+            'sfreq': self.sfreq,
+            'channels': self.channels,
+            'shared_memory': self.buffer.name if self.buffer is not None else None,
+            'chunks': self.chunks,
+            'cost': {key: histogram.to_dict() for key, histogram in self.costs.items()}
+        }
+
+    def close(self):
+        """Free the shared buffer."""
+        if self.buffer is not None:
+            self.buffer.close(unlink=True)
+
+
+class ProcessingWorker(threading.Thread):
+    """
+    Dedicated thread running the real-time processors of the Muse streams.
+
+    The acquisition thread only queues the raw chunks with :meth:`submit`;
+    the worker converts them to arrays (except the marker strings of
+    :data:`MARKER_STREAM`) and calls every processor registered for the
+    chunk's stream, in registration order.
+
+    Args:
+        queue_size (int): Chunks queued at most.
+        clock (callable): Clock of the submit times, e.g. the LSL clock so
+            that processors can relate them to sample timestamps.
+
+    Attributes:
+        processors (dict): Stream name -> list of processors.
+        dropped (int): Chunks dropped because the queue was full.
+        arrival (float or None): Submit time of the chunk being processed.
+        latency (LatencyHistogram): Time from :meth:`submit` until all
+            processors of the chunk are done.
+    """
+    def __init__(self, queue_size=QUEUE_SIZE, clock=time.perf_counter):
+        super().__init__(daemon=True, name="ProcessingWorker")
+        self.processors = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.clock = clock
+        self.dropped = 0
+        self.arrival = None
+        self.latency = LatencyHistogram()
+        self._stop_event = threading.Event()
+
+    def add(self, stream, processor, first=False):
+        """
+        Register a processor (an object with ``process(timestamps, values)``) for a stream.
+
+        Args:
+            stream (str): Stream name.
+            processor (object): The processor.
+            first (bool): Run it before the processors already registered,
+                for latency-critical ones such as closed-loop triggers.
+        """
+        processors = self.processors.setdefault(stream, [])
+        if first:
+            processors.insert(0, processor)
+        else:
+            processors.append(processor)
+
+    def submit(self, stream, timestamps, chunk):
+        """
+        Queue a chunk as pulled from the stream's inlet. Never blocks.
+
+        Args:
+            stream (str): Stream name.
+            timestamps (list): Timestamps of the samples.
+            chunk (list): Samples, one list of channel values each.
+        """
+        if stream not in self.processors:
+            return
+        try:
+            self.queue.put_nowait((stream, timestamps, chunk, self.clock()))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                stream, timestamps, chunk, self.arrival = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            timestamps = np.asarray(timestamps, dtype=np.float64)
+            values = chunk if stream == MARKER_STREAM else np.asarray(chunk, dtype=np.float64)
+            for processor in self.processors[stream]:
+                try:
+                    processor.process(timestamps, values)
+                except Exception as e:
+                    print(f"ProcessingWorker: {type(processor).__name__} failed on {stream}: {e}")
+            self.latency.add((self.clock() - self.arrival) * 1000.0)
+
+    def stop(self):
+        """Stop the thread after the current chunk."""
+        self._stop_event.set()
+
+    def status(self):
+        """Return the queue state and the submit-to-done latency."""
+        return {'queued': self.queue.qsize(), 'dropped': self.dropped, 'latency': self.latency.to_dict()}
@@ -0,0 +1,497 @@
+"""
+Loaders for Recorded Session Files
+
+Reads the JSON files written during a session into numpy arrays:
+- ``recorded_data_*.json``: Muse streams (EEG, accelerometer, gyroscope,
+  PPG) and stimulus markers saved by the control application
+- ``recording_start_time_*_timestamps.json``: camera frame timestamps
+  saved by the camera program (p1)
+- ``image_stimuli_start_time_*.json`` / ``video_stimuli_start_time_*.json``:
+  stimulus logs saved by the stimulus programs (p2, p4)
+
+Recordings and camera timestamps are pretty-printed JSON in which every
+sample is an object. Instead of building that object tree with
+``json.load``, they are converted by a streaming scanner that reads the
+file in blocks and extracts the numbers of each block with regular
+expressions, and the result is stored as a columnar cache next to the
+file: a ``recorded_data_*.cache/`` directory of ``.npy`` columns, or a
+``*_timestamps.npy`` file. The loaders use the cache (memory-mapped) when
+it was made from the current version of the file and convert otherwise.
+
+Recordings saved in the compressed chunk format (``recorded_data_*.ncz``,
+see :mod:`website.compression`) are decoded directly and need no cache.
+
+Convert a backlog of files up front with:
+    python -m website.recordings data/
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from website.compression import CompressedRecording
+
+# Muse streams stored in recorded_data_*.json and their channel names
+STREAM_CHANNELS = {
+    'eeg': ['TP9', 'AF7', 'AF8', 'TP10'],
+    'acc': ['X', 'Y', 'Z'],
+    'gyro': ['X', 'Y', 'Z'],
+    'ppg': ['PPG1', 'PPG2', 'PPG3']
+}
+
+# Nominal sample rates (Hz) of the Muse streams
+STREAM_RATES = {'eeg': 256, 'acc': 52, 'gyro': 52, 'ppg': 64}
+
+# Output range (min, max) of the Muse EEG in uV: 12-bit samples of
+# 0.48828125 uV, centred on zero by muselsl (-2048 to 2047 steps)
+EEG_RANGE = (-1000.0, 999.51171875)
+
+CACHE_VERSION = 1  # bump when the cache layout changes to rebuild all caches
+CACHE_META_NAME = "meta.json"
+BLOCK_SIZE = 2 * 1024 * 1024  # characters read from a JSON file at a time
+
+# Top-level arrays of a recording, and one sample object inside them
+SECTION_RE = re.compile(r'"(' + "|".join(list(STREAM_CHANNELS) + ['markers']) + r')":\s*\[')
+SAMPLE_RE = re.compile(r'"timestamp":\s*([^,\s]+),\s*"values":\s*\[([^\]]*)\]')
+FRAME_RE = re.compile(r'"frame_number":\s*(\d+),\s*"timestamp":\s*([^,\s}]+)')
+
+
+def recording_cache_dir(path):
+    """Return the cache directory of a ``recorded_data_*.json`` file."""
+    return os.path.splitext(path)[0] + ".cache"
+
+
+def camera_cache_path(path):
+    """Return the cache file of a ``*_timestamps.json`` file."""
+    return os.path.splitext(path)[0] + ".npy"
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return {'version': CACHE_VERSION, 'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def is_cache_fresh(path):
+    """Return True if the recording's cache was made from the current version of the file."""
+    meta_path = os.path.join(recording_cache_dir(path), CACHE_META_NAME)
+    if not os.path.exists(meta_path):
+        return False
+    try:
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return all(meta.get(key) == value for key, value in _source_signature(path).items())
+
+
+def _parse_samples(text, n_channels):
+    """
+    Extract the samples of one block of a stream section.
+
+    Returns:
+        tuple: (timestamps, values) arrays, values shape (samples, n_channels).
+    """
+    matches = SAMPLE_RE.findall(text)
+    if not matches:
+        return np.zeros(0), np.zeros((0, n_channels))
+    timestamps = np.array([match[0] for match in matches], dtype=np.float64)
+    rows = [match[1] for match in matches]
+    widths = {row.count(',') + 1 if row.strip() else 0 for row in rows}
+    flat = None
+    if len(widths) == 1 and 0 not in widths:
+        # All samples have the same number of values: parse them in one call
+        width = widths.pop()
+        flat = np.fromstring(",".join(rows), dtype=np.float64, sep=",")
+    if flat is not None and len(flat) == len(rows) * width:
+        values = flat.reshape(len(rows), width)[:, :n_channels]
+        if width < n_channels:
+            values = np.pad(values, ((0, 0), (0, n_channels - width)))
+    else:
+        values = np.zeros((len(rows), n_channels))
+        for i, row in enumerate(rows):
+            row_values = [float(v) for v in row.split(',') if v.strip()][:n_channels]
+            values[i, :len(row_values)] = row_values
+    return timestamps, values
+
+
+def convert_recording(path, write_cache=True, block_size=BLOCK_SIZE):
+    """
+    Convert a ``recorded_data_*.json`` file without parsing it into objects.
+
+    The file is read in blocks; each block is cut after its last complete
+    sample object and its samples are extracted with :data:`SAMPLE_RE`.
+    The (small) marker array is decoded with the ``json`` module.
+
+    Args:
+        path (str): Path of the recording.
+        write_cache (bool): Store the columns in the cache directory.
+        block_size (int): Characters read at a time.
+
+    Returns:
+        dict: The recording, as returned by :func:`load_recording`.
+    """
+    columns = {stream: ([], []) for stream in STREAM_CHANNELS}
+    markers = []
+    section = None
+    decoder = json.JSONDecoder()
+
+    def consume(text):
+        if section in columns:
+            timestamps, values = _parse_samples(text, len(STREAM_CHANNELS[section]))
+            if len(timestamps):
+                columns[section][0].append(timestamps)
+                columns[section][1].append(values)
+
+    with open(path, 'r') as file:
+        buffer = ""
+        eof = False
+        while True:
+            if not eof:
+                block = file.read(block_size)
+                eof = not block
+                buffer += block
+            header = SECTION_RE.search(buffer)
+            if header is not None:
+                consume(buffer[:header.start()])
+                if header.group(1) == 'markers':
+                    try:
+                        entries, end = decoder.raw_decode(buffer, header.end() - 1)
+                    except ValueError:
+                        if eof:
+                            raise
+                        buffer = buffer[header.start():]  # read on until the array is complete
+                        continue
+                    markers.extend(entries)
+                    section = None
+                    buffer = buffer[end:]
+                else:
+                    section = header.group(1)
+                    buffer = buffer[header.end():]
+                continue
+            # Keep the incomplete sample after the last closing brace for the next block
+            cut = len(buffer) if eof else buffer.rfind('}') + 1
+            consume(buffer[:cut])
+            buffer = buffer[cut:]
+            if eof:
+                break
+
+    recording = {}
+    for stream, channels in STREAM_CHANNELS.items():
+        timestamps, values = columns[stream]
+        recording[stream] = {
+            'timestamps': np.concatenate(timestamps) if timestamps else np.zeros(0),
+            'values': np.concatenate(values) if values else np.zeros((0, len(channels)))
+        }
+    recording['markers'] = {
+        'timestamps': np.array([marker['timestamp'] for marker in markers], dtype=np.float64),
+        'values': [marker['values'][0] if marker['values'] else "" for marker in markers],
+        'streams': [marker.get('stream', "") for marker in markers]
+    }
+
+    if write_cache:
+        try:
+            _write_recording_cache(path, recording)
+        except OSError as e:
+            print(f"WARNING: Could not write recording cache for {path}: {e}")
+    return recording
+
+
+def _write_recording_cache(path, recording):
+    """Write the columns of a converted recording; ``meta.json`` is written last."""
+    signature = _source_signature(path)
+    cache_dir = recording_cache_dir(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, CACHE_META_NAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for stream in STREAM_CHANNELS:
+        for field in ('timestamps', 'values'):
+            np.save(os.path.join(cache_dir, f"{stream}_{field}.npy"), recording[stream][field])
+    with open(os.path.join(cache_dir, "markers.json"), 'w') as file:
+        json.dump({'timestamps': recording['markers']['timestamps'].tolist(),
+                   'values': recording['markers']['values'],
+                   'streams': recording['markers']['streams']}, file)
+    with open(meta_path, 'w') as file:
+        json.dump(signature, file)
+
+
+def _read_recording_cache(path):
+    cache_dir = recording_cache_dir(path)
+    recording = {}
+    for stream in STREAM_CHANNELS:
+        recording[stream] = {field: np.load(os.path.join(cache_dir, f"{stream}_{field}.npy"), mmap_mode='r')
+                             for field in ('timestamps', 'values')}
+    with open(os.path.join(cache_dir, "markers.json"), 'r') as file:
+        markers = json.load(file)
+    markers['timestamps'] = np.array(markers['timestamps'], dtype=np.float64)
+    recording['markers'] = markers
+    return recording
+
+
+def load_recording(path, use_cache=True):
+    """
+    Load a ``recorded_data_*.json`` or ``recorded_data_*.ncz`` file.
+
+    JSON files use the columnar cache if it is up to date, otherwise they
+    are converted with :func:`convert_recording` and the cache is written.
+    Compressed files are decoded in memory.
+
+    Args:
+        path (str): Path of the recording.
+        use_cache (bool): Read and write the cache. Stream arrays loaded
+            from the cache are read-only memory maps.
+
+    Returns:
+        dict: For each stream in ``STREAM_CHANNELS`` a dict with
+        ``timestamps`` (n,) and ``values`` (n, channels) arrays on the LSL
+        clock, and ``markers`` with ``timestamps`` (n,) plus lists of marker
+        ``values`` and source ``streams``.
+    """
+    if path.endswith(".ncz"):
+        return _read_compressed_recording(path)
+    if use_cache and is_cache_fresh(path):
+        return _read_recording_cache(path)
+    return convert_recording(path, write_cache=use_cache)
+
+
+def _stream_columns(values, stream):
+    """Return decoded ``.ncz`` values with the channels of ``STREAM_CHANNELS``, zero-filling missing ones."""
+    n_channels = len(STREAM_CHANNELS[stream])
+    columns = np.zeros((len(values), n_channels))
+    width = min(values.shape[1], n_channels)
+    columns[:, :width] = values[:, :width]
+    return columns
+
+
+def _marker_columns(markers):
+    """Return the marker dicts of a recording as the ``markers`` layout of :func:`load_recording`."""
+    return {
+        'timestamps': np.array([marker['timestamp'] for marker in markers], dtype=np.float64),
+        'values': [marker['values'][0] if marker['values'] else "" for marker in markers],
+        'streams': [marker.get('stream', "") for marker in markers]
+    }
+
+
+def _read_compressed_recording(path):
+    """Decode a ``recorded_data_*.ncz`` file into the layout of :func:`load_recording`."""
+    compressed = CompressedRecording(path)
+    recording = {}
+    for stream in STREAM_CHANNELS:
+        timestamps, values = compressed.read(stream)
+        recording[stream] = {'timestamps': timestamps, 'values': _stream_columns(values, stream)}
+    recording['markers'] = _marker_columns(compressed.markers)
+    return recording
+
+
+def _cached_recording(path):
+    """
+    Return a JSON recording with its streams memory-mapped from the cache,
+    converting it first if the cache is missing or stale. Falls back to the
+    converted arrays if the cache cannot be written.
+    """
+    if not is_cache_fresh(path):
+        recording = convert_recording(path)
+        if not is_cache_fresh(path):
+            return recording
+        del recording  # read back memory-mapped instead of holding every stream
+    return _read_recording_cache(path)
+
+
+def convert_camera_timestamps(path, write_cache=True, block_size=BLOCK_SIZE):
+    """
+    Convert a camera ``*_timestamps.json`` file without parsing it into objects.
+
+    Args:
+        path (str): Path of a ``recording_start_time_*_timestamps.json`` file.
+        write_cache (bool): Store the timestamps in ``*_timestamps.npy``.
+        block_size (int): Characters read at a time.
+
+    Returns:
+        numpy.ndarray: Timestamp of each frame, indexed by frame number.
+    """
+    frame_numbers, timestamps = [], []
+    with open(path, 'r') as file:
+        buffer = ""
+        while True:
+            block = file.read(block_size)
+            buffer += block
+            cut = len(buffer) if not block else buffer.rfind('}') + 1
+            matches = FRAME_RE.findall(buffer[:cut])
+            if matches:
+                frame_numbers.append(np.array([match[0] for match in matches], dtype=np.int64))
+                timestamps.append(np.array([match[1] for match in matches], dtype=np.float64))
+            buffer = buffer[cut:]
+            if not block:
+                break
+
+    frame_numbers = np.concatenate(frame_numbers) if frame_numbers else np.zeros(0, dtype=np.int64)
+    frame_timestamps = np.full(frame_numbers.max() + 1 if len(frame_numbers) else 0, np.nan)
+    frame_timestamps[frame_numbers] = np.concatenate(timestamps) if timestamps else np.zeros(0)
+
+    if write_cache:
+        try:
+            np.save(camera_cache_path(path), frame_timestamps)
+        except OSError as e:
+            print(f"WARNING: Could not write camera timestamp cache for {path}: {e}")
+    return frame_timestamps
+
+
+def load_camera_timestamps(path, use_cache=True):
+    """
+    Load the frame timestamps saved next to a camera recording.
+
+    Uses ``*_timestamps.npy`` if it is newer than the JSON file, otherwise
+    converts the file with :func:`convert_camera_timestamps`.
+
+    Args:
+        path (str): Path of a ``recording_start_time_*_timestamps.json`` file.
+        use_cache (bool): Read and write the cache.
+
+    Returns:
+        numpy.ndarray: Timestamp of each frame, indexed by frame number.
+    """
+    cache_path = camera_cache_path(path)
+    if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return np.load(cache_path)
+    return convert_camera_timestamps(path, write_cache=use_cache)
+
+
+def load_stimulus_log(path):
+    """
+    Load a stimulus log written by the image (p2) or video (p4) program.
+
+    Args:
+        path (str): Path of an ``*_stimuli_start_time_*.json`` file.
+
+    Returns:
+        dict: ``labels`` (list of files shown), wall-clock ``timestamps``
+        and ``lsl_timestamps`` arrays. LSL timestamps are NaN for logs
+        written before they were recorded.
+    """
+    with open(path, 'r') as file:
+        entries = json.load(file)
+    return {
+        'labels': [entry['file_shown'] for entry in entries],
+        'timestamps': np.array([entry['timestamp'] for entry in entries], dtype=np.float64),
+        'lsl_timestamps': np.array([entry.get('lsl_timestamp', np.nan) for entry in entries], dtype=np.float64)
+    }
+
+
+def nearest_indices(times, queries, tolerance):
+    """
+    Find the index of the nearest sample for each query time.
+
+    Args:
+        times (numpy.ndarray): Sorted sample timestamps.
+        queries (numpy.ndarray): Query timestamps, in any order.
+        tolerance (float): Largest allowed distance in seconds; queries
+            farther from every sample (or NaN) get -1.
+
+    Returns:
+        numpy.ndarray: Integer sample index per query, -1 where no sample matches.
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    if len(times) == 0:
+        return np.full(queries.shape, -1, dtype=np.int64)
+    # Candidates are the samples just before and just after each query
+    right = np.clip(np.searchsorted(times, queries), 0, len(times) - 1)
+    left = np.maximum(right - 1, 0)
+    pick_left = np.abs(queries - times[left]) <= np.abs(times[right] - queries)
+    indices = np.where(pick_left, left, right)
+    with np.errstate(invalid='ignore'):
+        valid = np.abs(times[indices] - queries) <= tolerance
+    return np.where(valid, indices, -1).astype(np.int64)
+
+
+def iter_stream_chunks(path, stream, chunk_size=4096):
+    """
+    Iterate over one stream of a recording in chunks of samples.
+
+    Compressed recordings are decoded one stored chunk at a time and JSON
+    recordings are read from the memory-mapped cache (converted once if it
+    is stale), so only the current chunk is held in memory.
+
+    Args:
+        path (str): Path of a ``recorded_data_*.json`` or ``.ncz`` file.
+        stream (str): ``eeg``, ``acc``, ``gyro`` or ``ppg``.
+        chunk_size (int): Samples per chunk.
+
+    Yields:
+        tuple: (timestamps, values) arrays of at most ``chunk_size`` samples.
+    """
+    if path.endswith(".ncz"):
+        for timestamps, values in CompressedRecording(path).iter_chunks(stream):
+            values = _stream_columns(values, stream)
+            for start in range(0, len(timestamps), chunk_size):
+                yield timestamps[start:start + chunk_size], values[start:start + chunk_size]
+        return
+    data = _cached_recording(path)[stream]
+    for start in range(0, len(data['timestamps']), chunk_size):
+        yield (np.asarray(data['timestamps'][start:start + chunk_size]),
+               np.asarray(data['values'][start:start + chunk_size]))
+
+
+def first_timestamp(path, stream):
+    """
+    Return the first timestamp of a stream of a recording, or None if it is
+    empty, from the chunk index or the cache without reading the samples.
+    """
+    if path.endswith(".ncz"):
+        return CompressedRecording(path).first_timestamp(stream)
+    timestamps = _cached_recording(path)[stream]['timestamps']
+    return float(timestamps[0]) if len(timestamps) else None
+
+
+def load_markers(path):
+    """Return the ``markers`` of a recording, as in :func:`load_recording`, without its streams."""
+    if path.endswith(".ncz"):
+        return _marker_columns(CompressedRecording(path).markers)
+    return _cached_recording(path)['markers']
+
+
+def convert_directory(directory):
+    """
+    Convert every recording and camera timestamp file below a directory
+    whose cache is missing or stale.
+
+    Args:
+        directory (str): Directory searched recursively, e.g. ``data/``.
+
+    Returns:
+        dict: ``converted`` and ``up_to_date`` file counts, ``megabytes``
+        converted and ``seconds``.
+    """
+    start = time.perf_counter()
+    converted = up_to_date = 0
+    converted_bytes = 0
+    for path in sorted(glob.glob(os.path.join(directory, "**", "recorded_data_*.json"), recursive=True)):
+        if is_cache_fresh(path):
+            up_to_date += 1
+            continue
+        file_start = time.perf_counter()
+        convert_recording(path)
+        converted += 1
+        converted_bytes += os.path.getsize(path)
+        print(f"Converted {path} ({os.path.getsize(path) / 1e6:.1f} MB) in {time.perf_counter() - file_start:.2f} s")
+    for path in sorted(glob.glob(os.path.join(directory, "**", "*_timestamps.json"), recursive=True)):
+        cache_path = camera_cache_path(path)
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            up_to_date += 1
+            continue
+        convert_camera_timestamps(path)
+        converted += 1
+        converted_bytes += os.path.getsize(path)
+        print(f"Converted {path}")
+    elapsed = time.perf_counter() - start
+    print(f"Converted {converted} files ({converted_bytes / 1e6:.1f} MB) in {elapsed:.1f} s, "
+          f"{up_to_date} already up to date")
+    return {'converted': converted, 'up_to_date': up_to_date, 'megabytes': converted_bytes / 1e6, 'seconds': elapsed}
+
+
+if __name__ == "__main__":
+    convert_directory(sys.argv[1] if len(sys.argv) > 1 else "data")
@@ -0,0 +1,181 @@
+"""
+Deadline-Based Stimulus Scheduler
+
+Schedules stimulus onsets at absolute offsets from a single run start on the
+monotonic project clock (:mod:`website.clock`), instead of chaining ``time.sleep(duration)`` calls whose
+overheads accumulate into drift over a long sequence.
+
+Key Features:
+- Absolute target onsets computed from one run start
+- Coarse interruptible sleep followed by a short spin up to the deadline
+- Intended vs. actual onset recorded for every trial
+- Timing report (mean/max error, drift) saved next to the stimuli log
+"""
+
+import json
+import platform
+import time
+
+from website import clock
+
+# Time before a deadline at which the coarse sleep hands over to spinning.
+# Windows sleeps in ~15.6 ms ticks unless the timer resolution is raised.
+SPIN_MARGIN = 0.02 if platform.system() == "Windows" else 0.002
+
+
+class StimulusScheduler:
+    """
+    Monotonic-clock scheduler for stimulus onsets.
+
+    Attributes:
+        spin_margin (float): Seconds before a deadline spent busy-waiting.
+        clock (callable): Monotonic clock returning seconds.
+        run_start (float or None): Clock value at the start of the run.
+        requested_at (float or None): Clock value of the request that started
+            the run, if known.
+        trials (list): One dict per recorded onset with ``label``,
+            ``intended`` and ``actual`` offsets (seconds from run start).
+    """
+    def __init__(self, spin_margin=SPIN_MARGIN, clock=clock.now):
+        self.spin_margin = spin_margin
+        self.clock = clock
+        self.run_start = None
+        self.requested_at = None
+        self.trials = []
+
+    def start(self, requested_at=None, at=None):
+        """
+        Mark the start of the run. All offsets are relative to this moment.
+
+        Args:
+            requested_at (float, optional): Clock value at which the run was
+                requested, to report the request-to-first-onset latency.
+            at (float, optional): Clock value of a scheduled run start
+                instead of now, e.g. a synchronized session start;
+                ``wait_until(0)`` waits for it.
+
+        Returns:
+            float: Clock value of the run start.
+        """
+        self.run_start = self.clock() if at is None else at
+        self.requested_at = requested_at
+        self.trials = []
+        return self.run_start
+
+    def elapsed(self):
+        """Return seconds since the run start."""
+        return self.clock() - self.run_start
+
+    def wait_until(self, offset, stop_event=None):
+        """
+        Block until ``offset`` seconds after the run start.
+
+        Sleeps until ``spin_margin`` before the deadline and spins for the
+        remainder. A deadline already in the past returns immediately.
+
+        Args:
+            offset (float): Target time in seconds from the run start.
+            stop_event (threading.Event, optional): Interrupts the coarse sleep.
+
+        Returns:
+            bool: False if ``stop_event`` was set while waiting, True otherwise.
+        """
+        deadline = self.run_start + offset
+        remaining = deadline - self.clock() - self.spin_margin
+        if remaining > 0:
+            if stop_event is not None:
+                if stop_event.wait(remaining):
+                    return False
+            else:
+                time.sleep(remaining)
+        if stop_event is not None and stop_event.is_set():
+            return False
+        while self.clock() < deadline:
+            pass
+        return True
+
+    def record(self, label, intended, at=None):
+        """
+        Record an onset that has just happened.
+
+        Args:
+            label (str): Stimulus label (file shown or countdown step).
+            intended (float): Intended onset in seconds from the run start.
+            at (float, optional): Clock value of the onset if it was observed
+                earlier than the call, e.g. from a player event.
+
+        Returns:
+            float: Actual onset in seconds from the run start.
+        """
+        actual = self.elapsed() if at is None else at - self.run_start
+        self.trials.append({
+            'label': label,
+            'intended': intended,
+            'actual': actual,
+            'error_ms': (actual - intended) * 1000.0
+        })
+        return actual
+
+    def report(self):
+        """
+        Summarize onset errors of the recorded trials.
+
+        ``drift_ms_per_min`` is the least-squares slope of the onset error
+        over the intended onset, i.e. how fast errors grow along the run.
+
+        Returns:
+            dict: Summary statistics followed by the per-trial records.
+        """
+        errors = [trial['error_ms'] for trial in self.trials]
+        n = len(errors)
+        summary = {
+            'trials': n,
+            'spin_margin_ms': self.spin_margin * 1000.0,
+            'mean_error_ms': None,
+            'mean_abs_error_ms': None,
+            'max_abs_error_ms': None,
+            'drift_ms_per_min': None,
+            'total_drift_ms': None,
+            'request_to_first_onset_ms': None
+        }
+        if n:
+            summary['mean_error_ms'] = sum(errors) / n
+            summary['mean_abs_error_ms'] = sum(abs(e) for e in errors) / n
+            summary['max_abs_error_ms'] = max(abs(e) for e in errors)
+            summary['total_drift_ms'] = errors[-1] - errors[0]
+            if self.requested_at is not None:
+                first_onset = self.run_start + self.trials[0]['actual']
+                summary['request_to_first_onset_ms'] = (first_onset - self.requested_at) * 1000.0
+            if n > 1:
+                xs = [trial['intended'] for trial in self.trials]
+                x_mean = sum(xs) / n
+                var = sum((x - x_mean) ** 2 for x in xs)
+                if var > 0:
+                    cov = sum((x - x_mean) * (e - summary['mean_error_ms']) for x, e in zip(xs, errors))
+                    summary['drift_ms_per_min'] = cov / var * 60.0
+        summary['trial_timing'] = self.trials
+        return summary
+
+    def save_report(self, path, extra=None):
+        """
+        Write :meth:`report` to a JSON file.
+
+        Args:
+            path (str): Output path, e.g. ``data/image_stimuli_start_time_*_timing.json``.
+            extra (dict, optional): Additional sections added to the report,
+                e.g. video transition latencies.
+
+        Returns:
+            dict: The report that was written.
+        """
+        report = self.report()
+        if extra:
+            report.update(extra)
+        with open(path, 'w') as jsonfile:
+            json.dump(report, jsonfile, indent=4)
+        return report
+
+
+def timing_report_path(stimuli_log_path):
+    """Return the timing report path stored next to a stimuli log file."""
+    return stimuli_log_path.replace('.json', '_timing.json')
@@ -0,0 +1,268 @@
+"""
+Session Directories and Alignment Index
+
+Groups everything recorded in one session under a single directory
+``data/sessions/<session_id>/`` described by a ``manifest.json``, instead of
+loose files in ``data/`` that are only related by their own timestamps.
+
+The control application opens a session, tells the child programs to write
+their outputs (camera video and frame timestamps, stimulus logs, timing
+reports) into its directory, saves the Muse recordings there, and finalizes
+the session. Finalizing lists the files in the manifest and precomputes an
+alignment index (``alignment.json``) that maps every stimulus event to the
+nearest EEG sample of the recording and the nearest camera frame, so
+downstream analysis does not have to re-discover and re-align the files.
+
+EEG samples and stimulus events are matched on the LSL clock; camera frames
+are matched on their wall-clock times, which every program derives from the
+LSL clock with the same published offset (see :mod:`website.clock`).
+"""
+
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from website import clock
+from website.recordings import (STREAM_RATES, load_recording, load_camera_timestamps,
+                                load_stimulus_log, nearest_indices)
+
+SESSIONS_DIR = "data/sessions"
+MANIFEST_NAME = "manifest.json"
+ALIGNMENT_NAME = "alignment.json"
+
+STATUS_OPEN = "open"
+STATUS_FINALIZED = "finalized"
+
+# Role of each session file, matched by glob pattern in this order
+FILE_ROLES = (
+    ('timing_report', '*_timing.json'),
+    ('closed_loop_report', '*_closed_loop.json'),
+    ('camera_timestamps', 'recording_start_time_*_timestamps.json'),
+    ('camera_video', 'recording_start_time_*.avi'),
+    ('eeg_recording', 'recorded_data_*.json'),
+    ('eeg_recording', 'recorded_data_*.ncz'),
+    ('image_stimuli_log', 'image_stimuli_start_time_*.json'),
+    ('video_stimuli_log', 'video_stimuli_start_time_*.json'),
+    ('derived_stream', 'derived_data_*.npz'),
+    ('subject_information', 'subject_information.json'),
+    ('session_start', 'session_start.json'),
+    ('clock_offsets', 'clock_offsets.json')
+)
+
+# Largest distance (seconds) between an event and its matched camera frame
+CAMERA_TOLERANCE = 0.5
+
+
+def new_session_id(label=None):
+    """Return a session id made of the current time and an optional label."""
+    session_id = time.strftime('%Y%m%d_%H%M%S')
+    if label:
+        session_id += "_" + "".join(c if c.isalnum() or c in "-_" else "_" for c in label)
+    return session_id
+
+
+class Session:
+    """
+    A session directory and its manifest.
+
+    Attributes:
+        path (str): Session directory.
+        manifest (dict): Contents of ``manifest.json``: ``session_id``,
+            ``created``, ``status``, ``finalized``, ``files`` (list of
+            ``{"name", "role", "size", "mtime"}``) and ``alignment``.
+    """
+    def __init__(self, path):
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as file:
+                self.manifest = json.load(file)
+        else:
+            self.manifest = {
+                'session_id': os.path.basename(os.path.normpath(path)),
+                'created': clock.wall_datetime().strftime('%Y-%m-%d %H:%M:%S.%f'),
+                'status': STATUS_OPEN,
+                'finalized': None,
+                'files': [],
+                'alignment': None
+            }
+
+    @classmethod
+    def create(cls, root=SESSIONS_DIR, label=None, subject_information="data/subject_information.json"):
+        """
+        Create a new session directory with an open manifest.
+
+        Args:
+            root (str): Directory holding all sessions.
+            label (str, optional): Appended to the session id.
+            subject_information (str, optional): Subject information file
+                copied into the session if it exists.
+
+        Returns:
+            Session: The new session.
+        """
+        path = os.path.join(root, new_session_id(label))
+        os.makedirs(path, exist_ok=True)
+        session = cls(path)
+        if subject_information and os.path.exists(subject_information):
+            with open(subject_information, 'r') as file:
+                info = json.load(file)
+            with open(session.file_path("subject_information.json"), 'w') as file:
+                json.dump(info, file)
+        session.save_manifest()
+        return session
+
+    @property
+    def session_id(self):
+        return self.manifest['session_id']
+
+    def file_path(self, name):
+        """Return the path of a file inside the session directory."""
+        return os.path.join(self.path, name)
+
+    def save_manifest(self):
+        """Write ``manifest.json``."""
+        with open(self.file_path(MANIFEST_NAME), 'w') as file:
+            json.dump(self.manifest, file, indent=4)
+
+    def scan_files(self):
+        """
+        List the session's data files with their roles.
+
+        Returns:
+            list: ``{"name", "role", "size", "mtime"}`` per file, sorted by name.
+        """
+        files = {}
+        for role, pattern in FILE_ROLES:
+            for path in glob.glob(os.path.join(self.path, pattern)):
+                name = os.path.basename(path)
+                if name in files:
+                    continue
+                stat = os.stat(path)
+                files[name] = {'name': name, 'role': role, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        return [files[name] for name in sorted(files)]
+
+    def files_with_role(self, role):
+        """Return the paths of the manifest's files with a role, sorted by name."""
+        return [self.file_path(f['name']) for f in self.manifest['files'] if f['role'] == role]
+
+    def build_alignment(self):
+        """
+        Map every stimulus event to EEG sample indices and camera frame numbers.
+
+        All events of the session are matched against each recording at once
+        with ``numpy.searchsorted``. An event is assigned to the recording
+        (and camera video) whose samples lie within one sample period (or
+        ``CAMERA_TOLERANCE`` for frames); unmatched events get -1.
+
+        Returns:
+            dict: ``events`` (one record per stimulus event) and the lists of
+            ``recordings`` and ``videos`` the indices refer to.
+        """
+        labels, logs, wall_times, lsl_times = [], [], [], []
+        for role in ('image_stimuli_log', 'video_stimuli_log'):
+            for path in self.files_with_role(role):
+                log = load_stimulus_log(path)
+                labels.extend(log['labels'])
+                logs.extend([os.path.basename(path)] * len(log['labels']))
+                wall_times.append(log['timestamps'])
+                lsl_times.append(log['lsl_timestamps'])
+        wall_times = np.concatenate(wall_times) if wall_times else np.zeros(0)
+        lsl_times = np.concatenate(lsl_times) if lsl_times else np.zeros(0)
+        n_events = len(labels)
+
+        recordings = self.files_with_role('eeg_recording')
+        eeg_recording = np.full(n_events, -1, dtype=np.int64)
+        eeg_sample = np.full(n_events, -1, dtype=np.int64)
+        for r, path in enumerate(recordings):
+            timestamps = load_recording(path)['eeg']['timestamps']
+            indices = nearest_indices(timestamps, lsl_times, 1.0 / STREAM_RATES['eeg'])
+            matched = (indices >= 0) & (eeg_sample < 0)
+            eeg_recording[matched] = r
+            eeg_sample[matched] = indices[matched]
+
+        videos = self.files_with_role('camera_video')
+        camera_video = np.full(n_events, -1, dtype=np.int64)
+        camera_frame = np.full(n_events, -1, dtype=np.int64)
+        for v, path in enumerate(videos):
+            timestamps_path = path.replace('.avi', '_timestamps.json')
+            if not os.path.exists(timestamps_path):
+                continue
+            indices = nearest_indices(load_camera_timestamps(timestamps_path), wall_times, CAMERA_TOLERANCE)
+            matched = (indices >= 0) & (camera_frame < 0)
+            camera_video[matched] = v
+            camera_frame[matched] = indices[matched]
+
+        events = []
+        for i in range(n_events):
+            events.append({
+                'label': labels[i],
+                'log': logs[i],
+                'timestamp': float(wall_times[i]),
+                'lsl_timestamp': None if np.isnan(lsl_times[i]) else float(lsl_times[i]),
+                'eeg_recording': int(eeg_recording[i]),
+                'eeg_sample': int(eeg_sample[i]),
+                'camera_video': int(camera_video[i]),
+                'camera_frame': int(camera_frame[i])
+            })
+        return {
+            'recordings': [os.path.basename(path) for path in recordings],
+            'videos': [os.path.basename(path) for path in videos],
+            'events': events
+        }
+
+    def finalize(self):
+        """
+        List the session files in the manifest, write the alignment index
+        and mark the session finalized.
+
+        Returns:
+            dict: The manifest.
+        """
+        self.manifest['files'] = self.scan_files()
+        alignment = self.build_alignment()
+        with open(self.file_path(ALIGNMENT_NAME), 'w') as file:
+            json.dump(alignment, file, indent=4)
+
+        events = alignment['events']
+        self.manifest['alignment'] = {
+            'file': ALIGNMENT_NAME,
+            'events': len(events),
+            'eeg_matched': sum(1 for event in events if event['eeg_sample'] >= 0),
+            'camera_matched': sum(1 for event in events if event['camera_frame'] >= 0)
+        }
+        self.manifest['status'] = STATUS_FINALIZED
+        self.manifest['finalized'] = clock.wall_datetime().strftime('%Y-%m-%d %H:%M:%S.%f')
+        self.save_manifest()
+        return self.manifest
+
+    def load_alignment(self):
+        """
+        Load the alignment index written by :meth:`finalize`.
+
+        Returns:
+            dict or None: The alignment index, or None if the session has not
+            been finalized.
+        """
+        path = self.file_path(ALIGNMENT_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+
+def list_sessions(root=SESSIONS_DIR):
+    """
+    Find all sessions below a directory.
+
+    Args:
+        root (str): Directory holding the session directories.
+
+    Returns:
+        list: :class:`Session` per directory containing a manifest, sorted by path.
+    """
+    paths = glob.glob(os.path.join(root, "**", MANIFEST_NAME), recursive=True)
+    return [Session(os.path.dirname(path)) for path in sorted(paths)]
@@ -0,0 +1,161 @@
+"""
+Image Stimulus Cache
+
+Decodes and scales image stimuli before a run starts so that presenting an
+image only has to swap an already prepared frame into the stimulus window.
+
+Key Features:
+- Bounded in-memory LRU cache keyed by file, modification time and target size
+- Scaling to the screen resolution (aspect ratio preserved)
+- PNG, JPEG and BMP sources decoded through Pillow
+- Optional persistent on-disk cache of the scaled versions for large stimulus sets
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+DEFAULT_CACHE_DIR = "data/stimulus_cache"
+DEFAULT_MAX_ITEMS = 64
+
+
+def resolve_image_path(name, directory="image_stimuli"):
+    """
+    Find the image file for a stimulus name.
+
+    Args:
+        name (str): Stimulus name as written in ``fileSequence`` (e.g. ``a``).
+            A name that already carries a supported extension is used as is.
+        directory (str): Directory holding the image stimuli.
+
+    Returns:
+        str or None: Path of the first existing file, or None if no file
+        with a supported extension exists.
+    """
+    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+        candidates = [os.path.join(directory, name)]
+    else:
+        candidates = [os.path.join(directory, f"{name}{ext}") for ext in IMAGE_EXTENSIONS]
+
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class ImageStimulusCache:
+    """
+    Bounded LRU cache of decoded, scaled stimulus images.
+
+    Entries are keyed by absolute path, modification time, file size and
+    target size, so an edited stimulus file is decoded again automatically.
+
+    Attributes:
+        max_items (int): Maximum number of decoded images kept in memory.
+        cache_dir (str or None): Directory for the persistent cache of scaled
+            images, or None to disable it.
+        hits (int): Number of in-memory cache hits.
+        disk_hits (int): Number of images loaded from the persistent cache.
+        misses (int): Number of images decoded from the original file.
+    """
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS, cache_dir=DEFAULT_CACHE_DIR):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, path, size):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, tuple(size) if size else None)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.png")
+
+    def _decode(self, path, size):
+        image = Image.open(path)
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        if size:
+            image = ImageOps.contain(image, tuple(size), method=Image.Resampling.LANCZOS)
+        return image
+
+    def get(self, path, size=None):
+        """
+        Return the decoded image for a file, scaled to fit ``size``.
+
+        Args:
+            path (str): Path of the image file.
+            size (tuple, optional): (width, height) to fit the image into while
+                preserving its aspect ratio. None keeps the original size.
+
+        Returns:
+            PIL.Image.Image: Decoded image, fully loaded into memory.
+        """
+        key = self._key(path, size)
+
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image
+
+        image = None
+        disk_path = self._disk_path(key) if self.cache_dir else None
+        if disk_path is not None and os.path.exists(disk_path):
+            try:
+                image = Image.open(disk_path)
+                image.load()
+                self.disk_hits += 1
+            except Exception as e:
+                print(f"Image Stimulus Cache: WARNING: Ignoring unreadable cache file {disk_path}: {e}")
+                image = None
+
+        if image is None:
+            image = self._decode(path, size)
+            self.misses += 1
+            if disk_path is not None:
+                try:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    image.save(disk_path, format="PNG", compress_level=1)
+                except Exception as e:
+                    print(f"Image Stimulus Cache: WARNING: Could not write cache file {disk_path}: {e}")
+
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_items:
+                self._images.popitem(last=False)
+
+        return image
+
+    def preload(self, paths, size=None):
+        """
+        Decode every image of a sequence ahead of presentation.
+
+        Args:
+            paths (list): Image paths; duplicates are decoded once.
+            size (tuple, optional): Target (width, height), see :meth:`get`.
+
+        Returns:
+            dict: Mapping of path to decoded ``PIL.Image.Image``.
+        """
+        images = {}
+        for path in paths:
+            if path not in images:
+                images[path] = self.get(path, size)
+        return images
+
+    def clear(self):
+        """Drop all in-memory entries. The persistent cache is left untouched."""
+        with self._lock:
+            self._images.clear()
@@ -0,0 +1,76 @@
+"""
+Synchronized Session Start
+
+Starts the EEG recording, the camera recording and a stimulus run at one
+scheduled time instead of three separate clicks:
+
+1. The control application picks a start time ``SYNC_START_LEAD`` seconds
+   ahead on the LSL clock, which every process on the machine shares.
+2. Every component is armed with that time in advance: the EEG recorder
+   keeps only samples from the start time on, the camera opens its video
+   writer and writes only frames captured from the start time on, and the
+   stimulus program prepares its run and schedules its first onset at the
+   start time.
+3. Shortly after the start, the first timestamp of every modality is
+   collected and :func:`skew_report` gives each one's offset from the
+   scheduled start and the residual skew between them.
+
+An offset of up to one sample or frame period is expected: the first
+sample at or after the start time is kept. Components armed after the
+start time are reported as late.
+"""
+
+import json
+import os
+
+SYNC_START_LEAD = 2.0  # seconds between the start request and the scheduled start
+SYNC_SETTLE = 1.0  # seconds after the start until the first timestamps are collected
+SYNC_REPORT_NAME = "session_start.json"
+
+
+def skew_report(start_at, components):
+    """
+    Summarize how closely each modality started at the scheduled time.
+
+    Args:
+        start_at (float): Scheduled start on the LSL clock.
+        components (dict): Component name -> dict with ``armed`` (LSL time
+            the component confirmed it was armed), ``first`` (LSL time of its
+            first sample, frame or onset, None if there is none yet) and
+            optionally ``period`` (nominal sample or frame period in seconds).
+
+    Returns:
+        dict: ``start_at``, per-component ``offset_ms`` (first timestamp minus
+        the scheduled start), ``period_ms``, ``armed_lead_ms`` (time left
+        before the start when armed) and ``late``, the ``skew_ms`` between
+        the earliest and the latest started modality, and the ``late`` and
+        ``missing`` component names.
+    """
+    report = {'start_at': start_at, 'components': {}, 'skew_ms': None, 'late': [], 'missing': []}
+    offsets = []
+    for name, component in components.items():
+        armed, first, period = component.get('armed'), component.get('first'), component.get('period')
+        entry = {
+            'offset_ms': (first - start_at) * 1000.0 if first is not None else None,
+            'period_ms': period * 1000.0 if period else None,
+            'armed_lead_ms': (start_at - armed) * 1000.0 if armed is not None else None,
+            'late': armed is None or armed > start_at
+        }
+        report['components'][name] = entry
+        if entry['late']:
+            report['late'].append(name)
+        if first is None:
+            report['missing'].append(name)
+        else:
+            offsets.append(entry['offset_ms'])
+    if offsets:
+        report['skew_ms'] = max(offsets) - min(offsets)
+    return report
+
+
+def write_skew_report(session_path, report):
+    """Write a :func:`skew_report` to the session directory and return its path."""
+    path = os.path.join(session_path, SYNC_REPORT_NAME)
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=4)
+    return path
@@ -0,0 +1,269 @@
+"""
+Long-Lived VLC Player for Video Stimuli
+
+Wraps a single ``vlc.Instance`` and media player that are created once per
+run and reused for every video, instead of creating and releasing a new
+instance per file. The media of the next video is created and parsed in the
+background while the current one plays, so a transition only pays for
+starting the decoder.
+
+Playback is tracked through VLC's event manager rather than by polling the
+player state. The callbacks run in libVLC threads and only record
+timestamps on the project clock (:mod:`website.clock`, the LSL clock of
+the EEG samples), so each video's timeline holds the moment the first
+frame was presented, the moment playback ended, and periodic media-time
+samples that map video time to the EEG clock.
+
+Key Features:
+- One VLC instance and media player per run, bound to the stimulus window
+- Asynchronous pre-parsing of the next video
+- First-frame, end and error times from player events
+- Media time to LSL clock samples with a linear fit per video
+"""
+
+import os
+import platform
+import threading
+
+import vlc
+
+from website import clock
+
+VLC_ARGS = ('--quiet', '--no-video-title-show', '--no-osd', '--no-snapshot-preview')
+TIME_SAMPLE_INTERVAL = 0.25  # minimum seconds between recorded media-time samples
+
+
+def fit_media_clock(time_samples):
+    """
+    Fit ``lsl_timestamp = intercept + slope * media_time`` to media-time samples.
+
+    Args:
+        time_samples (list): ``[media_time_s, lsl_timestamp]`` pairs.
+
+    Returns:
+        dict or None: ``slope``, ``intercept`` and ``max_residual_ms``, or
+        None if fewer than two distinct media times were sampled.
+    """
+    n = len(time_samples)
+    if n < 2:
+        return None
+    xs = [sample[0] for sample in time_samples]
+    ys = [sample[1] for sample in time_samples]
+    x_mean = sum(xs) / n
+    y_mean = sum(ys) / n
+    var = sum((x - x_mean) ** 2 for x in xs)
+    if var == 0:
+        return None
+    slope = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) / var
+    intercept = y_mean - slope * x_mean
+    max_residual = max(abs(y - (intercept + slope * x)) for x, y in zip(xs, ys))
+    return {'slope': slope, 'intercept': intercept, 'max_residual_ms': max_residual * 1000}
+
+
+class VideoPlayer:
+    """
+    Reusable VLC media player rendering into a Tkinter widget.
+
+    Attributes:
+        instance (vlc.Instance): libVLC instance shared by all videos of the run.
+        player (vlc.MediaPlayer): Media player reused for every video.
+        preloaded (dict): Pre-parsed ``vlc.Media`` per video path.
+        transitions (list): One playback record per started video with
+            ``file``, ``preloaded``, LSL clock times ``requested``,
+            ``playing``, ``first_frame`` and ``end``, ``error``,
+            ``start_latency_ms`` (request to first frame), ``gap_ms``
+            (previous end to request) and ``time_samples``.
+        last_end (float or None): LSL clock time when the previous video ended.
+    """
+    def __init__(self, window_id, vlc_args=VLC_ARGS):
+        self.instance = vlc.Instance(*vlc_args)
+        self.player = self.instance.media_player_new()
+        self.preloaded = {}
+        self.transitions = []
+        self.last_end = None
+        self._current = None
+        self._started = threading.Event()
+        self._finished = threading.Event()
+
+        # Render into the stimulus window
+        system = platform.system()
+        if system == "Windows":
+            self.player.set_hwnd(window_id)
+        elif system == "Darwin":
+            self.player.set_nsobject(window_id)
+        else:
+            self.player.set_xwindow(window_id)
+
+        events = self.player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerPlaying, self._on_playing)
+        events.event_attach(vlc.EventType.MediaPlayerVout, self._on_vout)
+        events.event_attach(vlc.EventType.MediaPlayerTimeChanged, self._on_time_changed)
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self._on_end)
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError, self._on_error)
+
+    # Event callbacks run in libVLC threads and must not call back into the
+    # player, so they only record timestamps and set events.
+
+    def _on_playing(self, event):
+        record = self._current
+        if record is not None and record['playing'] is None:
+            record['playing'] = clock.now()
+
+    def _on_vout(self, event):
+        record = self._current
+        if record is not None and record['first_frame'] is None and event.u.new_count > 0:
+            record['first_frame'] = clock.now()
+            self._started.set()
+
+    def _on_time_changed(self, event):
+        record = self._current
+        if record is None:
+            return
+        now = clock.now()
+        samples = record['time_samples']
+        if not samples or now - samples[-1][1] >= TIME_SAMPLE_INTERVAL:
+            samples.append([event.u.new_time / 1000.0, now])
+
+    def _on_end(self, event):
+        record = self._current
+        if record is not None and record['end'] is None:
+            record['end'] = clock.now()
+        self._started.set()
+        self._finished.set()
+
+    def _on_error(self, event):
+        record = self._current
+        if record is not None:
+            record['error'] = True
+            if record['end'] is None:
+                record['end'] = clock.now()
+        self._started.set()
+        self._finished.set()
+
+    def preload(self, video_path):
+        """
+        Create the media for a video and start parsing it in the background.
+
+        Args:
+            video_path (str): Path of the video to play next.
+        """
+        if video_path in self.preloaded or not os.path.exists(video_path):
+            return
+        media = self.instance.media_new(video_path)
+        media.parse_with_options(vlc.MediaParseFlag.local, -1)
+        self.preloaded[video_path] = media
+
+    def play(self, video_path, timeout=5.0):
+        """
+        Start a video and wait until its first frame is presented, i.e.
+        until VLC reports a video output.
+
+        Args:
+            video_path (str): Path of the video.
+            timeout (float): Seconds to wait for the first frame.
+
+        Returns:
+            dict or None: The video's playback record, or None if it did not
+            start (error, immediate end or timeout).
+        """
+        media = self.preloaded.pop(video_path, None)
+        preloaded = media is not None
+        if media is None:
+            media = self.instance.media_new(video_path)
+
+        record = {
+            'file': video_path,
+            'preloaded': preloaded,
+            'requested': clock.now(),
+            'playing': None,
+            'first_frame': None,
+            'end': None,
+            'error': False,
+            'start_latency_ms': None,
+            'gap_ms': None,
+            'time_samples': []
+        }
+        if self.last_end is not None:
+            record['gap_ms'] = (record['requested'] - self.last_end) * 1000
+        self._started.clear()
+        self._finished.clear()
+        self._current = record
+        self.transitions.append(record)
+
+        self.player.set_media(media)
+        media.release()  # the player holds its own reference
+        self.player.play()
+
+        self._started.wait(timeout)
+        if record['first_frame'] is None and record['time_samples'] and not record['error']:
+            # Media without a video track never creates a vout; its start is
+            # the first advance of the media time
+            record['first_frame'] = record['time_samples'][0][1]
+        if record['first_frame'] is None:
+            return None
+        record['start_latency_ms'] = (record['first_frame'] - record['requested']) * 1000
+        return record
+
+    def wait_finished(self, timeout=None):
+        """
+        Wait until the current video ends or fails.
+
+        Args:
+            timeout (float, optional): Seconds to wait, None waits forever.
+
+        Returns:
+            bool: True if the video has ended or failed.
+        """
+        return self._finished.wait(timeout)
+
+    def stop(self):
+        """Stop the current video and record its end time if it was cut short."""
+        record = self._current
+        self._current = None
+        self.player.stop()
+        if record is not None and record['end'] is None:
+            record['end'] = clock.now()
+        if record is not None:
+            self.last_end = record['end']
+
+    def transition_report(self):
+        """
+        Summarize the recorded transitions.
+
+        Returns:
+            dict: ``videos``, ``mean_start_latency_ms``, ``max_start_latency_ms``,
+            ``std_start_latency_ms`` and the per-video ``transitions``, each
+            with a ``media_clock`` fit of the LSL clock over media time.
+        """
+        latencies = [t['start_latency_ms'] for t in self.transitions if t['start_latency_ms'] is not None]
+        n = len(latencies)
+        report = {
+            'videos': len(self.transitions),
+            'mean_start_latency_ms': None,
+            'max_start_latency_ms': None,
+            'std_start_latency_ms': None
+        }
+        if n:
+            mean = sum(latencies) / n
+            report['mean_start_latency_ms'] = mean
+            report['max_start_latency_ms'] = max(latencies)
+            report['std_start_latency_ms'] = (sum((x - mean) ** 2 for x in latencies) / n) ** 0.5
+        for record in self.transitions:
+            record['media_clock'] = fit_media_clock(record['time_samples'])
+        report['transitions'] = self.transitions
+        return report
+
+    def release(self):
+        """Detach the event callbacks and release the player, unused media and instance."""
+        self._current = None
+        events = self.player.event_manager()
+        for event_type in (vlc.EventType.MediaPlayerPlaying, vlc.EventType.MediaPlayerVout,
+                           vlc.EventType.MediaPlayerTimeChanged, vlc.EventType.MediaPlayerEndReached,
+                           vlc.EventType.MediaPlayerEncounteredError):
+            events.event_detach(event_type)
+        self.player.stop()
+        for media in self.preloaded.values():
+            media.release()
+        self.preloaded = {}
+        self.player.release()
+        self.instance.release()